@@ -0,0 +1,300 @@
+"""
+Benchmarks of the simulator with fixed seeds, so runs before and after a change play exactly the same cards and hands.
+
+    microbenchmarks: ShoeFactory.get_shoe, Strategy.determine_player_action, BlackjackHand.add_card and the bonus
+                     payers' get_payout, in operations/sec
+    end to end:      hands/sec of each simulation in the sample config, with every available engine
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks                    run, write benchmarks/results.json, compare with the baseline
+    python -m benchmarks.run_benchmarks --save-baseline    run and store the results as the new baseline
+    python -m benchmarks.run_benchmarks --only micro --tolerance 0.2
+
+Each benchmark's rate is the best of --repeat runs. A benchmark regresses when its rate is more than --tolerance
+(a fraction) below the baseline's; the exit status is 1 if any did. Rates depend on the machine, so compare against a
+baseline saved on the same machine.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from blackjack_sim.rng import RandomStream
+from blackjack_sim.game_models import ShoeFactory, BlackjackHand, BlackjackPlayer
+from blackjack_sim.strategy import Strategy, DealerStrategy
+from blackjack_sim.bonuses import TwentyOne3BonusPayer, BustBonusPayer
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.simulation import Simulation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIM_CONFIG_FILE_PATH = os.path.join(ROOT_PATH, 'blackjack_sim', 'config', 'simulation_config.json')
+STRATEGY_CONFIG_FILE_PATH = os.path.join(ROOT_PATH, 'blackjack_sim', 'config', 'basic_strategy.json')
+
+BASELINE_FILE_PATH = os.path.join(ROOT_PATH, 'benchmarks', 'baseline.json')
+RESULTS_FILE_PATH = os.path.join(ROOT_PATH, 'benchmarks', 'results.json')
+
+VERSION = 1
+
+SEED = 20240101
+
+NUM_DECKS = 6
+NUM_MICRO_INPUTS = 10000  # hands (or shoes) each microbenchmark run goes through
+
+MIN_MICRO_TIME = 0.2  # seconds
+
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.15
+
+# Hands each simulation of the sample config is run for; the batch engine needs more to play a few rounds per table
+END_TO_END_HANDS = {'object': 20000, 'batch': 200000}
+
+
+# Seeded stream of card codes from shuffled shoes
+def get_cards(num_cards):
+    factory = ShoeFactory(NUM_DECKS, rng=RandomStream.create(seed=SEED))
+
+    cards = []
+    while len(cards) < num_cards:
+        cards.extend(factory.get_shoe())
+
+    return cards[:num_cards]
+
+
+def get_hand(cards, player=None, dealer_hand=False, stop_at_21=False):
+    hand = BlackjackHand(player=player, dealer_hand=dealer_hand)
+    for card in cards:
+        if stop_at_21 and hand.hard_value >= 21:
+            break
+
+        hand.add_card(card)
+
+    return hand
+
+
+# Each microbenchmark returns (function that runs the ops, # of ops it runs); inputs are built before timing
+def bench_get_shoe():
+    factory = ShoeFactory(NUM_DECKS, rng=RandomStream.create(seed=SEED))
+    num_shoes = NUM_MICRO_INPUTS // 100
+
+    def run():
+        for s in range(num_shoes):
+            factory.get_shoe()
+
+    return run, num_shoes
+
+
+# First decisions; the player decides whether splitting is allowed
+def bench_determine_player_action():
+    strategy = Strategy(load_json_file(STRATEGY_CONFIG_FILE_PATH))
+    player = BlackjackPlayer(0)
+    cards = get_cards(3 * NUM_MICRO_INPUTS)
+    inputs = [(cards[3 * i], get_hand(cards[3 * i + 1:3 * i + 3], player=player)) for i in range(NUM_MICRO_INPUTS)]
+
+    def run():
+        for dealer_up_card, player_hand in inputs:
+            strategy.determine_player_action(dealer_up_card, player_hand)
+
+    return run, len(inputs)
+
+
+# Adds the cards of a hit hand (up to 3, stopping at 21 like play does) to an emptied hand; the reset is part of the ops
+def bench_add_card():
+    hand = BlackjackHand(player=None, dealer_hand=False)
+    cards = get_cards(3 * NUM_MICRO_INPUTS)
+    inputs = [get_hand(cards[3 * i:3 * i + 3], stop_at_21=True).cards for i in range(NUM_MICRO_INPUTS)]
+
+    def run():
+        for hand_cards in inputs:
+            hand.reset(player=None, dealer_hand=False)
+            for card in hand_cards:
+                hand.add_card(card)
+
+    return run, sum(len(hand_cards) for hand_cards in inputs)
+
+
+def bench_21_3_get_payout():
+    payer = TwentyOne3BonusPayer()
+    cards = get_cards(3 * NUM_MICRO_INPUTS)
+    inputs = [(cards[3 * i], get_hand(cards[3 * i + 1:3 * i + 3])) for i in range(NUM_MICRO_INPUTS)]
+
+    def run():
+        for dealer_up_card, player_hand in inputs:
+            payer.get_payout(dealer_up_card=dealer_up_card, player_hand=player_hand, bonus_bet=1)
+
+    return run, len(inputs)
+
+
+# Dealer hands played out from the seeded cards, so about as many bust as at the table
+def bench_bust_get_payout():
+    payer = BustBonusPayer()
+    dealer_strategy = DealerStrategy()
+    cards = iter(get_cards(10 * NUM_MICRO_INPUTS))
+
+    inputs = []
+    for i in range(NUM_MICRO_INPUTS):
+        dealer_hand = get_hand([next(cards), next(cards)], dealer_hand=True)
+        while dealer_strategy.determine_dealer_action_code(dealer_hand) == Strategy.HIT:
+            dealer_hand.add_card(next(cards))
+
+        inputs.append(dealer_hand)
+
+    def run():
+        for dealer_hand in inputs:
+            payer.get_payout(dealer_hand=dealer_hand, bonus_bet=1)
+
+    return run, len(inputs)
+
+
+MICRO_BENCHMARKS = {
+    'ShoeFactory.get_shoe': bench_get_shoe,
+    'Strategy.determine_player_action': bench_determine_player_action,
+    'BlackjackHand.add_card': bench_add_card,
+    'TwentyOne3BonusPayer.get_payout': bench_21_3_get_payout,
+    'BustBonusPayer.get_payout': bench_bust_get_payout
+}
+
+
+# Like timeit's autorange, each timed run calls the benchmark enough times to take at least MIN_MICRO_TIME, so timer
+# resolution and scheduling noise don't matter
+def run_micro_benchmark(name, repeat):
+    run, num_ops = MICRO_BENCHMARKS[name]()
+
+    num_loops = 1
+    while time_call(run, num_loops) < MIN_MICRO_TIME:
+        num_loops *= 2
+
+    num_ops *= num_loops
+    best_time = min(time_call(run, num_loops) for r in range(repeat))
+
+    return {'kind': 'micro', 'unit': 'ops/sec', 'rate': num_ops / best_time, 'us_per_op': best_time / num_ops * 1e6, 'ops': num_ops}
+
+
+def time_call(func, num_loops=1):
+    start_time = time.perf_counter()
+    for loop in range(num_loops):
+        func()
+
+    return time.perf_counter() - start_time
+
+
+# One simulation of the sample config on one engine, on a single worker
+def run_end_to_end_benchmark(sim_config, engine, repeat):
+    strategy = Strategy(load_json_file(os.path.join(ROOT_PATH, sim_config['strategy_config_file'])))
+    sim_config = dict(sim_config, seed=SEED, engine=engine, num_sessions=1, max_session_hands=END_TO_END_HANDS[engine], workers=1, verbose=0)
+
+    best_time = None
+    for r in range(repeat):
+        sim = Simulation(0, sim_config, strategy)
+        sim.log.setLevel(logging.WARNING)
+
+        run_time = time_call(sim.run)
+        best_time = run_time if best_time is None else min(best_time, run_time)
+
+    return {'kind': 'end_to_end', 'unit': 'hands/sec', 'rate': sim.num_hands_played / best_time, 'us_per_op': best_time / sim.num_hands_played * 1e6,
+            'ops': sim.num_hands_played}
+
+
+def run_benchmarks(only=None, repeat=DEFAULT_REPEAT, log=print):
+    benchmarks = {}
+
+    if only in [None, 'micro']:
+        for name in MICRO_BENCHMARKS:
+            benchmarks[name] = run_micro_benchmark(name, repeat)
+            log(format_result(name, benchmarks[name]))
+
+    if only in [None, 'end_to_end']:
+        engines = ['object', 'batch'] if BatchTables.AVAILABLE else ['object']
+
+        for sim_config in load_json_file(SIM_CONFIG_FILE_PATH):
+            for engine in engines:
+                name = f'{sim_config["name"]} [{engine}]'
+                benchmarks[name] = run_end_to_end_benchmark(sim_config, engine, repeat)
+                log(format_result(name, benchmarks[name]))
+
+    return {
+        'version': VERSION,
+        'seed': SEED,
+        'python': platform.python_version(),
+        'numpy': np.__version__ if np is not None else None,
+        'machine': platform.machine(),
+        'benchmarks': benchmarks
+    }
+
+
+def format_result(name, result):
+    return f'{name}: {result["rate"]:,.0f} {result["unit"]} ({result["us_per_op"]:0.3f} µs per op)'
+
+
+# Key = benchmark name, value = (change of the rate vs the baseline as a fraction, regressed) for the benchmarks in both
+def compare_results(results, baseline, tolerance):
+    comparison = {}
+    for name, result in results['benchmarks'].items():
+        if name in baseline['benchmarks']:
+            change = result['rate'] / baseline['benchmarks'][name]['rate'] - 1
+            comparison[name] = (change, change < -tolerance)
+
+    return comparison
+
+
+def load_json_file(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_json_file(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the simulator benchmarks and compare them with a baseline')
+    parser.add_argument('--only', choices=['micro', 'end_to_end'], default=None, help='only run one kind of benchmark')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of each benchmark; the best one counts')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed slowdown vs the baseline, as a fraction')
+    parser.add_argument('--baseline', default=BASELINE_FILE_PATH, help='baseline results (JSON)')
+    parser.add_argument('--output', default=RESULTS_FILE_PATH, help='where to write the results (JSON)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline instead of comparing with it')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = run_benchmarks(only=args.only, repeat=args.repeat)
+    save_json_file(args.output, results)
+    print(f'Results written to {args.output}')
+
+    if args.save_baseline:
+        save_json_file(args.baseline, results)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline to store one')
+        return 0
+
+    comparison = compare_results(results, load_json_file(args.baseline), args.tolerance)
+
+    for name, (change, regressed) in comparison.items():
+        print(f'{"REGRESSED" if regressed else "ok"}: {name}: {change:+.1%} vs baseline')
+
+    num_regressed = sum(regressed for change, regressed in comparison.values())
+    print(f'{num_regressed} of {len(comparison)} benchmarks regressed by more than {args.tolerance:.0%}')
+
+    return 1 if num_regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,99 @@
-import sys
+import argparse
+import cProfile
+import io
 import logging
+import pstats
 from blackjack_sim.simulation import SimulationManager
+from blackjack_sim.differential import DifferentialHarness
+from blackjack_sim.rng import RandomStream
 from blackjack_sim.utils import Utils
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run blackjack simulations')
+    parser.add_argument('sim_config_file_path', nargs='?', default=None, help='simulation config file (JSON)')
+    parser.add_argument('--workers', type=int, default=None, help='# of worker processes per simulation; overrides the config')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for every simulation; overrides the config')
+    parser.add_argument('--rng', choices=RandomStream.BACKENDS, default=None, help='random number generator backend; overrides the config')
+    # Each of these runs something other than the simulations
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--exact', action='store_true', help='compute the exact bonus bet odds instead of simulating')
+    modes.add_argument('--sample', type=int, default=None, metavar='ROUNDS',
+                       help='estimate the bonus bet odds by importance sampling the cards left at the start of ROUNDS rounds of each simulation\'s shoes instead of simulating')
+    modes.add_argument('--replay', default=None, metavar='PATH',
+                       help='re-settle the rounds recorded at PATH (see record_path) with each simulation\'s payouts instead of simulating')
+    modes.add_argument('--what-if', default=None, metavar='PAYOUT_TABLES',
+                       help='EV and house edge of the bonus bets under each payout table in PAYOUT_TABLES (JSON list) from the bonus bet outcome counts')
+    modes.add_argument('--differential', choices=[e for e in DifferentialHarness.ENGINE_CONFIGS if e != DifferentialHarness.REFERENCE_ENGINE], default=None,
+                       metavar='ENGINE', help='play each simulation on the object engine and on ENGINE with the same shoes and report the first '
+                                              'round where they differ instead of simulating')
+    parser.add_argument('--counts', default=None, metavar='COUNTS',
+                        help='with --what-if, use the outcome counts saved in COUNTS (see bonus_counts_path) instead of simulating')
+    parser.add_argument('--checkpoint', default=None, metavar='DIR',
+                        help='checkpoint the simulations to DIR every few seconds (see checkpoint_path); overrides the config')
+    parser.add_argument('--resume', action='store_true', help='with --checkpoint, continue the run that was checkpointed there instead of starting over')
+    parser.add_argument('--phase-timing', action='store_true', help='time each phase of playing rounds and log hands/sec and µs per round')
+    parser.add_argument('--profile', default=None, metavar='PSTATS',
+                        help='profile the run with cProfile, write the stats to PSTATS and log the top functions; only profiles this '
+                             'process, so use --workers 1 to profile the simulations themselves')
+    parser.add_argument('--profile-top', type=int, default=25, metavar='N', help='# of functions in the --profile summary')
+
+    args = parser.parse_args()
+
+    if args.sample is not None and args.sample < 1:
+        parser.error('--sample ROUNDS must be at least 1')
+
+    if args.counts and not args.what_if:
+        parser.error('--counts requires --what-if')
+
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+
+    return args
+
 def run_simulation():
+    args = parse_args()
+
     log = Utils.get_logger('BlackjackSimulator', logging.INFO)
 
     log.info('Running BlackjackSimulator')
 
-    sim_mgr = SimulationManager(sim_config_file_path=sys.argv[1] if len(sys.argv) > 1 else None)
+    if args.profile:
+        run_profiled(args, log)
+    else:
+        run(args)
+
+def run(args):
+    sim_mgr = SimulationManager(sim_config_file_path=args.sim_config_file_path, workers=args.workers, seed=args.seed, rng=args.rng,
+                               checkpoint_path=args.checkpoint, resume=args.resume, phase_timing=args.phase_timing)
+
+    if args.exact:
+        sim_mgr.log_exact_bonus_results()
+    elif args.sample is not None:
+        sim_mgr.log_sampled_bonus_results(args.sample)
+    elif args.replay:
+        sim_mgr.log_replay_results(args.replay)
+    elif args.differential:
+        for sim in sim_mgr.simulations:
+            DifferentialHarness.from_simulation(sim).log_comparison(args.differential)
+    elif args.what_if:
+        sim_mgr.log_what_if_results(args.what_if, counts_path=args.counts)
+    else:
+        sim_mgr.run_simulations()
+
+# Runs under cProfile; the stats are written even if the run is interrupted
+def run_profiled(args, log):
+    profiler = cProfile.Profile()
+
+    try:
+        profiler.runcall(run, args)
+    finally:
+        profiler.dump_stats(args.profile)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(args.profile_top)
 
-    sim_mgr.run_simulations()
+        log.info(f'Profile written to {args.profile}; top {args.profile_top} functions by cumulative time:')
+        log.info(summary.getvalue())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,739 @@
+import weakref
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.strategy import Strategy
+from blackjack_sim.game_models import BlackjackHand, BlackjackPlayer
+from blackjack_sim.bonuses import BonusPlan
+from blackjack_sim.stats import RunningStats, RunningCovariance
+from blackjack_sim.bonus_counts import TwentyOne3OutcomeCounts, BustOutcomeCounts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BatchTables(object):
+
+    """
+    Plays many independent tables in lockstep. Instead of session/player/hand objects, all of the state lives in NumPy
+    arrays with one row per table (shoe cursors, hand totals, ace flags, bets, results) and each step of a round (deal,
+    strategy lookup, hit/double/split, dealer play, settlement) is a masked vector operation over the tables that are
+    at that step.
+
+    The tables share one source of shoe batches (a ShoeFactory or ShoePrefetcher); whenever tables need a new shoe
+    they take the next shoes of the current batch in table order. Each table plays exactly like a Simulation playing
+    the same shoes: the same compiled Strategy and DealerStrategy tables, the same card order for splits, the same
+    bonus payer rules. With a single table the batch engine deals the same shoes as Simulation and gives identical
+    results. The per-player counters are summed over all tables and written into a BlackjackSession by record_session(), so the
+    results are reported by Simulation.log_results as usual. With a recorder (see RoundRecorder) every round is also
+    written out, in the same format as Simulation writes it.
+    """
+
+    AVAILABLE = np is not None
+
+    # Bonus multiplier tables by payer; they only need to be built once per payer, not for every shard
+    _multiplier_cache = weakref.WeakKeyDictionary()
+
+    RECORDED_CARDS = 8  # cards per hand the recorder's card arrays start with
+
+    # Hand results
+    UNDETERMINED = 0
+    WIN = 1
+    PUSH = 2
+    LOSS = 3
+
+    def __init__(self, num_tables, shoe_source, num_decks, num_players, min_bet, split_limit, strategy, dealer_strategy, cut_card_position,
+                 shoe_batch_size, bonus_config=None, bonus_payer_21_3=None, bonus_payer_bust=None, bust_control_variate=None,
+                 blackjack_payout=None, recorder=None, infinite_deck=False, log=None):
+        if np is None:
+            raise ConfigurationError('The batch engine requires NumPy')
+
+        self.num_tables = num_tables
+        self.num_players = num_players
+        self.min_bet = min_bet
+        self.split_limit = split_limit
+        self.cut_card_position = cut_card_position
+        self.shoe_batch_size = shoe_batch_size
+        self.infinite_deck = infinite_deck
+        self.log = log
+        self.blackjack_payout = blackjack_payout if blackjack_payout is not None else BlackjackPlayer.DEFAULT_BLACKJACK_PAYOUT
+
+        # Recording needs every card of every hand, which the hand arrays don't keep; batch result codes -> recorded ones
+        self.recorder = recorder
+        if recorder:
+            self._recorded_results = np.array([0, recorder.WIN, recorder.PUSH, recorder.LOSS], dtype=np.uint8)
+
+        # Card lookup tables indexed by card code
+        self._values = np.array(Card.VALUES, dtype=np.int64)
+        self._ranks = np.array(Card.RANK_INDEXES, dtype=np.int64)
+        self._suits = np.array(Card.SUIT_INDEXES, dtype=np.int64)
+        self._dealer_up_card_idxs = np.array(Card.DEALER_UP_CARD_INDEXES, dtype=np.int64)
+        self._is_ace = self._ranks == Card.ACE_RANK_INDEX
+
+        self._actions = np.array(strategy.actions, dtype=np.int64)
+        self._dealer_actions = np.array(dealer_strategy.actions, dtype=np.int64)
+
+        # A hand can only be split into as many hands as there are cards of its rank in the shoe; an infinite deck has no
+        # such limit, but splitting to that many hands is too unlikely to ever happen
+        self.max_hands = max(split_limit, 1) if split_limit else 4 * num_decks
+
+        # One shoe per table; a cursor past the cut card means the table needs a new shoe
+        self.shoe_source = shoe_source
+        self.shoe_size = num_decks * Card.NUM_CARDS
+        self.shoes = np.zeros((self.num_tables, self.shoe_size), dtype=np.uint8)
+        self.cursors = np.full(self.num_tables, self.shoe_size + 1, dtype=np.int64)
+
+        # With an infinite deck (see InfiniteShoeFactory) a table's shoe is just its next chunk of cards; a table moves
+        # on to the next chunk only when it has dealt every card, like InfiniteShoe
+        if self.infinite_deck:
+            self.cut_card_position = self.shoe_size
+
+        # Shuffled shoes waiting to be played
+        self.shoe_batch = []
+        self.shoe_batch_idx = 0
+
+        self.num_hands_played = 0
+        self.num_shoes_used = 0
+
+        # Per-player counters, summed over all tables
+        self.num_wins = np.zeros(num_players, dtype=np.int64)
+        self.num_pushes = np.zeros(num_players, dtype=np.int64)
+        self.num_losses = np.zeros(num_players, dtype=np.int64)
+        self.num_blackjack_wins = np.zeros(num_players, dtype=np.int64)
+        self.net_change = np.zeros(num_players, dtype=np.float64)
+        self.num_split_hands = np.zeros((num_players, self.max_hands + 1), dtype=np.int64)
+
+        # Net change of each player's stack per round, and of each bonus bet; see BlackjackPlayer.round_stats
+        self.round_stats = [RunningStats() for p in range(num_players)]
+
+        # Bonus bets; every player has the same plans, so bet amounts only need to be looked up once. Like
+        # BlackjackPlayer, only the first plan of each bonus bet changes the players' stacks. Amounts, multipliers and
+        # the nets made from them keep NumPy's type for the values (ints unless any of them isn't), so they add up
+        # exactly like the object engine's Python numbers.
+        plan_configs_21_3 = BonusPlan.get_configs(bonus_config['21_3']) if bonus_config and '21_3' in bonus_config else []
+        plans = [BonusPlan(c) for c in plan_configs_21_3]
+        self._plays_21_3 = np.array([plan.will_play_bonus_bet() for plan in plans], dtype=bool)
+        self._bets_21_3 = np.array([plan.get_bet_amount() or 0 for plan in plans])
+        if plans:
+            self._mx_21_3 = self._get_multipliers(bonus_payer_21_3, self._get_21_3_multipliers)
+
+        # Bust bets are indexed by [plan, dealer up card rank index]
+        plan_configs_bust = BonusPlan.get_configs(bonus_config['bust']) if bonus_config and 'bust' in bonus_config else []
+        plans = [BonusPlan(c) for c in plan_configs_bust]
+        up_cards = [Card(Card.CARD_SUITS[0], rank) for rank in Card.CARD_RANKS]
+        self._plays_bust = np.zeros((len(plans), Card.NUM_RANKS), dtype=bool)
+        for plan_idx, plan in enumerate(plans):
+            self._plays_bust[plan_idx] = [plan.will_play_bonus_bet(dealer_up_card=c) for c in up_cards]
+        self._bets_bust = np.array([[plan.get_bet_amount(dealer_up_card=c) or 0 for c in up_cards] for plan in plans]).reshape((len(plans), Card.NUM_RANKS))
+        if plans:
+            self._mx_bust = self._get_multipliers(bonus_payer_bust, self._get_bust_multipliers)
+
+        # Net amounts and control variates of the bust plans that estimate with them: [plan][player], None otherwise
+        self.bust_control_variate = bust_control_variate
+        self.bonus_bust_control_stats = [
+            [RunningCovariance(1 + bust_control_variate.NUM_CONTROLS) for p in range(num_players)]
+            if bust_control_variate and plan.control_variate else None for plan in plans
+        ]
+
+        # Bonus counters: [plan, player] -> wins, losses, net
+        self.bonus_21_3_results = np.zeros((len(plan_configs_21_3), num_players, 3),
+                                           dtype=np.result_type(self._bets_21_3, self._mx_21_3) if plan_configs_21_3 else np.int64)
+        self.bonus_bust_results = np.zeros((len(plan_configs_bust), num_players, 3),
+                                           dtype=np.result_type(self._bets_bust, self._mx_bust) if plan_configs_bust else np.int64)
+        self.bonus_21_3_stats = [[RunningStats() for p in range(num_players)] for plan_config in plan_configs_21_3]
+        self.bonus_bust_stats = [[RunningStats() for p in range(num_players)] for plan_config in plan_configs_bust]
+
+        # Payout classes of every hand / round each bonus bet could be settled on, for what-ifs
+        self.bonus_counts_21_3 = TwentyOne3OutcomeCounts() if bonus_payer_21_3 else None
+        self.bonus_counts_bust = BustOutcomeCounts() if bonus_payer_bust else None
+
+    @classmethod
+    def _get_multipliers(cls, payer, build):
+        if payer not in cls._multiplier_cache:
+            cls._multiplier_cache[payer] = build(payer)
+
+        return cls._multiplier_cache[payer]
+
+    # 21+3 multipliers indexed by [up card rank, 1st card rank, 2nd card rank, flush]; filled in by asking the payer
+    # about one representative hand for each, so the payout rules stay in TwentyOne3BonusPayer. Filled in as Python
+    # numbers, so the table is ints unless a payout isn't.
+    @staticmethod
+    def _get_21_3_multipliers(payer):
+        mx = np.zeros((Card.NUM_RANKS, Card.NUM_RANKS, Card.NUM_RANKS, 2), dtype=object)
+
+        for up_rank in range(Card.NUM_RANKS):
+            for rank_1 in range(Card.NUM_RANKS):
+                for rank_2 in range(Card.NUM_RANKS):
+                    for is_flush in [0, 1]:
+                        suits = Card.CARD_SUITS[:1] * 3 if is_flush else Card.CARD_SUITS[:3]
+                        cards = [Card(suit, Card.CARD_RANKS[rank]) for suit, rank in zip(suits, [up_rank, rank_1, rank_2])]
+
+                        player_hand = BlackjackHand(player=None, dealer_hand=False)
+                        player_hand.add_card(cards[1])
+                        player_hand.add_card(cards[2])
+
+                        mx[up_rank, rank_1, rank_2, is_flush] = payer.get_payout(dealer_up_card=cards[0], player_hand=player_hand, bonus_bet=1)
+
+        return np.array(mx.tolist())
+
+    # Bust multipliers indexed by [up card rank, suited, 888]; filled in from representative busted dealer hands, as
+    # Python numbers like the 21+3 ones
+    @staticmethod
+    def _get_bust_multipliers(payer):
+        mx = np.zeros((Card.NUM_RANKS, 2, 2), dtype=object)
+
+        for up_rank in Card.CARD_RANKS:
+            for is_suited in [0, 1]:
+                for is_888 in [0, 1]:
+                    if is_888 and up_rank != '8':
+                        continue
+
+                    if is_888:
+                        ranks = ['8', '8', '8']
+                    elif up_rank == 'A':
+                        ranks = ['A', '5', 'T', 'T']
+                    else:
+                        ranks = [up_rank, 'T', 'T']
+
+                    suits = [Card.CARD_SUITS[0]] + [Card.CARD_SUITS[0 if is_suited else 1]] * (len(ranks) - 1)
+
+                    dealer_hand = BlackjackHand(player=None, dealer_hand=True)
+                    for suit, rank in zip(suits, ranks):
+                        dealer_hand.add_card(Card(suit, rank))
+
+                    mx[Card.CARD_RANKS.index(up_rank), is_suited, is_888] = payer.get_payout(dealer_hand=dealer_hand, bonus_bet=1)
+
+        return np.array(mx.tolist())
+
+    # Plays num_rounds[t] rounds at table t, starting from round first_round (e.g. of tables restored by set_state).
+    # checkpoint(r) is called after every round with the # of rounds played so far, if given.
+    def play(self, num_rounds, first_round=0, checkpoint=None):
+        num_rounds = np.asarray(num_rounds)
+
+        for r in range(first_round, int(num_rounds.max(initial=0))):
+            self.play_round(np.flatnonzero(num_rounds > r))
+
+            if checkpoint:
+                checkpoint(r + 1)
+
+    # Everything that carries over from one round to the next, for checkpoints; only the shoes left in the batch are kept
+    def get_state(self):
+        return {
+            'shoes': self.shoes,
+            'cursors': self.cursors,
+            'shoe_batch': self.shoe_batch[self.shoe_batch_idx:],
+            'num_hands_played': self.num_hands_played,
+            'num_shoes_used': self.num_shoes_used,
+            'num_wins': self.num_wins,
+            'num_pushes': self.num_pushes,
+            'num_losses': self.num_losses,
+            'num_blackjack_wins': self.num_blackjack_wins,
+            'net_change': self.net_change,
+            'num_split_hands': self.num_split_hands,
+            'round_stats': self.round_stats,
+            'bonus_21_3_results': self.bonus_21_3_results,
+            'bonus_bust_results': self.bonus_bust_results,
+            'bonus_21_3_stats': self.bonus_21_3_stats,
+            'bonus_bust_stats': self.bonus_bust_stats,
+            'bonus_bust_control_stats': self.bonus_bust_control_stats,
+            'bonus_counts_21_3': self.bonus_counts_21_3,
+            'bonus_counts_bust': self.bonus_counts_bust,
+            'recorder': self.recorder
+        }
+
+    # Restores tables created with the same settings to a state from get_state
+    def set_state(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+        self.shoe_batch_idx = 0
+
+    def new_shoe(self, table):
+        # Refill the batch when it runs out
+        if self.shoe_batch_idx >= len(self.shoe_batch):
+            self.shoe_batch = self.shoe_source.get_shoe_batch(self.shoe_batch_size)
+            self.shoe_batch_idx = 0
+
+        self.shoes[table] = self.shoe_batch[self.shoe_batch_idx]
+        self.shoe_batch_idx += 1
+
+        if self.infinite_deck:
+            self.cursors[table] = 0
+            return
+
+        self.num_shoes_used += 1
+
+        # Burn card
+        self.cursors[table] = 1
+
+    # Deals the next card at each of the tables
+    def draw(self, tables):
+        for table in tables[self.cursors[tables] >= self.shoe_size]:
+            if self.log and not self.infinite_deck:
+                self.log.warning('WARNING: Tried to get card from empty shoe')
+
+            self.new_shoe(table)
+
+        cards = self.shoes[tables, self.cursors[tables]]
+        self.cursors[tables] += 1
+
+        return cards
+
+    # Deals 2 rounds of cards at each of the tables; 1 card to each player and then the dealer per round. Returns the
+    # cards in deal order, [table row, card].
+    def deal_initial_cards(self, tables):
+        num_cards = 2 * (self.num_players + 1)
+
+        if np.all(self.shoe_size - self.cursors[tables] >= num_cards):
+            cards = self.shoes[tables[:, None], self.cursors[tables][:, None] + np.arange(num_cards)]
+            self.cursors[tables] += num_cards
+        else:
+            cards = np.stack([self.draw(tables) for c in range(num_cards)], axis=1)
+
+        return cards.astype(np.int64)
+
+    def play_round(self, tables):
+        num_tables = len(tables)
+        num_players = self.num_players
+        rows = np.arange(num_tables)
+
+        self.num_hands_played += num_tables
+
+        # Check if we need new shoes
+        for table in tables[self.cursors[tables] > self.cut_card_position]:
+            self.new_shoe(table)
+
+        cards = self.deal_initial_cards(tables)
+        player_cards_1 = cards[:, :num_players]
+        player_cards_2 = cards[:, num_players + 1:2 * num_players + 1]
+        up_cards = cards[:, num_players]
+        hole_cards = cards[:, 2 * num_players + 1]
+
+        # Player hands: [table row, player, hand]; split hands are added after the starting hand
+        shape = (num_tables, num_players, self.max_hands)
+        self.hard = np.zeros(shape, dtype=np.int64)
+        self.has_ace = np.zeros(shape, dtype=bool)
+        self.num_cards = np.zeros(shape, dtype=np.int64)
+        self.first_cards = np.zeros(shape + (2,), dtype=np.int64)
+        self.bets = np.zeros(shape, dtype=np.float64)
+        self.results = np.zeros(shape, dtype=np.int64)
+        self.num_hands = np.ones((num_tables, num_players), dtype=np.int64)
+
+        self.bets[:, :, 0] = self.min_bet
+        self.first_cards[:, :, 0, 0] = player_cards_1
+        self.first_cards[:, :, 0, 1] = player_cards_2
+        self.num_cards[:, :, 0] = 2
+        self.hard[:, :, 0] = self._values[player_cards_1] + self._values[player_cards_2]
+        self.has_ace[:, :, 0] = self._is_ace[player_cards_1] | self._is_ace[player_cards_2]
+
+        # Dealer hand; suited and eights track whether all of the dealer's cards so far are suited / 8s for the bust bonus
+        self.dealer_up_cards = up_cards
+        self.dealer_hard = self._values[up_cards] + self._values[hole_cards]
+        self.dealer_has_ace = self._is_ace[up_cards] | self._is_ace[hole_cards]
+        self.dealer_num_cards = np.full(num_tables, 2, dtype=np.int64)
+        self.dealer_suited = self._suits[up_cards] == self._suits[hole_cards]
+        self.dealer_eights = (self._values[up_cards] == 8) & (self._values[hole_cards] == 8)
+
+        # All of the cards of each hand, for the recorder: [(table row * # of players + player) * max hands + hand, card]
+        # and [table row, card]; widened when a hand gets more cards than fit. Doubled hands are flagged by the same
+        # flat hand index.
+        if self.recorder:
+            self.doubled = np.zeros(num_tables * num_players * self.max_hands, dtype=bool)
+            self.hand_cards = np.zeros((num_tables * num_players * self.max_hands, self.RECORDED_CARDS), dtype=np.int64)
+            self.hand_cards.reshape(shape + (-1,))[:, :, 0, :2] = self.first_cards[:, :, 0]
+            self.dealer_cards = np.zeros((num_tables, self.RECORDED_CARDS), dtype=np.int64)
+            self.dealer_cards[:, 0] = up_cards
+            self.dealer_cards[:, 1] = hole_cards
+
+        self.tables = tables
+
+        # Net change of every player's stack this round: [table row, player]
+        self.round_net = np.zeros((num_tables, num_players), dtype=np.float64)
+
+        # Its bonus bet parts, for the recorder
+        self.round_net_21_3 = np.zeros((num_tables, num_players), dtype=np.float64) if self.recorder else None
+        self.round_net_bust = np.zeros((num_tables, num_players), dtype=np.float64) if self.recorder else None
+
+        # Pay 3 card bonus if configured
+        if self._plays_21_3.any():
+            self.settle_21_3_bonus()
+
+        if self.bonus_counts_21_3 is not None:
+            up_suits = self._suits[up_cards][:, None]
+            is_flush = (self._suits[player_cards_1] == up_suits) & (self._suits[player_cards_2] == up_suits)
+
+            self.bonus_counts_21_3.add_hands_batch(
+                np.repeat(self._ranks[up_cards], num_players), self._ranks[player_cards_1].reshape(-1), self._ranks[player_cards_2].reshape(-1), is_flush.reshape(-1)
+            )
+
+        # Check if dealer has blackjack
+        dealer_blackjack = self.dealer_has_ace & (self.dealer_hard == 11)
+
+        if dealer_blackjack.any():
+            self.settle_dealer_blackjack(rows[dealer_blackjack])
+
+        playing_rows = rows[~dealer_blackjack]
+
+        # Play each player's hands, then the dealer's
+        for p in range(num_players):
+            self.play_player_hands(playing_rows, p)
+
+        self.play_dealer_hands(playing_rows)
+
+        if self.bonus_counts_bust is not None:
+            self.bonus_counts_bust.add_dealer_hands_batch(
+                self._ranks[self.dealer_up_cards[playing_rows]],
+                self.dealer_hard[playing_rows] > 21,
+                self.dealer_suited[playing_rows],
+                self.dealer_eights[playing_rows] & (self.dealer_num_cards[playing_rows] == 3)
+            )
+
+        self.settle_hands(playing_rows)
+
+        # Pay bust bonus if configured
+        if self._plays_bust.any():
+            self.settle_bust_bonus(playing_rows)
+
+        self.net_change += self.round_net.sum(axis=0)
+        for p in range(num_players):
+            self.round_stats[p].add_batch(self.round_net[:, p])
+
+        if self.recorder:
+            self.record_rounds(player_cards_1, player_cards_2)
+
+    # Writes the rounds just played to the recorder as flat columns, in table row, player, hand order
+    def record_rounds(self, player_cards_1, player_cards_2):
+        dealer_num_cards = self.dealer_num_cards
+        is_dealer_card = np.arange(self.dealer_cards.shape[1]) < dealer_num_cards[:, None]
+
+        is_hand = np.arange(self.max_hands) < self.num_hands[:, :, None]
+        num_cards = self.num_cards[is_hand]
+        hand_cards = self.hand_cards.reshape(is_hand.shape + (-1,))[is_hand]
+        is_hand_card = np.arange(hand_cards.shape[1]) < num_cards[:, None]
+
+        player_blackjack = self.has_ace[is_hand] & (self.hard[is_hand] == 11) & (num_cards == 2)
+
+        self.recorder.record_rounds(
+            len(dealer_num_cards),
+            dealer_num_cards=dealer_num_cards,
+            dealer_card=self.dealer_cards[is_dealer_card],
+            card_1=player_cards_1.reshape(-1),
+            card_2=player_cards_2.reshape(-1),
+            num_hands=self.num_hands.reshape(-1),
+            net=self.round_net.reshape(-1),
+            net_21_3=self.round_net_21_3.reshape(-1),
+            net_bust=self.round_net_bust.reshape(-1),
+            bet=self.bets[is_hand],
+            result=self._recorded_results[self.results[is_hand]],
+            blackjack=player_blackjack,
+            doubled=self.doubled.reshape(is_hand.shape)[is_hand],
+            num_cards=num_cards,
+            hand_card=hand_cards[is_hand_card]
+        )
+
+    # Puts cards into the rows of a card array at the given positions; returns the array, widened if it had to be
+    @staticmethod
+    def _put_cards(card_array, rows, positions, cards):
+        if positions.size and positions.max() >= card_array.shape[1]:
+            card_array = np.concatenate([card_array, np.zeros_like(card_array)], axis=1)
+
+        card_array[rows, positions] = cards
+
+        return card_array
+
+    def settle_21_3_bonus(self):
+        up_cards = self.dealer_up_cards
+        card_1 = self.first_cards[:, :, 0, 0]
+        card_2 = self.first_cards[:, :, 0, 1]
+
+        up_suits = self._suits[up_cards][:, None]
+        is_flush = (self._suits[card_1] == up_suits) & (self._suits[card_2] == up_suits)
+
+        multipliers = self._mx_21_3[self._ranks[up_cards][:, None], self._ranks[card_1], self._ranks[card_2], is_flush.astype(np.int64)]
+        rows = np.arange(len(up_cards))
+
+        for plan_idx in np.flatnonzero(self._plays_21_3):
+            bet = self._bets_21_3[plan_idx]
+
+            self._record_bonus_results(plan_idx, self.bonus_21_3_results, self.bonus_21_3_stats, rows, multipliers * bet, np.full(multipliers.shape, bet),
+                                      round_bonus_net=self.round_net_21_3)
+
+    def settle_dealer_blackjack(self, rows):
+        # Only the starting hands; nobody got to play
+        player_blackjack = self.has_ace[rows, :, 0] & (self.hard[rows, :, 0] == 11)
+        self.results[rows, :, 0] = np.where(player_blackjack, self.PUSH, self.LOSS)
+
+        self.num_pushes += player_blackjack.sum(axis=0)
+        self.num_losses += (~player_blackjack).sum(axis=0)
+        self.round_net[rows] -= np.where(player_blackjack, 0, self.bets[rows, :, 0])
+
+    # Plays player p's hand and any hands split from it at each of the tables. Like Simulation.play_player_hand, split
+    # hands go on a stack and are played after the hand they were split from.
+    def play_player_hands(self, rows, p):
+        num_tables = len(self.tables)
+        current_hands = np.zeros(num_tables, dtype=np.int64)
+        stack = np.zeros((num_tables, self.max_hands), dtype=np.int64)
+        stack_sizes = np.zeros(num_tables, dtype=np.int64)
+
+        # Flat views of the hand arrays; a hand is at (row * # of players + p) * max hands + hand
+        hard = self.hard.reshape(-1)
+        has_ace = self.has_ace.reshape(-1)
+        num_cards = self.num_cards.reshape(-1)
+        first_cards = self.first_cards.reshape(-1, 2)
+        bets = self.bets.reshape(-1)
+        results = self.results.reshape(-1)
+        num_hands = self.num_hands[:, p]
+
+        dealer_up_card_idxs = self._dealer_up_card_idxs[self.dealer_up_cards]
+
+        while rows.size:
+            hand_idxs = (rows * self.num_players + p) * self.max_hands + current_hands[rows]
+            hand_num_cards = num_cards[hand_idxs]
+            hand_hard = hard[hand_idxs]
+            first_decision = hand_num_cards == 2
+
+            rank_1 = self._ranks[first_cards[hand_idxs, 0]]
+            rank_2 = self._ranks[first_cards[hand_idxs, 1]]
+            is_pair = first_decision & (rank_1 == rank_2)
+
+            hand_class = np.where(is_pair, Strategy.PAIR, np.where(has_ace[hand_idxs], Strategy.SOFT, Strategy.HARD))
+            total = np.where(is_pair, rank_1, hand_hard)
+            can_split = num_hands[rows] < self.split_limit if self.split_limit else True
+
+            actions = self._actions[Strategy.get_table_idx(hand_class, total, dealer_up_card_idxs[rows], can_split, first_decision)]
+
+            # There will only be 1 card if we just split; stand at 21 or more
+            actions = np.where(hand_num_cards == 1, Strategy.HIT, np.where(hand_hard >= 21, Strategy.STAND, actions))
+
+            if np.any(actions == Strategy.NO_ACTION):
+                raise DetermineActionError(f'Unable to determine player action for hand with hard total {hand_hard[actions == Strategy.NO_ACTION][0]}')
+
+            doubles = actions == Strategy.DOUBLE
+            splits = actions == Strategy.SPLIT
+
+            # hit / double; double the bet before drawing
+            bets[hand_idxs[doubles]] *= 2
+
+            if self.recorder:
+                self.doubled[hand_idxs[doubles]] = True
+
+            draws = doubles | (actions == Strategy.HIT)
+            busts = np.zeros(rows.size, dtype=bool)
+            if draws.any():
+                draw_idxs = hand_idxs[draws]
+                self._add_cards(draw_idxs, self.draw(self.tables[rows[draws]]))
+
+                busts[draws] = hard[draw_idxs] > 21
+
+                if busts.any():
+                    bust_idxs = hand_idxs[busts]
+                    results[bust_idxs] = self.LOSS
+                    self.num_losses[p] += bust_idxs.size
+                    self.round_net[rows[busts], p] -= bets[bust_idxs]
+
+                    # Recorded with the # of hands the player has at the time, like BlackjackPlayer.record_hand_result
+                    self._record_split_hands(p, num_hands[rows[busts]])
+
+            # split; keep playing this hand and play the new one after it
+            if splits.any():
+                split_rows = rows[splits]
+                split_idxs = hand_idxs[splits]
+                new_hands = num_hands[split_rows]
+
+                if np.any(new_hands >= self.max_hands):
+                    raise GameplayError(f'Tried to split to more than {self.max_hands} hands')
+
+                new_idxs = split_idxs - current_hands[split_rows] + new_hands
+                moved_cards = first_cards[split_idxs, 1]
+                kept_cards = first_cards[split_idxs, 0]
+
+                if self.recorder:
+                    self.hand_cards[new_idxs, 0] = moved_cards
+
+                hard[new_idxs] = self._values[moved_cards]
+                has_ace[new_idxs] = self._is_ace[moved_cards]
+                num_cards[new_idxs] = 1
+                first_cards[new_idxs, 0] = moved_cards
+
+                hard[split_idxs] = self._values[kept_cards]
+                has_ace[split_idxs] = self._is_ace[kept_cards]
+                num_cards[split_idxs] = 1
+
+                num_hands[split_rows] += 1
+
+                stack[split_rows, stack_sizes[split_rows]] = new_hands
+                stack_sizes[split_rows] += 1
+
+            # Hands that are done; move on to the next split hand or the next player
+            done = (actions == Strategy.STAND) | doubles | busts
+            done_rows = rows[done]
+            next_rows = done_rows[stack_sizes[done_rows] > 0]
+            stack_sizes[next_rows] -= 1
+            current_hands[next_rows] = stack[next_rows, stack_sizes[next_rows]]
+
+            rows = np.concatenate([rows[~done], next_rows])
+
+    # hand_idxs are flat indexes into the hand arrays
+    def _add_cards(self, hand_idxs, cards):
+        num_cards = self.num_cards.reshape(-1)
+        hard = self.hard.reshape(-1)
+        has_ace = self.has_ace.reshape(-1)
+
+        # Keep the first 2 cards for pair and 21+3 checks
+        hand_num_cards = num_cards[hand_idxs]
+        is_second = hand_num_cards == 1
+        self.first_cards.reshape(-1, 2)[hand_idxs[is_second], 1] = cards[is_second]
+
+        if self.recorder:
+            self.hand_cards = self._put_cards(self.hand_cards, hand_idxs, hand_num_cards, cards)
+
+        hard[hand_idxs] += self._values[cards]
+        has_ace[hand_idxs] |= self._is_ace[cards]
+        num_cards[hand_idxs] = hand_num_cards + 1
+
+    def _record_split_hands(self, p, num_hands):
+        num_hands = num_hands[num_hands > 1]
+        if num_hands.size:
+            self.num_split_hands[p] += np.bincount(num_hands, minlength=self.max_hands + 1)
+
+    # Hit until the dealer table says stand
+    def play_dealer_hands(self, rows):
+        while rows.size:
+            is_soft = self.dealer_has_ace[rows] & (self.dealer_hard[rows] <= 11)
+            rows = rows[self._dealer_actions[2 * self.dealer_hard[rows] + is_soft] == Strategy.HIT]
+
+            if rows.size:
+                cards = self.draw(self.tables[rows]).astype(np.int64)
+
+                if self.recorder:
+                    self.dealer_cards = self._put_cards(self.dealer_cards, rows, self.dealer_num_cards[rows], cards)
+
+                self.dealer_hard[rows] += self._values[cards]
+                self.dealer_has_ace[rows] |= self._is_ace[cards]
+                self.dealer_num_cards[rows] += 1
+                self.dealer_suited[rows] &= self._suits[cards] == self._suits[self.dealer_up_cards[rows]]
+                self.dealer_eights[rows] &= self._values[cards] == 8
+
+    def settle_hands(self, rows):
+        hard = self.hard[rows]
+        has_ace = self.has_ace[rows]
+        num_hands = self.num_hands[rows]
+
+        # Hands that weren't settled when they busted
+        in_play = (np.arange(self.max_hands) < num_hands[:, :, None]) & (self.results[rows] == self.UNDETERMINED)
+
+        player_values = np.where(has_ace & (hard <= 11), hard + 10, hard)
+        player_blackjack = has_ace & (hard == 11) & (self.num_cards[rows] == 2)
+
+        dealer_hard = self.dealer_hard[rows]
+        dealer_values = np.where(self.dealer_has_ace[rows] & (dealer_hard <= 11), dealer_hard + 10, dealer_hard)[:, None, None]
+        dealer_bust = (dealer_hard > 21)[:, None, None]
+
+        wins = in_play & (dealer_bust | player_blackjack | (player_values > dealer_values))
+        pushes = in_play & ~wins & (player_values == dealer_values)
+        losses = in_play & ~wins & ~pushes
+
+        self.results[rows] = np.where(wins, self.WIN, np.where(pushes, self.PUSH, np.where(losses, self.LOSS, self.results[rows])))
+
+        bets = self.bets[rows]
+        blackjack_wins = wins & player_blackjack
+
+        self.num_wins += wins.sum(axis=(0, 2))
+        self.num_pushes += pushes.sum(axis=(0, 2))
+        self.num_losses += losses.sum(axis=(0, 2))
+        self.num_blackjack_wins += blackjack_wins.sum(axis=(0, 2))
+
+        # pay player; 3:2 for blackjack unless configured otherwise
+        self.round_net[rows] += np.where(blackjack_wins, self.blackjack_payout * bets, np.where(wins, bets, 0)).sum(axis=2)
+        self.round_net[rows] -= np.where(losses, bets, 0).sum(axis=2)
+
+        # Split hands are recorded with the final # of hands
+        for p in range(self.num_players):
+            split_hands = in_play[:, p] & (num_hands[:, p, None] > 1)
+            self._record_split_hands(p, np.broadcast_to(num_hands[:, p, None], split_hands.shape)[split_hands])
+
+    def settle_bust_bonus(self, rows):
+        up_ranks = self._ranks[self.dealer_up_cards[rows]]
+
+        is_888 = self.dealer_eights[rows] & (self.dealer_num_cards[rows] == 3)
+        multipliers = self._mx_bust[up_ranks, self.dealer_suited[rows].astype(np.int64), is_888.astype(np.int64)]
+        dealer_bust = self.dealer_hard[rows] > 21
+        multipliers = np.where(dealer_bust, multipliers, 0)
+
+        controls = None
+        if self.bust_control_variate:
+            controls = self.bust_control_variate.get_controls_batch(up_ranks, dealer_bust, self.dealer_suited[rows])
+
+        for plan_idx in range(len(self._plays_bust)):
+            played = self._plays_bust[plan_idx, up_ranks]
+            bets = self._bets_bust[plan_idx, up_ranks[played]]
+
+            self._record_bonus_results(
+                plan_idx,
+                self.bonus_bust_results,
+                self.bonus_bust_stats,
+                rows[played],
+                np.broadcast_to((multipliers[played] * bets)[:, None], (bets.size, self.num_players)),
+                np.broadcast_to(bets[:, None], (bets.size, self.num_players)),
+                control_stats=self.bonus_bust_control_stats[plan_idx],
+                controls=controls[played] * bets[:, None] if controls is not None else None,
+                round_bonus_net=self.round_net_bust
+            )
+
+    # payouts and bets are [table row, player] for the given rows; controls, if given, are the [table row, control]
+    # control variates of the bets for control_stats; round_bonus_net, if given, gets the net of the bet plan too
+    def _record_bonus_results(self, plan_idx, results, stats, rows, payouts, bets, control_stats=None, controls=None, round_bonus_net=None):
+        wins = payouts > 0
+        net = np.where(wins, payouts, -bets)
+
+        results[plan_idx, :, 0] += wins.sum(axis=0)
+        results[plan_idx, :, 1] += (~wins).sum(axis=0)
+        results[plan_idx, :, 2] += net.sum(axis=0)
+
+        for p in range(self.num_players):
+            stats[plan_idx][p].add_batch(net[:, p])
+
+            if control_stats is not None:
+                control_stats[p].add_batch(np.column_stack([net[:, p], controls]))
+
+        # Only the plan the players bet changes their stacks
+        if plan_idx == 0:
+            self.round_net[rows] += net
+
+            if round_bonus_net is not None:
+                round_bonus_net[rows] += net
+
+    # Adds the counters of all of the tables to the players of a session
+    def record_session(self, session):
+        session.num_hands_played += self.num_hands_played
+
+        for p, player in enumerate(session.players):
+            player.record_hand_results(
+                num_wins=int(self.num_wins[p]),
+                num_pushes=int(self.num_pushes[p]),
+                num_losses=int(self.num_losses[p]),
+                net_change=float(self.net_change[p]),
+                num_split_hands_dict={num_hands: int(n) for num_hands, n in enumerate(self.num_split_hands[p]) if n},
+                round_stats=self.round_stats[p]
+            )
+
+            for plan_idx, plan in enumerate(player.bonus_plans_21_3):
+                plan.record_bonus_results(*self._get_bonus_results(self.bonus_21_3_results[plan_idx, p]), stats=self.bonus_21_3_stats[plan_idx][p])
+
+            for plan_idx, plan in enumerate(player.bonus_plans_bust):
+                control_stats = self.bonus_bust_control_stats[plan_idx]
+                plan.record_bonus_results(
+                    *self._get_bonus_results(self.bonus_bust_results[plan_idx, p]),
+                    stats=self.bonus_bust_stats[plan_idx][p],
+                    control_stats=control_stats[p] if control_stats else None
+                )
+
+        return session
+
+    # (# of wins, # of losses, net amount) of a plan's bonus counters as Python numbers
+    @staticmethod
+    def _get_bonus_results(results):
+        num_wins, num_losses, net_amount = results.tolist()
+
+        return int(num_wins), int(num_losses), net_amount
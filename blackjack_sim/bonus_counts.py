@@ -0,0 +1,243 @@
+import math
+from collections import namedtuple
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.stats import RunningStats
+from blackjack_sim.bonuses import BonusPlan, TwentyOne3BonusPayer, BustBonusPayer
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# ev: net win per bet played, house_edge and ci_halfwidth: %s relative to the average bet like BonusPlan
+WhatIfResult = namedtuple('WhatIfResult', ['ev', 'house_edge', 'ci_halfwidth', 'num_bets'])
+
+
+class BonusOutcomeCounts(object):
+
+    """
+    How many times each payout class of a bonus bet came up, by dealer up card rank, in a flat list of ints indexed by
+    up card rank index * # of outcomes + outcome index. A bonus bet's result only depends on its payout class, the
+    payout table and the bet amount, so the counts are enough to settle the same rounds again under any payout table
+    and bonus plan (what_if) without dealing another card.
+
+    The counts don't depend on the bonus plans: every hand or round the bet could have been settled on is counted,
+    whether or not any plan bet on it.
+
+    Subclasses set OUTCOMES and implement get_payer(payouts), the bet's payer with payouts overriding its default ones,
+    and get_multipliers(payer), the payer's [up card rank index][outcome index] multipliers (0 loses the bet).
+    """
+
+    OUTCOMES = []
+
+    def __init__(self, counts=None):
+        num_counts = Card.NUM_RANKS * len(self.OUTCOMES)
+
+        if counts is not None and len(counts) != num_counts:
+            raise ConfigurationError(f'Expected {num_counts} outcome counts, got {len(counts)}')
+
+        self.counts = list(counts) if counts is not None else [0] * num_counts
+
+    def add(self, up_rank_idx, outcome_idx):
+        self.counts[up_rank_idx * len(self.OUTCOMES) + outcome_idx] += 1
+
+    # Arrays of up card rank indexes and outcome indexes
+    def add_batch(self, up_rank_idxs, outcome_idxs):
+        batch_counts = np.bincount(up_rank_idxs * len(self.OUTCOMES) + outcome_idxs, minlength=len(self.counts))
+        self.counts = (batch_counts + self.counts).tolist()
+
+    # Combine the counts of another part (shard) of the simulation
+    def merge(self, other):
+        self.counts = [c + n for c, n in zip(self.counts, other.counts)]
+
+    def get_count(self, up_rank, outcome):
+        return self.counts[Card.CARD_RANKS.index(up_rank) * len(self.OUTCOMES) + self.OUTCOMES.index(outcome)]
+
+    # Key = outcome, value = count over every up card
+    def get_outcome_counts(self):
+        num_outcomes = len(self.OUTCOMES)
+
+        return {outcome: sum(self.counts[o::num_outcomes]) for o, outcome in enumerate(self.OUTCOMES)}
+
+    def get_num_settled(self):
+        return sum(self.counts)
+
+    # Results of a bonus plan (a BonusPlan or its config; $1 on every hand or round if None) on the counted hands or
+    # rounds with the payer's payouts, overridden by payouts like the payers' (e.g. {"suited_888": 100})
+    def what_if(self, payouts=None, plan=None, payer=None):
+        plan = plan if isinstance(plan, BonusPlan) or plan is None else BonusPlan(plan)
+        payer = payer if payer else self.get_payer(payouts)
+
+        multipliers = self.get_multipliers(payer)
+        num_outcomes = len(self.OUTCOMES)
+
+        num_bets = 0
+        total = 0
+        total_squares = 0
+        for up_rank_idx, rank in enumerate(Card.CARD_RANKS):
+            if plan is None:
+                bet = 1
+            else:
+                up_card = Card(Card.CARD_SUITS[0], rank)
+                bet = plan.get_bet_amount(dealer_up_card=up_card) if plan.will_play_bonus_bet(dealer_up_card=up_card) else 0
+
+            if not bet:
+                continue
+
+            for outcome_idx in range(num_outcomes):
+                count = self.counts[up_rank_idx * num_outcomes + outcome_idx]
+                mx = multipliers[up_rank_idx][outcome_idx]
+
+                # Like BonusPlan.record_bonus_result, anything that doesn't pay loses the bet
+                net = mx * bet if mx > 0 else -bet
+
+                num_bets += count
+                total += count * net
+                total_squares += count * net * net
+
+        if not num_bets:
+            return WhatIfResult(ev=0, house_edge=0, ci_halfwidth=0, num_bets=0)
+
+        ev = total / num_bets
+        variance = (total_squares - num_bets * ev * ev) / (num_bets - 1) if num_bets > 1 else 0
+
+        avg_bet_amt = plan.get_avg_bet_amount() if plan else 1
+        house_edge = -(ev / avg_bet_amt) * 100 if avg_bet_amt else 0
+        ci_halfwidth = (RunningStats.Z_95 * math.sqrt(max(variance, 0) / num_bets) / avg_bet_amt) * 100 if avg_bet_amt else 0
+
+        return WhatIfResult(ev=ev, house_edge=house_edge, ci_halfwidth=ci_halfwidth, num_bets=num_bets)
+
+    def to_dict(self):
+        return {'outcomes': self.OUTCOMES, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, counts_dict):
+        if counts_dict['outcomes'] != cls.OUTCOMES:
+            raise ConfigurationError(f'Outcome counts are for {counts_dict["outcomes"]}, not {cls.OUTCOMES}')
+
+        return cls(counts=counts_dict['counts'])
+
+
+class TwentyOne3OutcomeCounts(BonusOutcomeCounts):
+
+    """
+    21+3 payout classes of every player's starting hand with the dealer's up card, counted on every round.
+    """
+
+    OUTCOMES = TwentyOne3BonusOdds.OUTCOMES
+
+    # Outcome index by (up card rank index, player rank index 1, player rank index 2, is flush), flattened; built the
+    # first time it's needed
+    _outcome_table = None
+    _np_outcome_table = None
+
+    @classmethod
+    def _get_outcome_table(cls):
+        if cls._outcome_table is None:
+            ranks = range(Card.NUM_RANKS)
+            cls._outcome_table = [cls.OUTCOMES.index(TwentyOne3BonusOdds.classify((r0, r1, r2), is_flush))
+                                  for r0 in ranks for r1 in ranks for r2 in ranks for is_flush in [False, True]]
+
+            if np is not None:
+                cls._np_outcome_table = np.array(cls._outcome_table, dtype=np.int64).reshape((Card.NUM_RANKS,) * 3 + (2,))
+
+        return cls._outcome_table
+
+    def add_hand(self, dealer_up_card, player_cards):
+        rank_idxs = Card.RANK_INDEXES
+        suit_idxs = Card.SUIT_INDEXES
+        card_1, card_2 = player_cards
+
+        up_rank_idx = rank_idxs[dealer_up_card]
+        up_suit_idx = suit_idxs[dealer_up_card]
+        is_flush = suit_idxs[card_1] == up_suit_idx and suit_idxs[card_2] == up_suit_idx
+
+        outcome_idx = self._get_outcome_table()[((up_rank_idx * Card.NUM_RANKS + rank_idxs[card_1]) * Card.NUM_RANKS + rank_idxs[card_2]) * 2 + is_flush]
+        self.add(up_rank_idx, outcome_idx)
+
+    # Arrays of rank indexes and flush flags, one per hand
+    def add_hands_batch(self, up_rank_idxs, rank_idxs_1, rank_idxs_2, is_flush):
+        self._get_outcome_table()
+
+        self.add_batch(up_rank_idxs, self._np_outcome_table[up_rank_idxs, rank_idxs_1, rank_idxs_2, is_flush.astype(np.int64)])
+
+    def get_payer(self, payouts=None):
+        return TwentyOne3BonusPayer(payouts=payouts)
+
+    def get_multipliers(self, payer):
+        outcome_multipliers = {
+            TwentyOne3BonusOdds.STRAIGHT_FLUSH: payer.STRAIGHT_FLUSH_MX,
+            TwentyOne3BonusOdds.TRIPS: payer.TRIPLES_MX,
+            TwentyOne3BonusOdds.STRAIGHT: payer.STRAIGHT_MX,
+            TwentyOne3BonusOdds.FLUSH: payer.FLUSH_MX,
+            TwentyOne3BonusOdds.NO_WIN: 0
+        }
+
+        # The same for every up card
+        return [[outcome_multipliers[outcome] for outcome in self.OUTCOMES] for rank in Card.CARD_RANKS]
+
+
+class BustOutcomeCounts(BonusOutcomeCounts):
+
+    """
+    Bust bonus payout classes of the dealer's hand, counted on every round the bet is settled on (the dealer doesn't
+    have blackjack).
+    """
+
+    OUTCOMES = BustBonusOdds.OUTCOMES
+
+    SUITED_IDX = OUTCOMES.index(BustBonusOdds.SUITED)
+    NON_SUITED_IDX = OUTCOMES.index(BustBonusOdds.NON_SUITED)
+    SUITED_888_IDX = OUTCOMES.index(BustBonusOdds.SUITED_888)
+    NON_SUITED_888_IDX = OUTCOMES.index(BustBonusOdds.NON_SUITED_888)
+    NO_BUST_IDX = OUTCOMES.index(BustBonusOdds.NO_BUST)
+
+    # Dealer hand that has been played out
+    def add_dealer_hand(self, dealer_hand):
+        cards = dealer_hand.cards
+        up_rank_idx = Card.RANK_INDEXES[cards[0]]
+
+        if dealer_hand.hard_value <= 21:
+            self.add(up_rank_idx, self.NO_BUST_IDX)
+            return
+
+        up_suit_idx = Card.SUIT_INDEXES[cards[0]]
+        is_suited = all(Card.SUIT_INDEXES[c] == up_suit_idx for c in cards)
+
+        if len(cards) == 3 and all(Card.VALUES[c] == 8 for c in cards):
+            self.add(up_rank_idx, self.SUITED_888_IDX if is_suited else self.NON_SUITED_888_IDX)
+        else:
+            self.add(up_rank_idx, self.SUITED_IDX if is_suited else self.NON_SUITED_IDX)
+
+    # Arrays of up card rank indexes and flags, one per dealer hand; is_888 is 3 8s
+    def add_dealer_hands_batch(self, up_rank_idxs, is_bust, is_suited, is_888):
+        outcome_idxs = np.where(
+            is_bust,
+            np.where(is_888, np.where(is_suited, self.SUITED_888_IDX, self.NON_SUITED_888_IDX), np.where(is_suited, self.SUITED_IDX, self.NON_SUITED_IDX)),
+            self.NO_BUST_IDX
+        )
+
+        self.add_batch(up_rank_idxs, outcome_idxs)
+
+    def get_payer(self, payouts=None):
+        return BustBonusPayer(payouts=payouts)
+
+    def get_multipliers(self, payer):
+        multipliers = []
+        for rank in Card.CARD_RANKS:
+            up_value = Card._get_value(rank)
+
+            outcome_multipliers = {
+                BustBonusOdds.SUITED: payer.MX_LOOKUP['suited'][up_value],
+                BustBonusOdds.NON_SUITED: payer.MX_LOOKUP['non-suited'][up_value],
+                BustBonusOdds.SUITED_888: payer.SUITED_888_MX,
+                BustBonusOdds.NON_SUITED_888: payer.NON_SUITED_888_MX,
+                BustBonusOdds.NO_BUST: 0
+            }
+
+            multipliers.append([outcome_multipliers[outcome] for outcome in self.OUTCOMES])
+
+        return multipliers
@@ -0,0 +1,414 @@
+from math import comb, factorial
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.strategy import Strategy, DealerStrategy
+from blackjack_sim.bonuses import BonusPlan, TwentyOne3BonusPayer, BustBonusPayer
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TwentyOne3BonusOdds(object):
+
+    """
+    Exact 21+3 odds for an N deck shoe. The bet only depends on 3 cards (the player's 2 and the dealer's up card), so
+    instead of enumerating the C(52N, 3) hands this counts them by rank multiset: for ranks with multiplicities k_r
+    there are prod C(4N, k_r) hands, of which 4 * prod C(N, k_r) are flushes. Each of the 455 rank multisets is then
+    classified with the payout ranking of TwentyOne3BonusPayer.
+
+    num_decks=None is an infinite deck (cards drawn with replacement): hands are then counted as the 52^3 ordered
+    draws, 3! / prod k_r! * 4^3 per rank multiset, of which 3! / prod k_r! * 4 are flushes.
+
+    Probabilities are off the top of a full shoe; every 3 cards dealt from a shuffled shoe have the same distribution.
+    """
+
+    STRAIGHT_FLUSH = 'straight flush'
+    TRIPS = 'trips'
+    STRAIGHT = 'straight'
+    FLUSH = 'flush'
+    NO_WIN = 'no win'
+
+    OUTCOMES = [STRAIGHT_FLUSH, TRIPS, STRAIGHT, FLUSH, NO_WIN]
+
+    def __init__(self, num_decks, payer=None):
+        if num_decks is not None and num_decks < 1:
+            raise ConfigurationError(f'Invalid # of decks: {num_decks}')
+
+        self.num_decks = num_decks
+        self.payer = payer if payer else TwentyOne3BonusPayer()
+
+        self._outcome_counts = None
+
+    # Straight rankings of a rank index with the ace low and high, like BonusPayer
+    @staticmethod
+    def _is_straight(rank_idxs):
+        for ace_high in [False, True]:
+            straight_ranks = sorted(Card.NUM_RANKS - r if r != Card.ACE_RANK_INDEX or ace_high else 0 for r in rank_idxs)
+
+            if straight_ranks[0] + 1 == straight_ranks[1] and straight_ranks[1] + 1 == straight_ranks[2]:
+                return True
+
+        return False
+
+    @classmethod
+    def classify(cls, rank_idxs, is_flush):
+        is_straight = cls._is_straight(rank_idxs)
+
+        if is_straight and is_flush:
+            return cls.STRAIGHT_FLUSH
+        elif rank_idxs[0] == rank_idxs[1] == rank_idxs[2]:
+            return cls.TRIPS
+        elif is_straight:
+            return cls.STRAIGHT
+        elif is_flush:
+            return cls.FLUSH
+        else:
+            return cls.NO_WIN
+
+    # Key = outcome, value = # of 3 card hands
+    def get_outcome_counts(self):
+        if self._outcome_counts is None:
+            num_suits = len(Card.CARD_SUITS)
+
+            counts = {outcome: 0 for outcome in self.OUTCOMES}
+            for r1 in range(Card.NUM_RANKS):
+                for r2 in range(r1, Card.NUM_RANKS):
+                    for r3 in range(r2, Card.NUM_RANKS):
+                        rank_idxs = (r1, r2, r3)
+                        multiplicities = [rank_idxs.count(r) for r in set(rank_idxs)]
+
+                        if self.num_decks is None:
+                            num_orders = factorial(3)
+                            for k in multiplicities:
+                                num_orders //= factorial(k)
+
+                            num_hands = num_orders * num_suits ** 3
+                            num_flushes = num_orders * num_suits
+                        else:
+                            num_hands = 1
+                            num_flushes = num_suits
+                            for k in multiplicities:
+                                num_hands *= comb(num_suits * self.num_decks, k)
+                                num_flushes *= comb(self.num_decks, k)
+
+                        counts[self.classify(rank_idxs, is_flush=True)] += num_flushes
+                        counts[self.classify(rank_idxs, is_flush=False)] += num_hands - num_flushes
+
+            self._outcome_counts = counts
+
+        return dict(self._outcome_counts)
+
+    def get_num_hands(self):
+        if self.num_decks is None:
+            return Card.NUM_CARDS ** 3
+
+        return comb(self.num_decks * Card.NUM_CARDS, 3)
+
+    def get_outcome_probabilities(self):
+        num_hands = self.get_num_hands()
+
+        return {outcome: count / num_hands for outcome, count in self.get_outcome_counts().items()}
+
+    def get_multipliers(self):
+        return {
+            self.STRAIGHT_FLUSH: self.payer.STRAIGHT_FLUSH_MX,
+            self.TRIPS: self.payer.TRIPLES_MX,
+            self.STRAIGHT: self.payer.STRAIGHT_MX,
+            self.FLUSH: self.payer.FLUSH_MX
+        }
+
+    # Expected net win per $1 bet
+    def get_ev(self):
+        outcomes = self.get_outcome_probabilities()
+
+        return sum(outcomes[outcome] * mx for outcome, mx in self.get_multipliers().items()) - outcomes[self.NO_WIN]
+
+    # Expected net win per bet played for a bonus plan (a BonusPlan or its config)
+    def get_plan_ev(self, plan):
+        plan = plan if isinstance(plan, BonusPlan) else BonusPlan(plan)
+
+        return plan.get_bet_amount() * self.get_ev() if plan.will_play_bonus_bet() else 0
+
+    # House edge as a %, like BonusPlan.get_result_str; the same for every bet amount
+    def get_house_edge(self):
+        return -self.get_ev() * 100
+
+
+class BustBonusOdds(object):
+
+    """
+    Exact bust bonus odds, computed from the dealer's outcome probabilities instead of simulated.
+
+    For each dealer up card the dealer's hand is played out over every possible draw: a memoized recursion over the
+    dealer's total, whether all of the cards so far are suited with the up card or are 8s, and the cards removed from
+    the shoe. While the dealer's cards are all suited the removed cards are tracked by value and suit (same suit as the
+    up card or not), after that only by value. num_decks=None is an infinite deck (no card removal).
+
+    Probabilities are conditioned on the dealer not having blackjack, since the bust bonus isn't played then, and are
+    off the top of a full shoe. EVs and house edges use the BustBonusPayer multipliers and follow BonusPlan's
+    definitions, so they can be compared directly with simulated results.
+    """
+
+    SUITED = 'suited'
+    NON_SUITED = 'non-suited'
+    SUITED_888 = 'suited 888'
+    NON_SUITED_888 = 'non-suited 888'
+    NO_BUST = 'no bust'
+
+    OUTCOMES = [SUITED, NON_SUITED, SUITED_888, NON_SUITED_888, NO_BUST]
+
+    NUM_VALUES = 10  # card values 1 (ace) through 10
+
+    # # of ranks with each card value (index = value)
+    RANKS_PER_VALUE = [0] + [sum(1 for rank in Card.CARD_RANKS if Card._get_value(rank) == v) for v in range(1, NUM_VALUES + 1)]
+
+    def __init__(self, num_decks=None, hits_soft_17=True, payer=None):
+        if num_decks is not None and num_decks < 1:
+            raise ConfigurationError(f'Invalid # of decks: {num_decks}')
+
+        self.num_decks = num_decks
+        self.hits_soft_17 = hits_soft_17
+        self.payer = payer if payer else BustBonusPayer()
+
+        self._dealer_actions = DealerStrategy(hits_soft_17=hits_soft_17).actions
+
+        # Key = up card value, value = (outcome probabilities, probability of dealer blackjack)
+        self._up_card_outcomes = {}
+
+    def get_outcome_probabilities(self, dealer_up_card_rank):
+        return dict(self._get_up_card_outcomes(Card._get_value(dealer_up_card_rank))[0])
+
+    def get_blackjack_probability(self, dealer_up_card_rank):
+        return self._get_up_card_outcomes(Card._get_value(dealer_up_card_rank))[1]
+
+    def get_bust_probability(self, dealer_up_card_rank):
+        return 1 - self.get_outcome_probabilities(dealer_up_card_rank)[self.NO_BUST]
+
+    # Expected net win per $1 bust bonus bet when the dealer shows this up card
+    def get_up_card_ev(self, dealer_up_card_rank):
+        up_value = Card._get_value(dealer_up_card_rank)
+        outcomes = self.get_outcome_probabilities(dealer_up_card_rank)
+
+        multipliers = {
+            self.SUITED: self.payer.MX_LOOKUP['suited'][up_value],
+            self.NON_SUITED: self.payer.MX_LOOKUP['non-suited'][up_value],
+            self.SUITED_888: self.payer.SUITED_888_MX,
+            self.NON_SUITED_888: self.payer.NON_SUITED_888_MX
+        }
+
+        return sum(outcomes[outcome] * mx for outcome, mx in multipliers.items()) - outcomes[self.NO_BUST]
+
+    # Expected net win per bet played for a bonus plan (a BonusPlan or its config)
+    def get_plan_ev(self, plan):
+        plan = plan if isinstance(plan, BonusPlan) else BonusPlan(plan)
+
+        total_probability = 0
+        total_ev = 0
+        for rank in Card.CARD_RANKS:
+            dealer_up_card = Card(Card.CARD_SUITS[0], rank)
+
+            if plan.will_play_bonus_bet(dealer_up_card=dealer_up_card):
+                # Every rank is equally likely to be the up card; the bet is only played without a dealer blackjack
+                probability = (1 - self.get_blackjack_probability(rank)) / Card.NUM_RANKS
+
+                total_probability += probability
+                total_ev += probability * plan.get_bet_amount(dealer_up_card=dealer_up_card) * self.get_up_card_ev(rank)
+
+        return total_ev / total_probability if total_probability > 0 else 0
+
+    # House edge as a %, relative to the plan's average bet like BonusPlan.get_result_str
+    def get_house_edge(self, plan):
+        plan = plan if isinstance(plan, BonusPlan) else BonusPlan(plan)
+
+        avg_bet_amt = plan.get_avg_bet_amount()
+
+        return -((self.get_plan_ev(plan) / avg_bet_amt) * 100) if avg_bet_amt > 0 else 0
+
+    def _get_up_card_outcomes(self, up_value):
+        if up_value not in self._up_card_outcomes:
+            memo = {}
+
+            if self.num_decks is None:
+                removed = None
+            else:
+                # Removed cards: (same suit as the up card by value, other suits by value); the up card itself is removed
+                removed = (tuple(1 if v == up_value else 0 for v in range(self.NUM_VALUES + 1)), (0,) * (self.NUM_VALUES + 1))
+
+            suited, non_suited, suited_888, non_suited_888, blackjack = self._play_dealer_hand(
+                memo, hard_value=up_value, has_ace=up_value == 1, num_cards=1, is_suited=True, is_eights=up_value == 8, removed=removed
+            )
+
+            no_blackjack = 1 - blackjack
+            outcomes = {
+                self.SUITED: suited / no_blackjack,
+                self.NON_SUITED: non_suited / no_blackjack,
+                self.SUITED_888: suited_888 / no_blackjack,
+                self.NON_SUITED_888: non_suited_888 / no_blackjack
+            }
+            outcomes[self.NO_BUST] = 1 - sum(outcomes.values())
+
+            self._up_card_outcomes[up_value] = (outcomes, blackjack)
+
+        return self._up_card_outcomes[up_value]
+
+    # Returns the probabilities of (suited bust, non-suited bust, suited 888, non-suited 888, dealer blackjack) from
+    # this dealer hand on
+    def _play_dealer_hand(self, memo, hard_value, has_ace, num_cards, is_suited, is_eights, removed):
+        if hard_value > 21:
+            if is_eights and num_cards == 3:
+                return (0, 0, 1, 0, 0) if is_suited else (0, 0, 0, 1, 0)
+            else:
+                return (1, 0, 0, 0, 0) if is_suited else (0, 1, 0, 0, 0)
+
+        # Hit until the dealer table says stand; the hole card is always drawn
+        is_soft = has_ace and hard_value <= 11
+        if self._dealer_actions[DealerStrategy.get_table_idx(hard_value, is_soft)] != Strategy.HIT:
+            return (0, 0, 0, 0, 0)
+
+        # Once the hand isn't suited only the values of the removed cards matter; keep them all with the other suits
+        if not is_suited and removed is not None and any(removed[0]):
+            removed = ((0,) * len(removed[0]), tuple(s + o for s, o in zip(*removed)))
+
+        key = (hard_value, has_ace, min(num_cards, 4), is_suited, is_eights and num_cards < 3, removed)
+        if key in memo:
+            return memo[key]
+
+        totals = [0, 0, 0, 0, 0]
+        for value, is_same_suit, probability, next_removed in self._get_draws(num_cards, is_suited, removed):
+            if probability == 0:
+                continue
+
+            # Dealer blackjack; the bust bonus isn't played
+            if num_cards == 1 and hard_value + value == 11 and (has_ace or value == 1):
+                totals[4] += probability
+                continue
+
+            outcomes = self._play_dealer_hand(
+                memo,
+                hard_value=hard_value + value,
+                has_ace=has_ace or value == 1,
+                num_cards=num_cards + 1,
+                is_suited=is_suited and is_same_suit,
+                is_eights=is_eights and value == 8,
+                removed=next_removed
+            )
+
+            for i in range(len(totals)):
+                totals[i] += probability * outcomes[i]
+
+        memo[key] = tuple(totals)
+
+        return memo[key]
+
+    # The possible next cards as (value, same suit as the up card, probability, removed cards after drawing it). Once
+    # the hand isn't suited, suits don't matter and same suit is always False.
+    def _get_draws(self, num_cards, is_suited, removed):
+        draws = []
+
+        if self.num_decks is None:
+            for value in range(1, self.NUM_VALUES + 1):
+                probability = self.RANKS_PER_VALUE[value] / Card.NUM_RANKS
+
+                if is_suited:
+                    draws.append((value, True, probability / len(Card.CARD_SUITS), None))
+                    draws.append((value, False, probability * (len(Card.CARD_SUITS) - 1) / len(Card.CARD_SUITS), None))
+                else:
+                    draws.append((value, False, probability, None))
+
+            return draws
+
+        num_suits = len(Card.CARD_SUITS)
+        num_remaining = self.num_decks * Card.NUM_CARDS - num_cards
+
+        removed_same_suit, removed_other_suits = removed
+        for value in range(1, self.NUM_VALUES + 1):
+            num_same_suit = self.RANKS_PER_VALUE[value] * self.num_decks - removed_same_suit[value]
+            num_other_suits = self.RANKS_PER_VALUE[value] * self.num_decks * (num_suits - 1) - removed_other_suits[value]
+
+            if is_suited:
+                draws.append((value, True, num_same_suit / num_remaining, (self._add_card(removed_same_suit, value), removed_other_suits)))
+                draws.append((value, False, num_other_suits / num_remaining, (removed_same_suit, self._add_card(removed_other_suits, value))))
+            else:
+                draws.append((value, False, (num_same_suit + num_other_suits) / num_remaining, (removed_same_suit, self._add_card(removed_other_suits, value))))
+
+        return draws
+
+    @staticmethod
+    def _add_card(removed, value):
+        return removed[:value] + (removed[value] + 1,) + removed[value + 1:]
+
+
+class BustBonusControlVariate(object):
+
+    """
+    Control variates for simulated bust bonus results. The dealer's chances of busting, and of busting suited, given
+    the up card are known exactly (BustBonusOdds), so for each round
+
+        bust control   = (non-suited multiplier + 1) * (dealer busted - P(bust | up card))
+        suited control = (suited - non-suited multiplier) * (dealer busted suited - P(suited bust | up card))
+
+    have a mean of exactly 0, and together they follow most of the swings of the bet's result. Subtracting their
+    fitted multiples from the results (see RunningCovariance.get_control_variate_estimate) leaves an unbiased edge
+    estimate with a fraction of the variance. Controls are per $1 bet; the probabilities are off the top of a full
+    shoe of num_decks decks (None = infinite deck), which ignores how far into the shoe each round is dealt.
+    """
+
+    NUM_CONTROLS = 2
+
+    # Bust and suited bust probabilities by (num_decks, hits_soft_17); the exact odds only need to be computed once per
+    # process. The weights depend on the payer's payouts, so they're looked up for every instance.
+    _probs_cache = {}
+
+    def __init__(self, num_decks=None, hits_soft_17=True, payer=None):
+        payer = payer if payer else BustBonusPayer()
+
+        key = (num_decks, hits_soft_17)
+        if key not in self._probs_cache:
+            self._probs_cache[key] = self._get_probs(BustBonusOdds(num_decks=num_decks, hits_soft_17=hits_soft_17, payer=payer))
+
+        # Indexed by up card rank index
+        self.bust_probs, self.suited_probs = self._probs_cache[key]
+
+        up_values = [Card._get_value(rank) for rank in Card.CARD_RANKS]
+        self.bust_weights = [payer.MX_LOOKUP['non-suited'][v] + 1 for v in up_values]
+        self.suited_weights = [payer.MX_LOOKUP['suited'][v] - payer.MX_LOOKUP['non-suited'][v] for v in up_values]
+
+        if np is not None:
+            self._np_tables = [np.array(table) for table in [self.bust_probs, self.bust_weights, self.suited_probs, self.suited_weights]]
+
+    @staticmethod
+    def _get_probs(odds):
+        bust_probs = []
+        suited_probs = []
+
+        for rank in Card.CARD_RANKS:
+            outcomes = odds.get_outcome_probabilities(rank)
+
+            bust_probs.append(1 - outcomes[BustBonusOdds.NO_BUST])
+            suited_probs.append(outcomes[BustBonusOdds.SUITED] + outcomes[BustBonusOdds.SUITED_888])
+
+        return bust_probs, suited_probs
+
+    # Controls for a dealer hand that has been played out
+    def get_controls(self, dealer_hand):
+        cards = dealer_hand.cards
+        up_rank_idx = Card.RANK_INDEXES[cards[0]]
+
+        is_bust = dealer_hand.hard_value > 21
+        is_suited = is_bust and all(Card.SUIT_INDEXES[c] == Card.SUIT_INDEXES[cards[0]] for c in cards)
+
+        return [
+            self.bust_weights[up_rank_idx] * (is_bust - self.bust_probs[up_rank_idx]),
+            self.suited_weights[up_rank_idx] * (is_suited - self.suited_probs[up_rank_idx])
+        ]
+
+    # Vectorized get_controls; arrays of up card rank indexes and flags, returns a [hand, control] array
+    def get_controls_batch(self, up_rank_idxs, is_bust, is_suited):
+        bust_probs, bust_weights, suited_probs, suited_weights = self._np_tables
+
+        return np.column_stack([
+            bust_weights[up_rank_idxs] * (is_bust - bust_probs[up_rank_idxs]),
+            suited_weights[up_rank_idxs] * ((is_bust & is_suited) - suited_probs[up_rank_idxs])
+        ])
@@ -0,0 +1,477 @@
+import math
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.strategy import Strategy, DealerStrategy
+from blackjack_sim.stats import RunningStats
+from blackjack_sim.bonuses import TwentyOne3BonusPayer, BustBonusPayer
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds
+
+
+class BonusSampler(object):
+
+    """
+    Estimates a bonus bet's payout class probabilities, and from them its EV, from the cards left in a simulation's
+    shoes at the start of each of its rounds (see Simulation.log_sampled_bonus_results), so shoe depth and penetration
+    count just like they do in the simulation. Only the cards the bet depends on are drawn, with two variance
+    reductions aimed at the rare, high paying classes:
+
+    - Stratification: every round is sampled once for each dealer up card rank and the strata are combined with the
+      up card's probability given the cards left, so the up card adds no noise.
+    - Importance sampling: cards are drawn from a tilted distribution that favors the cards leading to rare payouts
+      (see the subclasses), and every sample is weighted by its likelihood ratio, the product over its draws of
+      P(card) / P_tilted(card). Weighted class frequencies are unbiased estimates of the untilted probabilities.
+
+    Only the counts of the card categories a bet cares about are tracked (e.g. value and whether it has the up card's
+    suit), which keeps a sample down to a few draws. Without a shoe, rounds are dealt off the top of a full shoe of
+    num_decks decks (None = infinite deck), like the exact odds in bonus_odds.
+
+    The losing outcome (LOSS_OUTCOME) is by far the most likely and the tilts push it into rarely drawn, heavily weighted
+    samples, so its probability is estimated as 1 minus the others instead of from its own weights.
+
+    Rounds are grouped into batches, one per shoe (or BATCH_ROUNDS rounds off the top of a full shoe), and standard
+    errors come from the spread of the batches, since the rounds of a shoe are dealt from the same cards.
+
+    Subclasses set OUTCOMES and LOSS_OUTCOME and implement _start_round, _get_stratum_probability, _sample_stratum and
+    _get_net (see BustBonusSampler).
+    """
+
+    UNIFORM_BATCH_SIZE = 4096
+
+    BATCH_ROUNDS = 100
+
+    OUTCOMES = []
+    LOSS_OUTCOME = None
+
+    def __init__(self, num_decks, rng):
+        if num_decks is not None and num_decks < 1:
+            raise ConfigurationError(f'Invalid # of decks: {num_decks}')
+
+        self.num_decks = num_decks
+        self.rng = rng
+
+        self._uniforms = []
+        self._uniform_idx = 0
+
+        # Card codes of a full shoe (or of one deck for an infinite deck)
+        self._full_card_counts = [num_decks if num_decks else 1] * Card.NUM_CARDS
+
+        # Cards of the current round: [rank index][suit index]
+        self._rank_suit_counts = None
+
+        self.num_rounds = 0
+
+        # Per batch: (# of rounds, per stratum (up card rank index) the sum over the rounds of the stratum's
+        # probability, and per stratum and outcome the sum of the stratum's probability times its mean weight)
+        self._batches = []
+        self._start_batch()
+
+    def _start_batch(self):
+        self._batch_num_rounds = 0
+        self._batch_stratum_sums = [0.0] * Card.NUM_RANKS
+        self._batch_outcome_sums = [{outcome: 0.0 for outcome in self.OUTCOMES} for r in range(Card.NUM_RANKS)]
+
+    # Closes the batch of rounds sampled since the last one; call it when the shoe changes
+    def end_batch(self):
+        if self._batch_num_rounds:
+            self._batches.append((self._batch_num_rounds, self._batch_stratum_sums, self._batch_outcome_sums))
+            self._start_batch()
+
+    # Samples num_rounds more rounds off the top of a full shoe
+    def sample(self, num_rounds):
+        for i in range(num_rounds):
+            self.sample_round()
+
+            if self._batch_num_rounds == self.BATCH_ROUNDS:
+                self.end_batch()
+
+        return self
+
+    # Samples one round from cards (the card codes left in the shoe) or, without them, off the top of a full shoe
+    def sample_round(self, cards=None):
+        if cards is None or self.num_decks is None:
+            card_counts = self._full_card_counts
+        else:
+            card_counts = [0] * Card.NUM_CARDS
+            for card in cards:
+                card_counts[card] += 1
+
+        self._rank_suit_counts = [[card_counts[suit_idx * Card.NUM_RANKS + rank_idx] for suit_idx in range(len(Card.CARD_SUITS))]
+                                  for rank_idx in range(Card.NUM_RANKS)]
+        self._start_round(card_counts)
+
+        for up_rank_idx in range(Card.NUM_RANKS):
+            probability = self._get_stratum_probability(up_rank_idx)
+            if not probability:
+                continue
+
+            outcome, weight = self._sample_stratum(up_rank_idx)
+
+            self._batch_stratum_sums[up_rank_idx] += probability
+            self._batch_outcome_sums[up_rank_idx][outcome] += probability * weight
+
+        self._batch_num_rounds += 1
+        self.num_rounds += 1
+
+    # Draws the suit of an up card of this rank, in proportion to the cards left
+    def _draw_up_suit(self, up_rank_idx):
+        return self._draw(self._rank_suit_counts[up_rank_idx], [1] * len(Card.CARD_SUITS))[0]
+
+    def _random(self):
+        if self._uniform_idx == len(self._uniforms):
+            uniforms = self.rng.random_batch(self.UNIFORM_BATCH_SIZE)
+            self._uniforms = uniforms.tolist() if hasattr(uniforms, 'tolist') else uniforms
+            self._uniform_idx = 0
+
+        self._uniform_idx += 1
+
+        return self._uniforms[self._uniform_idx - 1]
+
+    # Draws a category with probability proportional to counts * tilts; returns (category, P(category) /
+    # P_tilted(category)). Categories with a tilt of 0 can't be drawn at all: the untilted draw is conditioned on them
+    # not coming up either.
+    def _draw(self, counts, tilts):
+        total = 0
+        tilted_total = 0
+        for count, tilt in zip(counts, tilts):
+            if tilt:
+                total += count
+                tilted_total += count * tilt
+
+        x = self._random() * tilted_total
+
+        category = 0
+        for category, (count, tilt) in enumerate(zip(counts, tilts)):
+            x -= count * tilt
+            if x < 0:
+                break
+
+        # Rounding can leave x a hair above 0 at the end; take the last category that can be drawn
+        while not counts[category] * tilts[category]:
+            category -= 1
+
+        return category, tilted_total / (total * tilts[category])
+
+    def _get_batches(self):
+        if self._batch_num_rounds:
+            return self._batches + [(self._batch_num_rounds, self._batch_stratum_sums, self._batch_outcome_sums)]
+
+        return self._batches
+
+    # (estimate, standard error) of the mean over settled bets of coefficient(up rank index, outcome). With
+    # P(loss) = 1 - the others, a batch's sum is the loss coefficient times its stratum sums plus the other outcomes'
+    # coefficients less the loss coefficient times their sums. Dividing by the batches' settled bets makes it a ratio
+    # estimate, with the usual linearized standard error.
+    def _get_estimate(self, coefficient):
+        batches = self._get_batches()
+        if len(batches) < 2:
+            return math.nan, math.inf
+
+        totals = []
+        settled = []
+        for num_rounds, stratum_sums, outcome_sums in batches:
+            total = 0
+            for up_rank_idx in range(Card.NUM_RANKS):
+                loss_coefficient = coefficient(up_rank_idx, self.LOSS_OUTCOME)
+                total += loss_coefficient * stratum_sums[up_rank_idx]
+
+                for outcome, outcome_sum in outcome_sums[up_rank_idx].items():
+                    if outcome != self.LOSS_OUTCOME:
+                        total += (coefficient(up_rank_idx, outcome) - loss_coefficient) * outcome_sum
+
+            totals.append(total)
+            settled.append(sum(stratum_sums))
+
+        n = len(batches)
+        estimate = sum(totals) / sum(settled)
+        variance = n / (n - 1) * sum((t - estimate * s) ** 2 for t, s in zip(totals, settled)) / sum(settled) ** 2
+
+        return estimate, math.sqrt(variance)
+
+    # Estimated probabilities of the up card ranks among the settled bets, and of the outcomes with each of them
+    def _get_stratum_outcome_probabilities(self):
+        batches = self._get_batches()
+
+        stratum_sums = [sum(b[1][r] for b in batches) for r in range(Card.NUM_RANKS)]
+        num_settled = sum(stratum_sums)
+
+        strata = []
+        for up_rank_idx, stratum_sum in enumerate(stratum_sums):
+            if not stratum_sum:
+                continue
+
+            probabilities = {outcome: sum(b[2][up_rank_idx][outcome] for b in batches) / stratum_sum for outcome in self.OUTCOMES if outcome != self.LOSS_OUTCOME}
+            probabilities[self.LOSS_OUTCOME] = 1 - sum(probabilities.values())
+
+            strata.append((up_rank_idx, stratum_sum / num_settled, probabilities))
+
+        return strata
+
+    # Per bet variance of the same estimate from a plain simulation, using the estimated probabilities
+    def _get_plain_variance(self, coefficient):
+        mean = 0
+        mean_square = 0
+        for up_rank_idx, stratum_probability, probabilities in self._get_stratum_outcome_probabilities():
+            for outcome, p in probabilities.items():
+                a = coefficient(up_rank_idx, outcome)
+                mean += stratum_probability * a * p
+                mean_square += stratum_probability * a * a * p
+
+        return mean_square - mean * mean
+
+    # How many times as many rounds a plain simulation would need for the same standard error
+    def _get_variance_reduction(self, coefficient):
+        std_error = self._get_estimate(coefficient)[1]
+        if not 0 < std_error < math.inf:
+            return math.inf if std_error == 0 else math.nan
+
+        num_settled = sum(sum(stratum_sums) for num_rounds, stratum_sums, outcome_sums in self._get_batches())
+
+        return self._get_plain_variance(coefficient) / (num_settled * std_error ** 2)
+
+    def _outcome_coefficient(self, outcome):
+        return lambda up_rank_idx, o: 1 if o == outcome else 0
+
+    def _contribution_coefficient(self, outcome):
+        return lambda up_rank_idx, o: self._get_net(up_rank_idx, o) if o == outcome else 0
+
+    # Key = outcome, value = (probability, standard error)
+    def get_outcome_probabilities(self):
+        return {outcome: self._get_estimate(self._outcome_coefficient(outcome)) for outcome in self.OUTCOMES}
+
+    # Key = outcome, value = (contribution to the EV per $1 bet, standard error, variance reduction vs plain simulation)
+    def get_contributions(self):
+        contributions = {}
+        for outcome in self.OUTCOMES:
+            coefficient = self._contribution_coefficient(outcome)
+            contributions[outcome] = self._get_estimate(coefficient) + (self._get_variance_reduction(coefficient),)
+
+        return contributions
+
+    # (expected net win per $1 bet, standard error, variance reduction vs plain simulation)
+    def get_ev(self):
+        return self._get_estimate(self._get_net) + (self._get_variance_reduction(self._get_net),)
+
+    # (house edge, 95% CI half-width) as %s
+    def get_house_edge(self):
+        ev, std_error = self.get_ev()[:2]
+
+        return -ev * 100, RunningStats.Z_95 * std_error * 100
+
+
+class BustBonusSampler(BonusSampler):
+
+    """
+    Bust bonus sampling: plays out the dealer's hand for each up card. Categories are (card value, same suit as the up
+    card). While the dealer's cards are all suited, cards of the up card's suit are drawn suited_tilt times as often,
+    and while they're all 8s (up to the third card), 8s are drawn eight_tilt times as often; that oversamples suited
+    busts and 888s. The hole card is never one that gives the dealer blackjack, since the bet isn't settled then.
+
+    The dealer's cards are drawn from the cards left at the start of the round; the players' cards of the round
+    aren't taken out first, the same simplification the exact odds make.
+    """
+
+    DEFAULT_SUITED_TILT = 3
+    DEFAULT_EIGHT_TILT = 10
+
+    OUTCOMES = BustBonusOdds.OUTCOMES
+    LOSS_OUTCOME = BustBonusOdds.NO_BUST
+
+    def __init__(self, num_decks=None, hits_soft_17=True, rng=None, payer=None, suited_tilt=DEFAULT_SUITED_TILT, eight_tilt=DEFAULT_EIGHT_TILT):
+        super().__init__(num_decks, rng)
+
+        self.payer = payer if payer else BustBonusPayer()
+        self.suited_tilt = suited_tilt
+        self.eight_tilt = eight_tilt
+
+        self._dealer_actions = DealerStrategy(hits_soft_17=hits_soft_17).actions
+
+        # Category = 2 * (value - 1) + (0 if same suit as the up card else 1)
+        self._category_values = [c // 2 + 1 for c in range(2 * BustBonusOdds.NUM_VALUES)]
+        self._category_suited = [c % 2 == 0 for c in range(2 * BustBonusOdds.NUM_VALUES)]
+
+        self._rank_values = [Card._get_value(rank) for rank in Card.CARD_RANKS]
+
+        # Value of the hole card that would give the dealer blackjack, per up card rank index
+        self._blackjack_hole_values = [10 if v == 1 else 1 if v == 10 else None for v in self._rank_values]
+
+        # Category counts of the round's cards relative to each suit, and # of cards of each value
+        self._suit_category_counts = None
+        self._value_counts = None
+        self._num_cards = 0
+
+    # Called with the counts of the card codes left before a round's strata are sampled
+    def _start_round(self, card_counts):
+        num_suits = len(Card.CARD_SUITS)
+
+        value_suit_counts = [[0] * num_suits for v in range(BustBonusOdds.NUM_VALUES + 1)]
+        for rank_idx, suit_counts in enumerate(self._rank_suit_counts):
+            for suit_idx, n in enumerate(suit_counts):
+                value_suit_counts[self._rank_values[rank_idx]][suit_idx] += n
+
+        self._value_counts = [sum(suit_counts) for suit_counts in value_suit_counts]
+        self._num_cards = sum(self._value_counts)
+
+        self._suit_category_counts = []
+        for suit_idx in range(num_suits):
+            counts = []
+            for value in range(1, BustBonusOdds.NUM_VALUES + 1):
+                counts.append(value_suit_counts[value][suit_idx])
+                counts.append(self._value_counts[value] - value_suit_counts[value][suit_idx])
+
+            self._suit_category_counts.append(counts)
+
+    # Probability that the up card has this rank and the bet is settled, given the cards left
+    def _get_stratum_probability(self, up_rank_idx):
+        num_up_cards = sum(self._rank_suit_counts[up_rank_idx])
+        if not num_up_cards:
+            return 0
+
+        hole_value = self._blackjack_hole_values[up_rank_idx]
+        num_hole_cards = self._num_cards - (1 if self.num_decks else 0)
+        not_blackjack = 1 - self._value_counts[hole_value] / num_hole_cards if hole_value else 1
+
+        return num_up_cards / self._num_cards * not_blackjack
+
+    # Net win per $1 bet for an outcome with this up card
+    def _get_net(self, up_rank_idx, outcome):
+        up_value = self._rank_values[up_rank_idx]
+
+        if outcome == BustBonusOdds.SUITED:
+            return self.payer.MX_LOOKUP['suited'][up_value]
+        elif outcome == BustBonusOdds.NON_SUITED:
+            return self.payer.MX_LOOKUP['non-suited'][up_value]
+        elif outcome == BustBonusOdds.SUITED_888:
+            return self.payer.SUITED_888_MX
+        elif outcome == BustBonusOdds.NON_SUITED_888:
+            return self.payer.NON_SUITED_888_MX
+        else:
+            return -1
+
+    # Returns (outcome, likelihood ratio) of one sample with this up card rank
+    def _sample_stratum(self, up_rank_idx):
+        finite = self.num_decks is not None
+
+        up_value = self._rank_values[up_rank_idx]
+        counts = list(self._suit_category_counts[self._draw_up_suit(up_rank_idx)])
+
+        if finite:
+            counts[2 * (up_value - 1)] -= 1
+
+        hole_value = self._blackjack_hole_values[up_rank_idx]
+
+        hard_value = up_value
+        has_ace = up_value == 1
+        num_cards = 1
+        is_suited = True
+        is_eights = up_value == 8
+
+        weight = 1.0
+        while True:
+            tilts = []
+            for value, suited in zip(self._category_values, self._category_suited):
+                if num_cards == 1 and value == hole_value:
+                    tilts.append(0)
+                else:
+                    tilts.append((self.suited_tilt if is_suited and suited else 1) * (self.eight_tilt if is_eights and num_cards < 3 and value == 8 else 1))
+
+            category, ratio = self._draw(counts, tilts)
+            weight *= ratio
+
+            if finite:
+                counts[category] -= 1
+
+            value = self._category_values[category]
+            hard_value += value
+            has_ace = has_ace or value == 1
+            num_cards += 1
+            is_suited = is_suited and self._category_suited[category]
+            is_eights = is_eights and value == 8
+
+            if hard_value > 21:
+                if is_eights and num_cards == 3:
+                    return (BustBonusOdds.SUITED_888 if is_suited else BustBonusOdds.NON_SUITED_888), weight
+                else:
+                    return (BustBonusOdds.SUITED if is_suited else BustBonusOdds.NON_SUITED), weight
+
+            is_soft = has_ace and hard_value <= 11
+            if self._dealer_actions[DealerStrategy.get_table_idx(hard_value, is_soft)] != Strategy.HIT:
+                return BustBonusOdds.NO_BUST, weight
+
+
+class TwentyOne3BonusSampler(BonusSampler):
+
+    """
+    21+3 sampling: draws a player's 2 cards for each up card. Categories are (rank index, same suit as the up card).
+    Cards of the up card's suit are drawn suited_tilt times as often and ranks that can make trips or a straight with
+    the up card near_tilt times as often, which oversamples straight flushes, trips and straights.
+    """
+
+    DEFAULT_SUITED_TILT = 3
+    DEFAULT_NEAR_TILT = 3
+
+    OUTCOMES = TwentyOne3BonusOdds.OUTCOMES
+    LOSS_OUTCOME = TwentyOne3BonusOdds.NO_WIN
+
+    def __init__(self, num_decks, rng=None, payer=None, suited_tilt=DEFAULT_SUITED_TILT, near_tilt=DEFAULT_NEAR_TILT):
+        super().__init__(num_decks, rng)
+
+        self.payer = payer if payer else TwentyOne3BonusPayer()
+        self.suited_tilt = suited_tilt
+        self.near_tilt = near_tilt
+
+        self._multipliers = TwentyOne3BonusOdds(num_decks, payer=self.payer).get_multipliers()
+
+        # Category = 2 * rank index + (0 if same suit as the up card else 1)
+        self._category_ranks = [c // 2 for c in range(2 * Card.NUM_RANKS)]
+        self._category_suited = [c % 2 == 0 for c in range(2 * Card.NUM_RANKS)]
+
+        # Tilts per up card rank index
+        self._tilts = []
+        for up_rank_idx in range(Card.NUM_RANKS):
+            near_ranks = {r for r in range(Card.NUM_RANKS)
+                          if r == up_rank_idx or any(TwentyOne3BonusOdds._is_straight((up_rank_idx, r, x)) for x in range(Card.NUM_RANKS))}
+
+            self._tilts.append([(suited_tilt if suited else 1) * (near_tilt if rank in near_ranks else 1)
+                                for rank, suited in zip(self._category_ranks, self._category_suited)])
+
+        # Category counts of the round's cards relative to each suit
+        self._suit_category_counts = None
+        self._num_cards = 0
+
+    def _start_round(self, card_counts):
+        self._num_cards = sum(card_counts)
+
+        self._suit_category_counts = []
+        for suit_idx in range(len(Card.CARD_SUITS)):
+            counts = []
+            for suit_counts in self._rank_suit_counts:
+                counts.append(suit_counts[suit_idx])
+                counts.append(sum(suit_counts) - suit_counts[suit_idx])
+
+            self._suit_category_counts.append(counts)
+
+    def _get_stratum_probability(self, up_rank_idx):
+        return sum(self._rank_suit_counts[up_rank_idx]) / self._num_cards
+
+    def _get_net(self, up_rank_idx, outcome):
+        return self._multipliers[outcome] if outcome in self._multipliers else -1
+
+    def _sample_stratum(self, up_rank_idx):
+        counts = self._suit_category_counts[self._draw_up_suit(up_rank_idx)]
+        tilts = self._tilts[up_rank_idx]
+
+        if self.num_decks is not None:
+            counts = list(counts)
+            counts[2 * up_rank_idx] -= 1
+
+        category_1, ratio_1 = self._draw(counts, tilts)
+
+        if self.num_decks is not None:
+            counts[category_1] -= 1
+
+        category_2, ratio_2 = self._draw(counts, tilts)
+
+        rank_idxs = (up_rank_idx, self._category_ranks[category_1], self._category_ranks[category_2])
+        is_flush = self._category_suited[category_1] and self._category_suited[category_2]
+
+        return TwentyOne3BonusOdds.classify(rank_idxs, is_flush), ratio_1 * ratio_2
@@ -1,4 +1,6 @@
 from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.stats import RunningStats, RunningCovariance
 
 
 class BonusPlan(object):
@@ -11,11 +13,33 @@ class BonusPlan(object):
         # Dictionary of bet amount based on card lookup; 0 means no bet
         self.dealer_up_card_lookup = bonus_config['dealer_up_card_lookup'] if 'dealer_up_card_lookup' in bonus_config else None
 
+        # Same bet amounts indexed by card rank index so the per-round lookup doesn't need the rank string
+        self._dealer_up_card_bets = [self.dealer_up_card_lookup[rank] for rank in Card.CARD_RANKS] if self.dealer_up_card_lookup else None
+
         self.num_times_played = 0
         self.num_wins = 0
         self.num_losses = 0
         self.net_amount = 0
 
+        # Net amount of each bet played; for the confidence interval of the house edge
+        self.stats = RunningStats()
+
+        # Estimate the edge with control variates too (bust bonus only; see BustBonusControlVariate)
+        self.control_variate = bool(int(bonus_config['control_variate'])) if 'control_variate' in bonus_config else False
+
+        # Net amount and control values of each bet played; created with the first result that has controls
+        self.control_stats = None
+
+    # A bonus_bets entry is either a plan config or a list of them (see BlackjackPlayer)
+    @staticmethod
+    def get_configs(bonus_config):
+        configs = bonus_config if isinstance(bonus_config, list) else [bonus_config]
+
+        if not configs:
+            raise ConfigurationError('Empty list of bonus plans')
+
+        return configs
+
     """
         Frequency options:
         21+3: always
@@ -24,16 +48,16 @@ class BonusPlan(object):
     def will_play_bonus_bet(self, dealer_up_card=None):
         if self.frequency == 'always':
             return True
-        elif self.frequency == 'dealer_up_card_lookup' and dealer_up_card:
-            return self.dealer_up_card_lookup[dealer_up_card.rank] > 0
+        elif self.frequency == 'dealer_up_card_lookup' and dealer_up_card is not None:
+            return self._dealer_up_card_bets[Card.RANK_INDEXES[dealer_up_card]] > 0
         else:
             return False
 
     def get_bet_amount(self, dealer_up_card=None):
         if self._amount:
             return self._amount
-        elif self.dealer_up_card_lookup and dealer_up_card:
-            return self.dealer_up_card_lookup[dealer_up_card.rank]
+        elif self.dealer_up_card_lookup and dealer_up_card is not None:
+            return self._dealer_up_card_bets[Card.RANK_INDEXES[dealer_up_card]]
 
     def get_avg_bet_amount(self):
         if self._amount:
@@ -47,7 +71,8 @@ class BonusPlan(object):
                     num_valid_bets +=1
             return total / num_valid_bets
 
-    def record_bonus_result(self, payout, bet_amount):
+    # controls, if given, are the round's control variates per $1 bet
+    def record_bonus_result(self, payout, bet_amount, controls=None):
         self.num_times_played += 1
 
         if payout:
@@ -59,6 +84,63 @@ class BonusPlan(object):
             self.num_losses += 1
             self.net_amount -= bet_amount
 
+        self.stats.add(payout if payout else -bet_amount)
+
+        if self.control_variate and controls is not None:
+            if self.control_stats is None:
+                self.control_stats = RunningCovariance(1 + len(controls))
+
+            self.control_stats.add([payout if payout else -bet_amount] + [bet_amount * c for c in controls])
+
+    # Bulk version of record_bonus_result; net_amount is the total of the payouts less the lost bets and stats, if
+    # given, the RunningStats of the same bets. control_stats is the RunningCovariance of the same bets' net amounts and
+    # controls
+    def record_bonus_results(self, num_wins, num_losses, net_amount, stats=None, control_stats=None):
+        self.num_times_played += num_wins + num_losses
+        self.num_wins += num_wins
+        self.num_losses += num_losses
+        self.net_amount += net_amount
+
+        if stats is not None:
+            self.stats.merge(stats)
+
+        self._merge_control_stats(control_stats)
+
+    # Combine the counters of the same plan from another part (shard) of the simulation
+    def merge(self, other):
+        self.num_times_played += other.num_times_played
+        self.num_wins += other.num_wins
+        self.num_losses += other.num_losses
+        self.net_amount += other.net_amount
+        self.stats.merge(other.stats)
+        self._merge_control_stats(other.control_stats)
+
+    def _merge_control_stats(self, control_stats):
+        if control_stats is None or not control_stats.count:
+            return
+
+        if self.control_stats is None:
+            self.control_stats = RunningCovariance(control_stats.num_values)
+
+        self.control_stats.merge(control_stats)
+
+    # Half-width of the 95% confidence interval of the house edge, as a %
+    def get_edge_ci_halfwidth(self):
+        avg_bet_amt = self.get_avg_bet_amount()
+
+        return (self.stats.ci_halfwidth() / avg_bet_amt) * 100 if avg_bet_amt else 0
+
+    # (house edge, 95% CI half-width, variance reduction factor) using the control variates, as %s; None without them
+    def get_control_variate_edge(self):
+        avg_bet_amt = self.get_avg_bet_amount()
+
+        if self.control_stats is None or not self.control_stats.count or not avg_bet_amt:
+            return None
+
+        estimate, std_error, variance_reduction = self.control_stats.get_control_variate_estimate()
+
+        return -(estimate / avg_bet_amt) * 100, (RunningStats.Z_95 * std_error / avg_bet_amt) * 100, variance_reduction
+
     def get_result_str(self):
         pct_win = (self.num_wins / self.num_times_played) * 100 if self.num_times_played > 0 else 0
         pct_loss = (self.num_losses / self.num_times_played) * 100 if self.num_times_played > 0 else 0
@@ -67,61 +149,29 @@ class BonusPlan(object):
         avg_bet_amt = self.get_avg_bet_amount()
         edge = -((net_change_per_hand / avg_bet_amt) * 100) if avg_bet_amt > 0 else 0
 
-        return f'{self.name}: Played={self.num_times_played}, Avg Bet: ${round(avg_bet_amt, 2)}, Wins={self.num_wins} ({round(pct_win, 1)}%), Losses={self.num_losses} ({round(pct_loss, 1)}%), ' \
-               + f'Net: ${self.net_amount}, House Edge: {round(edge, 2)}%'
+        result_str = f'{self.name}: Played={self.num_times_played}, Avg Bet: ${round(avg_bet_amt, 2)}, Wins={self.num_wins} ({round(pct_win, 1)}%), Losses={self.num_losses} ({round(pct_loss, 1)}%), ' \
+                     + f'Net: ${self.net_amount}, House Edge: {round(edge, 2)}% ± {round(self.get_edge_ci_halfwidth(), 2)}%'
 
+        control_variate_edge = self.get_control_variate_edge()
+        if control_variate_edge:
+            cv_edge, cv_halfwidth, variance_reduction = control_variate_edge
+            result_str += f', Control Variate House Edge: {round(cv_edge, 2)}% ± {round(cv_halfwidth, 2)}% ({round(variance_reduction, 1)}x less variance)'
 
-class BonusPayer(object):
+        return result_str
 
-    SUIT_LOOKUP = {
-        'C': 0,
-        'D': 1,
-        'H': 2,
-        'S': 3
-    }
 
-    ACE_LOW_RANK_LOOKUP = {
-        'A': 0,
-        '2': 1,
-        '3': 2,
-        '4': 3,
-        '5': 4,
-        '6': 5,
-        '7': 6,
-        '8': 7,
-        '9': 8,
-        'T': 9,
-        'J': 10,
-        'Q': 11,
-        'K': 12
-    }
+class BonusPayer(object):
 
-    ACE_HIGH_RANK_LOOKUP = {
-        '2': 1,
-        '3': 2,
-        '4': 3,
-        '5': 4,
-        '6': 5,
-        '7': 6,
-        '8': 7,
-        '9': 8,
-        'T': 9,
-        'J': 10,
-        'Q': 11,
-        'K': 12,
-        'A': 13
-    }
+    # Straight ranking of each card code; aces are either low (below 2) or high (above K)
+    ACE_LOW_RANKS = tuple(Card.NUM_RANKS - rank_idx if rank_idx != Card.ACE_RANK_INDEX else 0 for rank_idx in Card.RANK_INDEXES)
+    ACE_HIGH_RANKS = tuple(Card.NUM_RANKS - rank_idx for rank_idx in Card.RANK_INDEXES)
 
     def __init__(self):
         pass
 
     def _is_straight(self, cards, rank_lookup):
 
-        sorted_cards = sorted(cards, key=lambda c: rank_lookup[c.rank])
-
-        card_1_idx = rank_lookup[sorted_cards[0].rank]
-        card_2_idx = rank_lookup[sorted_cards[1].rank]
-        card_3_idx = rank_lookup[sorted_cards[2].rank]
+        card_1_idx, card_2_idx, card_3_idx = sorted(rank_lookup[c] for c in cards)
 
         if card_1_idx + 1 == card_2_idx and card_2_idx + 1 == card_3_idx:
             return True
@@ -129,11 +179,12 @@ class BonusPayer(object):
             return False
 
     def _is_flush(self, cards):
-        suits_found = {}
+        suit_idx = Card.SUIT_INDEXES[cards[0]]
         for card in cards:
-            suits_found[card.suit] = 1
+            if Card.SUIT_INDEXES[card] != suit_idx:
+                return False
 
-        return len(suits_found.keys()) == 1
+        return True
 
 
 class TwentyOne3BonusPayer(BonusPayer):
@@ -149,6 +200,23 @@ class TwentyOne3BonusPayer(BonusPayer):
     STRAIGHT_MX = 10
     FLUSH_MX = 5
 
+    PAYOUT_KEYS = {
+        'straight_flush': 'STRAIGHT_FLUSH_MX',
+        'trips': 'TRIPLES_MX',
+        'straight': 'STRAIGHT_MX',
+        'flush': 'FLUSH_MX'
+    }
+
+    # payouts overrides any of the multipliers above, e.g. {"straight_flush": 40, "flush": 4}
+    def __init__(self, payouts=None):
+        super().__init__()
+
+        for key, mx in (payouts or {}).items():
+            if key not in self.PAYOUT_KEYS:
+                raise ConfigurationError(f'Unknown 21+3 payout: {key}')
+
+            setattr(self, self.PAYOUT_KEYS[key], int(mx))
+
     def get_payout(self, dealer_up_card, player_hand, bonus_bet):
         if len(player_hand.cards) != 2:
             raise GameplayError(f'Incorrect # of cards ({len(player_hand.cards)}) in player hand for 21+3 bonus')
@@ -159,22 +227,22 @@ class TwentyOne3BonusPayer(BonusPayer):
 
         contains_ace = False
         for c in all_cards:
-            if c.rank == 'A':
+            if Card.RANK_INDEXES[c] == Card.ACE_RANK_INDEX:
                 contains_ace = True
 
         # Check for straight
-        is_straight = self._is_straight(all_cards, self.ACE_LOW_RANK_LOOKUP)
+        is_straight = self._is_straight(all_cards, self.ACE_LOW_RANKS)
 
         # If an ace exists (player or dealer) and ace low wasn't a straight then try ace high
         if not is_straight and contains_ace:
-            is_straight = self._is_straight(all_cards, self.ACE_HIGH_RANK_LOOKUP)
+            is_straight = self._is_straight(all_cards, self.ACE_HIGH_RANKS)
 
         # Check for flush
         is_flush = self._is_flush(all_cards)
 
         # Check for trips
         is_trips = False
-        if all_cards[0].rank == all_cards[1].rank == all_cards[2].rank:
+        if Card.RANK_INDEXES[all_cards[0]] == Card.RANK_INDEXES[all_cards[1]] == Card.RANK_INDEXES[all_cards[2]]:
             is_trips = True
 
         if is_straight and is_flush:
@@ -205,6 +273,9 @@ class BustBonusPayer(BonusPayer):
       888:  25:1          75:1
     """
 
+    SUITED_888_MX = 75
+    NON_SUITED_888_MX = 25
+
     # Keys are value of the dealer up card.
     # 888 is a special case that will be handled separately.
     MX_LOOKUP = {
@@ -234,6 +305,32 @@ class BustBonusPayer(BonusPayer):
         }
     }
 
+    # payouts overrides any of the multipliers above, e.g. {"suited_888": 100, "suited": {"1": 40}}; suited and
+    # non-suited are keyed by up card value
+    def __init__(self, payouts=None):
+        super().__init__()
+
+        payouts = payouts or {}
+        for key in payouts:
+            if key not in ['suited', 'non-suited', 'suited_888', 'non_suited_888']:
+                raise ConfigurationError(f'Unknown bust bonus payout: {key}')
+
+        if 'suited_888' in payouts:
+            self.SUITED_888_MX = int(payouts['suited_888'])
+
+        if 'non_suited_888' in payouts:
+            self.NON_SUITED_888_MX = int(payouts['non_suited_888'])
+
+        if 'suited' in payouts or 'non-suited' in payouts:
+            self.MX_LOOKUP = {payout_set: dict(mx_lookup) for payout_set, mx_lookup in self.MX_LOOKUP.items()}
+
+            for payout_set in ['suited', 'non-suited']:
+                for value, mx in payouts.get(payout_set, {}).items():
+                    if int(value) not in self.MX_LOOKUP[payout_set]:
+                        raise ConfigurationError(f'Invalid up card value for {payout_set} bust bonus payout: {value}')
+
+                    self.MX_LOOKUP[payout_set][int(value)] = int(mx)
+
     def get_payout(self, dealer_hand, bonus_bet):
         multiplier = 0
 
@@ -241,13 +338,16 @@ class BustBonusPayer(BonusPayer):
 
             is_flush = self._is_flush(dealer_hand.cards)
 
-            if len(dealer_hand.cards) == 3 and dealer_hand.cards[0].value == 8 and dealer_hand.cards[1].value == 8 and dealer_hand.cards[2].value == 8:
+            values = Card.VALUES
+            cards = dealer_hand.cards
+
+            if len(cards) == 3 and values[cards[0]] == 8 and values[cards[1]] == 8 and values[cards[2]] == 8:
                 # 888
-                multiplier = 75 if is_flush else 25
+                multiplier = self.SUITED_888_MX if is_flush else self.NON_SUITED_888_MX
             else:
                 # just check up card
                 payout_set = 'suited' if is_flush else 'non-suited'
-                multiplier = self.MX_LOOKUP[payout_set][dealer_hand.cards[0].value]
+                multiplier = self.MX_LOOKUP[payout_set][values[cards[0]]]
 
         return multiplier * bonus_bet
 
@@ -0,0 +1,100 @@
+class Card(int):
+
+    """
+    Cards are encoded as small ints (0-51): suit index * 13 + rank index, where the rank index is the position in
+    CARD_RANKS. Shoes and hands hold the plain ints and everything about a card is looked up in the tables below, which
+    keeps the hot path free of string comparisons. Card(suit, rank) is only a convenience for building specific cards,
+    and the string forms are only needed for logging.
+
+    Cards in hands are sorted in the order shown in CARD_RANKS when looking up strategy actions.
+    Changing the ordering here will likely break the strategy lookup.
+    """
+    CARD_RANKS = ['A', 'K', 'Q', 'J', 'T', '9', '8', '7', '6', '5', '4', '3', '2']
+    CARD_SUITS = ['C', 'D', 'H', 'S']
+
+    NUM_RANKS = len(CARD_RANKS)
+    NUM_CARDS = len(CARD_RANKS) * len(CARD_SUITS)
+
+    ACE_RANK_INDEX = 0
+
+    CARD_STRATEGY_RANK_LOOKUP = {
+        '2': 0,
+        '3': 1,
+        '4': 2,
+        '5': 3,
+        '6': 4,
+        '7': 5,
+        '8': 6,
+        '9': 7,
+        'T': 8,
+        'A': 9
+    }
+
+    # Lookup tables indexed by card code; filled in below the class
+    RANK_INDEXES = ()
+    SUIT_INDEXES = ()
+    VALUES = ()
+    DEALER_UP_CARD_INDEXES = ()
+    RANK_STRS = ()
+
+    def __new__(cls, suit, rank):
+        return super().__new__(cls, cls.encode(suit, rank))
+
+    # Pickle and copy rebuild the card from its suit and rank
+    def __getnewargs__(self):
+        return self.suit, self.rank
+
+    def __str__(self):
+        return self.to_str(self)
+
+    def __repr__(self):
+        return f'Card({self.suit!r}, {self.rank!r})'
+
+    @property
+    def rank(self):
+        return self.RANK_STRS[self]
+
+    @property
+    def suit(self):
+        return self.CARD_SUITS[self.SUIT_INDEXES[self]]
+
+    # hard value
+    @property
+    def value(self):
+        return self.VALUES[self]
+
+    # used to look up strategy action to take based on dealer up card
+    @property
+    def dealer_up_card_index(self):
+        return self.DEALER_UP_CARD_INDEXES[self]
+
+    @classmethod
+    def encode(cls, suit, rank):
+        return cls.CARD_SUITS.index(suit) * cls.NUM_RANKS + cls.CARD_RANKS.index(rank)
+
+    @classmethod
+    def to_str(cls, code):
+        return cls.RANK_STRS[code]
+
+    @staticmethod
+    def _get_value(rank):
+        if rank in ['2', '3', '4', '5', '6', '7', '8', '9']:
+            return int(rank)
+        elif rank in ['T', 'J', 'Q', 'K']:
+            return 10
+        else:
+            return 1  # A
+
+    @classmethod
+    def _get_dealer_up_card_index(cls, rank):
+        if rank in ['K', 'Q', 'J']:
+            rank = 'T'
+
+        return cls.CARD_STRATEGY_RANK_LOOKUP[rank]
+
+
+Card.RANK_INDEXES = tuple(code % Card.NUM_RANKS for code in range(Card.NUM_CARDS))
+Card.SUIT_INDEXES = tuple(code // Card.NUM_RANKS for code in range(Card.NUM_CARDS))
+Card.RANK_STRS = tuple(Card.CARD_RANKS[rank_idx] for rank_idx in Card.RANK_INDEXES)
+Card.VALUES = tuple(Card._get_value(rank) for rank in Card.RANK_STRS)
+Card.DEALER_UP_CARD_INDEXES = tuple(Card._get_dealer_up_card_index(rank) for rank in Card.RANK_STRS)
@@ -0,0 +1,140 @@
+import json
+import os
+import pickle
+import tempfile
+import time
+from blackjack_sim.errors import *
+
+
+class Checkpoints(object):
+
+    """
+    Checkpoint files of one simulation in a directory, so a run that dies part way through can be resumed. Every
+    shard has its own file: the shard's ShardResult once it's finished, before that the state it was left in every
+    interval seconds (see Simulation.get_shard_state). Shards are played from their own random streams, so a resumed
+    run finishes the unfinished shards exactly like the first run would have and gets the same results.
+
+    run.json holds the config the run was started with; a run can only be resumed with the same settings. Every file is
+    written to a temp file and renamed over the old one, so a crash mid-write leaves the last complete checkpoint; temp
+    files a crash leaves behind are removed when the run is resumed.
+    """
+
+    VERSION = 1
+
+    RUN_FILE_NAME = 'run.json'
+
+    # Files being written; a run killed mid-write leaves one behind
+    TEMP_FILE_PREFIX = '.tmp-'
+
+    DEFAULT_INTERVAL = 5  # seconds between checkpoints of a shard
+
+    # Settings that don't change the results, so they may differ when resuming
+    RESUMABLE_CONFIG_KEYS = ['workers', 'verbose', 'resume', 'checkpoint_path', 'checkpoint_interval', 'shoe_prefetch_producers', 'shoe_prefetch_slots']
+
+    # Shard state
+    FINISHED = 'finished'
+    PARTIAL = 'partial'
+
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.interval = interval if interval is not None else self.DEFAULT_INTERVAL
+
+        if self.interval < 0:
+            raise ConfigurationError(f'Invalid checkpoint interval: {self.interval}')
+
+        self._next_time = None
+
+    @staticmethod
+    def get_shard_file_name(session_idx, shard_idx):
+        return f'shard-{session_idx:05d}-{shard_idx:06d}.pkl'
+
+    # Config the run in the directory was started with, or None if there isn't one
+    def load_run_config(self):
+        run_file_path = os.path.join(self.path, self.RUN_FILE_NAME)
+
+        if not os.path.exists(run_file_path):
+            return None
+
+        with open(run_file_path, 'r') as f:
+            run = json.load(f)
+
+        if run['version'] != self.VERSION:
+            raise ConfigurationError(f'Unsupported checkpoint version {run["version"]} in {self.path}')
+
+        return run['config']
+
+    # Starts a new run in the directory, or with resume continues the one that's there; config is the simulation's
+    # worker config
+    def start(self, config, resume=False):
+        run_config = self.load_run_config() if resume else None
+
+        if run_config is not None:
+            changed_keys = sorted(k for k in set(run_config) | set(config)
+                                  if k not in self.RESUMABLE_CONFIG_KEYS and run_config.get(k) != config.get(k))
+
+            if changed_keys:
+                raise ConfigurationError(f'Can\'t resume the run in {self.path} with different settings: {", ".join(changed_keys)}')
+
+            self._remove_files(self.TEMP_FILE_PREFIX)
+            return
+
+        # Shards of an earlier run would otherwise be picked up by a later resume
+        os.makedirs(self.path, exist_ok=True)
+        self._remove_files('shard-', self.TEMP_FILE_PREFIX)
+
+        self._write(self.RUN_FILE_NAME, json.dumps({'version': self.VERSION, 'config': config}, indent=2).encode())
+
+    # (state, value) of the shard's checkpoint; value is a ShardResult if FINISHED, the shard state if PARTIAL.
+    # None if the shard hasn't been checkpointed.
+    def load_shard(self, shard):
+        try:
+            with open(os.path.join(self.path, self.get_shard_file_name(shard.session_idx, shard.shard_idx)), 'rb') as f:
+                checkpoint = pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+        if checkpoint['version'] != self.VERSION or checkpoint['shard'] != tuple(shard):
+            raise ConfigurationError(f'Checkpoint of shard {shard.session_idx}/{shard.shard_idx} in {self.path} is for another run')
+
+        return checkpoint['state'], checkpoint['value']
+
+    # Saves the state of a shard that's being played if the interval has passed since the last one; get_state is only
+    # called when it's saved
+    def save_partial_shard(self, shard, get_state):
+        now = time.monotonic()
+
+        if self._next_time is None:
+            self._next_time = now + self.interval
+        elif now >= self._next_time:
+            self._save_shard(shard, self.PARTIAL, get_state())
+            self._next_time = time.monotonic() + self.interval
+
+    def save_finished_shard(self, shard, shard_result):
+        self._save_shard(shard, self.FINISHED, shard_result)
+        self._next_time = None
+
+    def _save_shard(self, shard, state, value):
+        checkpoint = {'version': self.VERSION, 'shard': tuple(shard), 'state': state, 'value': value}
+
+        self._write(self.get_shard_file_name(shard.session_idx, shard.shard_idx), pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL))
+
+    # Removes the files in the directory whose names start with any of the prefixes
+    def _remove_files(self, *prefixes):
+        for name in os.listdir(self.path):
+            if name.startswith(prefixes):
+                os.remove(os.path.join(self.path, name))
+
+    # Atomic write: the file is either the old one or the new one, never part of the new one
+    def _write(self, name, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=self.TEMP_FILE_PREFIX)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_path, os.path.join(self.path, name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
@@ -0,0 +1,315 @@
+import hashlib
+import logging
+import os
+import tempfile
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.recording import RoundRecorder, RoundRecording
+from blackjack_sim.rng import RandomStream
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.utils import Utils
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RecordedRounds(object):
+
+    """
+    The rounds of one part of a recording (see RoundRecording.get_columns) as plain Python values, one round at a time,
+    so two engines' versions of a round can be compared with == and dumped.
+    """
+
+    def __init__(self, name, num_rounds, num_players, columns):
+        self.name = name
+        self.num_rounds = num_rounds
+        self.num_players = num_players
+        self.columns = columns
+
+        # Where each round's dealer cards, each seat's hands and each hand's cards start in the flat columns
+        self._dealer_offsets = self._get_offsets(columns['dealer_num_cards'])
+        self._hand_offsets = self._get_offsets(columns['num_hands'])
+        self._card_offsets = self._get_offsets(columns['num_cards'])
+
+    @staticmethod
+    def _get_offsets(lengths):
+        return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+    # Dict of the round's values, or None past the end of the part
+    def get_round(self, round_idx):
+        if round_idx >= self.num_rounds:
+            return None
+
+        columns = self.columns
+        dealer_start, dealer_end = self._dealer_offsets[round_idx:round_idx + 2]
+
+        seats = []
+        for seat_idx in range(round_idx * self.num_players, (round_idx + 1) * self.num_players):
+            hands = []
+            for hand_idx in range(self._hand_offsets[seat_idx], self._hand_offsets[seat_idx + 1]):
+                card_start, card_end = self._card_offsets[hand_idx:hand_idx + 2]
+
+                hands.append({
+                    'cards': columns['hand_card'][card_start:card_end].tolist(),
+                    'bet': float(columns['bet'][hand_idx]),
+                    'result': int(columns['result'][hand_idx]),
+                    'blackjack': bool(columns['blackjack'][hand_idx]),
+                    'doubled': bool(columns['doubled'][hand_idx])
+                })
+
+            seats.append({
+                'cards': [int(columns['card_1'][seat_idx]), int(columns['card_2'][seat_idx])],
+                'net': float(columns['net'][seat_idx]),
+                'net_21_3': float(columns['net_21_3'][seat_idx]),
+                'net_bust': float(columns['net_bust'][seat_idx]),
+                'hands': hands
+            })
+
+        return {'dealer_cards': columns['dealer_card'][dealer_start:dealer_end].tolist(), 'seats': seats}
+
+
+class RoundDivergence(object):
+
+    """
+    The first round where an engine's recording differs from the reference engine's: where it is, which of its values
+    differ and both versions of the round. round_idx counts rounds over the whole recording, in part order.
+    """
+
+    RESULT_STRS = {RoundRecorder.LOSS: 'LOSS', RoundRecorder.PUSH: 'PUSH', RoundRecorder.WIN: 'WIN'}
+
+    def __init__(self, reference_engine, engine, part_name, part_round_idx, round_idx, reference_round, engine_round):
+        self.reference_engine = reference_engine
+        self.engine = engine
+        self.part_name = part_name
+        self.part_round_idx = part_round_idx
+        self.round_idx = round_idx
+        self.reference_round = reference_round
+        self.engine_round = engine_round
+
+        self.differences = self.get_differences(reference_round, engine_round)
+
+    # Names of the values that differ, e.g. 'dealer cards' or 'seat 2 hand 1 bet'
+    @staticmethod
+    def get_differences(reference_round, engine_round):
+        if reference_round is None or engine_round is None:
+            return ['round played']
+
+        differences = []
+        if reference_round['dealer_cards'] != engine_round['dealer_cards']:
+            differences.append('dealer cards')
+
+        for seat_idx, (reference_seat, engine_seat) in enumerate(zip(reference_round['seats'], engine_round['seats'])):
+            for key in ['cards', 'net', 'net_21_3', 'net_bust']:
+                if reference_seat[key] != engine_seat[key]:
+                    differences.append(f'seat {seat_idx + 1} {key.replace("_", " ")}')
+
+            if len(reference_seat['hands']) != len(engine_seat['hands']):
+                differences.append(f'seat {seat_idx + 1} # of hands')
+
+            for hand_idx, (reference_hand, engine_hand) in enumerate(zip(reference_seat['hands'], engine_seat['hands'])):
+                differences.extend(f'seat {seat_idx + 1} hand {hand_idx + 1} {key}' for key in reference_hand if reference_hand[key] != engine_hand[key])
+
+        return differences
+
+    def get_report_lines(self):
+        lines = [f'{self.engine} engine diverges from the {self.reference_engine} engine at round {self.round_idx} '
+                 f'(round {self.part_round_idx} of {self.part_name}): {", ".join(self.differences)}']
+
+        for engine, recorded_round in [(self.reference_engine, self.reference_round), (self.engine, self.engine_round)]:
+            lines.append(f'{engine}:')
+            lines.extend(f'  {line}' for line in self.format_round(recorded_round))
+
+        return lines
+
+    @classmethod
+    def format_round(cls, recorded_round):
+        if recorded_round is None:
+            return ['(not played)']
+
+        lines = [f'Dealer: {cls.format_cards(recorded_round["dealer_cards"])}']
+
+        for seat_idx, seat in enumerate(recorded_round['seats']):
+            split_str = f', split to {len(seat["hands"])} hands' if len(seat['hands']) > 1 else ''
+            lines.append(f'Seat {seat_idx + 1}: {cls.format_cards(seat["cards"])}{split_str}, net {seat["net"]:+g} '
+                         f'(21+3 {seat["net_21_3"]:+g}, bust {seat["net_bust"]:+g})')
+
+            for hand_idx, hand in enumerate(seat['hands']):
+                lines.append(f'  Hand {hand_idx + 1}: {cls.format_cards(hand["cards"])}, bet {hand["bet"]:g}, '
+                             f'{cls.RESULT_STRS.get(hand["result"], hand["result"])}, actions: {cls.get_actions(hand)}')
+
+        return lines
+
+    # Cards with suits and the best value of the hand, e.g. 'AS 7D (18)'
+    @staticmethod
+    def format_cards(cards):
+        return f'{" ".join(Card.to_str(c) + Card.CARD_SUITS[Card.SUIT_INDEXES[c]] for c in cards)} ({get_hand_value(cards)})'
+
+    # The actions that produced a hand: a doubled hand got one card for its double, and otherwise every card past the
+    # second is a hit
+    @staticmethod
+    def get_actions(hand):
+        if hand['blackjack']:
+            return 'blackjack'
+
+        if hand['doubled']:
+            return 'double'
+
+        actions = ['hit'] * (len(hand['cards']) - 2)
+        actions.append('bust' if get_hand_value(hand['cards']) > 21 else 'stand')
+
+        return ', '.join(actions)
+
+
+class DifferentialHarness(object):
+
+    """
+    Plays the same seeded shoes on the reference engine (the object engine, Simulation.play_round) and on another
+    engine, records both runs (see RoundRecorder) and compares the recordings round by round. A recorded round has
+    everything an engine decides: the dealer's cards, each seat's hands (splits and hits show in the hands' cards,
+    doubles are flagged), their results and the change of each seat's stack, in total and from each bonus bet. The first
+    round that differs is reported with both engines' version of it.
+
+    Engines deal the same shoes as the reference engine only if they play one table at a time, so the batch engine
+    runs with a single table. Each run's round stream can also be hashed (see get_round_stream_hash), so a change in
+    what the engines play shows up as a changed hash without running the reference engine.
+    """
+
+    REFERENCE_ENGINE = 'object'
+
+    # Settings that make an engine deal the reference engine's shoes
+    ENGINE_CONFIGS = {
+        'object': {},
+        'batch': {'batch_tables': 1}
+    }
+
+    # Settings of a run that don't apply to a comparison
+    IGNORED_CONFIG_KEYS = ['record_path', 'checkpoint_path', 'resume', 'phase_timing', 'bonus_counts_path']
+
+    def __init__(self, sim_config, strategy_config, idx=0, path=None):
+        if np is None:
+            raise ConfigurationError('Comparing engines requires NumPy')
+
+        # Both engines need the same seed
+        self.sim_config = dict({k: v for k, v in sim_config.items() if k not in self.IGNORED_CONFIG_KEYS}, workers=1, verbose=0)
+        self.sim_config.setdefault('seed', RandomStream.new_seed())
+
+        self.strategy_config = strategy_config
+        self.idx = idx
+        self.path = path
+
+        self.log = Utils.get_logger(f'DifferentialHarness-{idx}', logging.INFO)
+
+    # Harness with the settings of a configured simulation, including its seed
+    @classmethod
+    def from_simulation(cls, sim, path=None):
+        return cls(sim.worker_config, sim.strategy, idx=sim.idx, path=path)
+
+    # Plays the simulation on the engine and returns its recording. The shards are played directly rather than with
+    # Simulation.run, which logs an engine's errors and carries on, so a crash raises instead of showing up as rounds
+    # the engine didn't play.
+    def run_engine(self, engine, path):
+        if engine not in self.ENGINE_CONFIGS:
+            raise ConfigurationError(f'Unknown engine: {engine}')
+
+        sim = Simulation(self.idx, dict(self.sim_config, engine=engine, record_path=path, **self.ENGINE_CONFIGS[engine]), self.strategy_config)
+        sim.log.setLevel(logging.WARNING)
+        sim.run_shards(sim.get_shards())
+
+        return RoundRecording(path)
+
+    # Returns the first RoundDivergence between the engine and the reference engine, or None if they played the same
+    def compare(self, engine):
+        if self.path:
+            return self._compare(engine, self.path)
+
+        with tempfile.TemporaryDirectory() as path:
+            return self._compare(engine, path)
+
+    def _compare(self, engine, path):
+        reference = self.run_engine(self.REFERENCE_ENGINE, os.path.join(path, self.REFERENCE_ENGINE))
+        recording = self.run_engine(engine, os.path.join(path, engine))
+
+        return self.compare_recordings(reference, recording, engine)
+
+    @classmethod
+    def compare_recordings(cls, reference, recording, engine):
+        if reference.num_players != recording.num_players:
+            raise ConfigurationError(f'Recordings have different # of players: {reference.num_players} and {recording.num_players}')
+
+        first_round_idx = 0
+        for part_idx in range(max(len(reference.parts), len(recording.parts))):
+            reference_rounds = cls.get_recorded_rounds(reference, part_idx)
+            engine_rounds = cls.get_recorded_rounds(recording, part_idx)
+
+            # Whole columns are compared first, so only a part that differs is walked round by round
+            if reference_rounds and engine_rounds and reference_rounds.name == engine_rounds.name \
+                    and reference_rounds.num_rounds == engine_rounds.num_rounds \
+                    and all(np.array_equal(values, engine_rounds.columns[column]) for column, values in reference_rounds.columns.items()):
+                first_round_idx += reference_rounds.num_rounds
+                continue
+
+            part_name = (reference_rounds or engine_rounds).name
+            num_rounds = max(rounds.num_rounds if rounds else 0 for rounds in [reference_rounds, engine_rounds])
+
+            for r in range(num_rounds):
+                reference_round = reference_rounds.get_round(r) if reference_rounds else None
+                engine_round = engine_rounds.get_round(r) if engine_rounds and engine_rounds.name == part_name else None
+
+                if reference_round != engine_round:
+                    return RoundDivergence(cls.REFERENCE_ENGINE, engine, part_name, r, first_round_idx + r, reference_round, engine_round)
+
+            first_round_idx += num_rounds
+
+        return None
+
+    @staticmethod
+    def get_recorded_rounds(recording, part_idx):
+        if part_idx >= len(recording.parts):
+            return None
+
+        num_rounds, columns = recording.get_columns(part_idx)
+
+        return RecordedRounds(recording.parts[part_idx][0], num_rounds, recording.num_players, columns)
+
+    # Hash of every recorded round, in part order; independent of the machine's byte order
+    @staticmethod
+    def get_round_stream_hash(recording):
+        stream_hash = hashlib.sha256(f'{recording.num_players}'.encode())
+
+        for part_idx, (name, meta) in enumerate(recording.parts):
+            num_rounds, columns = recording.get_columns(part_idx)
+            stream_hash.update(f'{name}:{num_rounds}'.encode())
+
+            for column in sorted(columns):
+                stream_hash.update(column.encode())
+                stream_hash.update(np.ascontiguousarray(columns[column], dtype=columns[column].dtype.newbyteorder('<')).tobytes())
+
+        return stream_hash.hexdigest()
+
+    # Hash of the round stream the engine plays
+    def get_engine_hash(self, engine):
+        with tempfile.TemporaryDirectory() as path:
+            return self.get_round_stream_hash(self.run_engine(engine, os.path.join(path, engine)))
+
+    def log_comparison(self, engine):
+        divergence = self.compare(engine)
+
+        if divergence:
+            for line in divergence.get_report_lines():
+                self.log.info(line)
+        else:
+            self.log.info(f'{engine} engine plays the same rounds as the {self.REFERENCE_ENGINE} engine: {self.sim_config["name"]}, seed {self.sim_config["seed"]}')
+
+        return divergence
+
+
+# Best value of the cards: an ace counts as 11 if that doesn't bust the hand
+def get_hand_value(cards):
+    value = sum(Card.VALUES[c] for c in cards)
+
+    if value <= 11 and any(Card.RANK_INDEXES[c] == Card.ACE_RANK_INDEX for c in cards):
+        value += 10
+
+    return value
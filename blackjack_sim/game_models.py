@@ -1,99 +1,186 @@
+import math
 from enum import Enum
-from random import randint
 from blackjack_sim.errors import *
+from blackjack_sim.rng import RandomStream
+from blackjack_sim.stats import RunningStats
+from blackjack_sim.cards import *
 from blackjack_sim.bonuses import *
 
 
-class Card(object):
+class Deck(object):
+
+    def __init__(self):
+        # Card codes; ordered by suit then rank
+        self.cards = list(range(Card.NUM_CARDS))
+
+class Shoe(object):
 
     """
-    Cards in hands are sorted in the order shown in CARD_RANKS when looking up strategy actions.
-    Changing the ordering here will likely break the strategy lookup.
+    Shuffled cards stored as one byte per card code. Cards are dealt by advancing a read cursor, so dealing,
+    remaining() and the cut card check are all O(1).
+
+    The cut card sits behind the first cut_card_position cards; it's reached once a card behind it has been dealt.
     """
-    CARD_RANKS = ['A', 'K', 'Q', 'J', 'T', '9', '8', '7', '6', '5', '4', '3', '2']
-    CARD_SUITS = ['C', 'D', 'H', 'S']
 
-    CARD_STRATEGY_RANK_LOOKUP = {
-        '2': 0,
-        '3': 1,
-        '4': 2,
-        '5': 3,
-        '6': 4,
-        '7': 5,
-        '8': 6,
-        '9': 7,
-        'T': 8,
-        'A': 9
-    }
+    def __init__(self, cards, cut_card_position=None):
+        self._cards = cards if isinstance(cards, (bytes, memoryview)) else bytes(cards)
+        self._cursor = 0
+        self.cut_card_position = len(self._cards) if cut_card_position is None else cut_card_position
 
+    def __len__(self):
+        return self.remaining()
 
-    def __init__(self, suit, rank):
-        self.suit = suit
-        self.rank = rank
+    def __iter__(self):
+        return iter(self._cards[self._cursor:])
 
-        # hard value
-        self.value = self._get_value()
+    def size(self):
+        return len(self._cards)
 
-        # used to look up strategy action to take based on dealer up card
-        self.dealer_up_card_index = self._get_dealer_up_card_index()
+    def remaining(self):
+        return len(self._cards) - self._cursor
 
-    def __str__(self):
-        return f'{self.rank}'
+    # Fraction of the shoe that has been dealt
+    def penetration(self):
+        return self._cursor / len(self._cards)
 
-    def _get_value(self):
-        if self.rank in ['2', '3', '4', '5', '6', '7', '8', '9']:
-            return int(self.rank)
-        elif self.rank in ['T', 'J', 'Q', 'K']:
-            return 10
-        else:
-            return 1  # A
+    def is_cut_card_reached(self):
+        return self._cursor > self.cut_card_position
 
-    def _get_dealer_up_card_index(self):
-        rank = self.rank
-        if rank in ['K', 'Q', 'J']:
-            rank = 'T'
+    def deal(self):
+        if self._cursor >= len(self._cards):
+            raise GameplayError('Tried to deal from empty shoe')
 
-        return self.CARD_STRATEGY_RANK_LOOKUP[rank]
+        card = self._cards[self._cursor]
+        self._cursor += 1
 
-class Deck(object):
+        return card
 
-    def __init__(self):
-        self.cards = []
-        for suit in Card.CARD_SUITS:
-            for rank in Card.CARD_RANKS:
-                self.cards.append(Card(suit, rank))
+    # Deal the next k cards at once
+    def deal_many(self, k):
+        if self._cursor + k > len(self._cards):
+            raise GameplayError(f'Tried to deal {k} cards from shoe with {self.remaining()} cards')
+
+        cards = self._cards[self._cursor:self._cursor + k]
+        self._cursor += k
 
-# Instead of creating all Deck and Card objects every time we need a shoe, this keeps master copies to copy and return.
-# Over thousands of hands this makes a significant difference in performance.
+        return cards
+
+# Instead of creating the Deck every time we need a shoe, this keeps a master copy to copy and return.
+# Shoes are shuffled in batches by the factory's RandomStream; with a NumPy backend a whole batch is one vectorized
+# permutation of the master shoe, with the stdlib backend each shoe in the batch gets a Fisher-Yates shuffle.
 class ShoeFactory(object):
 
-    def __init__(self, num_decks):
+    def __init__(self, num_decks, rng=None):
+        # Each factory shuffles from its own random stream so that shards of a simulation can be reproduced independently
+        self._rng = rng if rng else RandomStream.create()
+
+        # Batch n is always shuffled by child stream n, so any batch can be regenerated on its own
+        self._num_batches = 0
+
         self._deck_cards_master = Deck().cards
-        self._shoe_cards_master = []
-        for i in range(num_decks):
-            # Make a copy of the deck
-            deck = self._deck_cards_master[:]
-            for card in deck:
-                self._shoe_cards_master.append(card)
-
-    def get_shoe(self):
+        self._shoe_cards_master = bytes(self._deck_cards_master * num_decks)
+
+    def get_shoe(self, cut_card_position=None):
         # Return a shuffled copy of the master shoe
-        new_shoe = self._shoe_cards_master[:]
+        return Shoe(self.get_shoe_batch(1)[0], cut_card_position=cut_card_position)
+
+    def get_shoe_size(self):
+        return len(self._shoe_cards_master)
+
+    # Returns num_shoes shuffled copies of the master shoe; a (num_shoes, 52 * num_decks) uint8 array with a NumPy
+    # backend, otherwise a list of lists of card codes
+    def get_shoe_batch(self, num_shoes):
+        shoes = self.shuffle_batch(self._num_batches, num_shoes)
+        self._num_batches += 1
+
+        return shoes
+
+    # Shuffle batch # batch_idx of this factory's stream of batches
+    def shuffle_batch(self, batch_idx, num_shoes):
+        return self._rng.spawn(batch_idx).shuffled_batch(self._shoe_cards_master, num_shoes)
+
+class InfiniteShoe(Shoe):
+
+    """
+    A shoe that never runs out: cards come from a stream of chunks of cards drawn with replacement (see
+    InfiniteShoeFactory), so there's no card removal, no cut card and no reshuffling. next_cards() returns the next
+    chunk whenever the current one runs out.
+    """
+
+    def __init__(self, next_cards):
+        super().__init__(next_cards())
+        self._next_cards = next_cards
+
+    def __len__(self):
+        return len(self._cards) - self._cursor
+
+    def remaining(self):
+        return math.inf
+
+    def penetration(self):
+        return 0
+
+    def is_cut_card_reached(self):
+        return False
+
+    def deal(self):
+        if self._cursor >= len(self._cards):
+            self._refill()
+
+        return super().deal()
+
+    def deal_many(self, k):
+        while self._cursor + k > len(self._cards):
+            self._refill()
+
+        return super().deal_many(k)
+
+    def _refill(self):
+        self._cards = bytes(self._cards[self._cursor:]) + bytes(self._next_cards())
+        self._cursor = 0
+
+    # The source of chunks isn't pickled with the shoe; an unpickled shoe needs set_next_cards() before it can refill
+    def __getstate__(self):
+        return dict(self.__dict__, _next_cards=None)
+
+    def set_next_cards(self, next_cards):
+        self._next_cards = next_cards
+
+
+# Same interface as ShoeFactory, but each "shoe" is a chunk of shoe size cards drawn independently, with replacement,
+# from the card distribution of a deck. Every card code is equally likely in a deck, so a card is one uniform draw of
+# its code, a whole batch at a time.
+class InfiniteShoeFactory(object):
+
+    def __init__(self, num_decks, rng=None):
+        self._rng = rng if rng else RandomStream.create()
+
+        self._num_batches = 0
+
+        self._shoe_size = num_decks * Card.NUM_CARDS
+
+    def get_shoe(self, cut_card_position=None):
+        return InfiniteShoe(lambda: self.get_shoe_batch(1)[0])
+
+    def get_shoe_size(self):
+        return self._shoe_size
+
+    def get_shoe_batch(self, num_shoes):
+        shoes = self.shuffle_batch(self._num_batches, num_shoes)
+        self._num_batches += 1
 
-        return self.shuffle(new_shoe)
+        return shoes
 
-    # Fisher-Yates shuffle; implementation taken from here:
-    # https://www.geeksforgeeks.org/shuffle-a-given-array-using-fisher-yates-shuffle-algorithm/
-    @staticmethod
-    def shuffle(arr):
-        n = len(arr)
-        for i in range(n - 1, 0, -1):
-            j = randint(0, i)
+    # Batch # batch_idx of this factory's stream; num_shoes rows of shoe size cards, a uint8 array with a NumPy
+    # backend, otherwise a list of lists of card codes
+    def shuffle_batch(self, batch_idx, num_shoes):
+        cards = self._rng.spawn(batch_idx).randint_batch(0, Card.NUM_CARDS - 1, num_shoes * self._shoe_size)
 
-            # Swap arr[i] with the element at random index
-            arr[i], arr[j] = arr[j], arr[i]
+        if isinstance(cards, list):
+            return [cards[s * self._shoe_size:(s + 1) * self._shoe_size] for s in range(num_shoes)]
+
+        return cards.astype('uint8').reshape(num_shoes, self._shoe_size)
 
-        return arr
 
 class BlackjackHandResult(Enum):
     UNDETERMINED = 0,
@@ -103,9 +190,16 @@ class BlackjackHandResult(Enum):
 
 class BlackjackHand(object):
 
+    __slots__ = ['player', 'cards', 'hard_value', 'soft_value', 'contains_ace', 'is_blackjack', 'is_dealer_hand', 'result', 'bet', 'is_doubled']
+
     def __init__(self, player, dealer_hand, bet=0):
-        self.player = player
         self.cards = []
+        self.reset(player=player, dealer_hand=dealer_hand, bet=bet)
+
+    # Empty the hand so the object can be reused for another round
+    def reset(self, player, dealer_hand, bet=0):
+        self.player = player
+        self.cards.clear()
         self.hard_value = 0         # All hands have a hard value
         self.soft_value = None      # Hands may not have a soft value
         self.contains_ace = False
@@ -114,19 +208,20 @@ class BlackjackHand(object):
         self.result = BlackjackHandResult.UNDETERMINED
 
         self.bet = bet
+        self.is_doubled = False
 
     def __str__(self):
         hand_str = ''
         for card in self.cards:
-            hand_str += card.__str__()
+            hand_str += Card.to_str(card)
         return f'{hand_str} ({self.hard_value}/{self.soft_value})'
 
     def get_hand_as_ranks(self):
         # Sort by the order in CARD_RANKS. This only really matters for looking up soft hands.
-        sorted_cards = sorted(self.cards, key=lambda c: Card.CARD_RANKS.index(c.rank))
+        sorted_cards = sorted(self.cards, key=Card.RANK_INDEXES.__getitem__)
         hand_str = ''
         for card in sorted_cards:
-            hand_str += card.rank
+            hand_str += Card.RANK_STRS[card]
         return hand_str
 
     def add_card(self, card):
@@ -134,17 +229,30 @@ class BlackjackHand(object):
             raise GameplayError(f'Tried to add card to hand with hard value of {self.hard_value}')
 
         else:
+            # Values are updated incrementally; O(1) per card
             self.cards.append(card)
-            self.calculate_value()
 
+            hard_value = self.hard_value + Card.VALUES[card]
+            self.hard_value = hard_value
+
+            if Card.RANK_INDEXES[card] == Card.ACE_RANK_INDEX:
+                self.contains_ace = True
+
+            # Only 1 ace in a hand can count as 11 and only if that won't make the total greater than 21
+            self.soft_value = 10 + hard_value if self.contains_ace and hard_value <= 11 else None
+
+            self.is_blackjack = self.soft_value == 21 and len(self.cards) == 2
+
+    # Recalculates the values from all of the cards; needed when a card is removed
     def calculate_value(self):
         self.hard_value = 0
         self.soft_value = None
+        self.contains_ace = False
 
         for card in self.cards:
-            self.hard_value += card.value
+            self.hard_value += Card.VALUES[card]
 
-            if card.rank == 'A':
+            if Card.RANK_INDEXES[card] == Card.ACE_RANK_INDEX:
                 self.contains_ace = True
 
         # Only 1 ace in a hand can count as 11 and only if that won't make the total greater than 21
@@ -159,38 +267,87 @@ class BlackjackHand(object):
         else:
             return self.hard_value
 
-    def split_hand(self):
+    # Moves the 2nd card to a new hand; pass new_hand to reuse a hand object instead of allocating one
+    def split_hand(self, new_hand=None):
         if self.is_dealer_hand:
             raise GameplayError('Tried to split dealer hand')
 
         if len(self.cards) != 2:
             raise GameplayError(f'Can\'t split hand with {len(self.cards)} cards')
 
-        if self.cards[0].rank != self.cards[1].rank:
+        if Card.RANK_INDEXES[self.cards[0]] != Card.RANK_INDEXES[self.cards[1]]:
             raise GameplayError('Tried to split hand with unmatched cards')
 
-        new_hand = BlackjackHand(player=self.player, dealer_hand=False)
+        if new_hand is None:
+            new_hand = BlackjackHand(player=self.player, dealer_hand=False)
+        else:
+            new_hand.reset(player=self.player, dealer_hand=False)
+
         new_hand.add_card(self.cards.pop())
+        self.calculate_value()
 
         return new_hand
 
+# Hands are reused across rounds instead of being allocated for every player every round. A table acquires hands as
+# it deals and splits, and releases all of them at the start of the next round.
+class BlackjackHandPool(object):
+
+    def __init__(self):
+        self._hands = []
+        self._num_in_use = 0
+
+    def acquire(self, player, dealer_hand, bet=0):
+        if self._num_in_use < len(self._hands):
+            hand = self._hands[self._num_in_use]
+            hand.reset(player=player, dealer_hand=dealer_hand, bet=bet)
+        else:
+            hand = BlackjackHand(player=player, dealer_hand=dealer_hand, bet=bet)
+            self._hands.append(hand)
+
+        self._num_in_use += 1
+
+        return hand
+
+    def release_all(self):
+        self._num_in_use = 0
+
+    def get_num_allocated(self):
+        return len(self._hands)
+
 class BlackjackSession(object):
 
-    def __init__(self, idx, num_players, buyin, bonus_config=None):
+    def __init__(self, idx, num_players, buyin, bonus_config=None, blackjack_payout=None):
         self.session_idx = idx
         self.num_hands_played = 0
         self.num_players = num_players
 
         self.players = []
         for p in range(self.num_players):
-            self.players.append(BlackjackPlayer(idx=p, buyin=buyin, bonus_config=bonus_config))
+            self.players.append(BlackjackPlayer(idx=p, buyin=buyin, bonus_config=bonus_config, blackjack_payout=blackjack_payout))
+
+    # Combine the results of another part (shard) of the same session into this one
+    def merge(self, other):
+        if other.num_players != self.num_players:
+            raise GameplayError(f'Tried to merge session with {other.num_players} players into session with {self.num_players} players')
+
+        self.num_hands_played += other.num_hands_played
+
+        for player, other_player in zip(self.players, other.players):
+            player.merge(other_player)
 
 class BlackjackPlayer(object):
 
-    def __init__(self, idx, buyin=0, bonus_config=None):
+    __slots__ = ['player_idx', 'buyin', 'chip_stack', 'num_hands_played', 'num_wins', 'num_pushes', 'num_losses', 'allowed_to_split',
+                 'num_split_hands_dict', 'hands', 'bonus_plans_21_3', 'bonus_plans_bust', 'bonus_plan_21_3', 'bonus_plan_bust', 'round_start_stack',
+                 'round_net_21_3', 'round_net_bust', 'round_stats', 'blackjack_payout']
+
+    DEFAULT_BLACKJACK_PAYOUT = 1.5  # 3:2
+
+    def __init__(self, idx, buyin=0, bonus_config=None, blackjack_payout=None):
         self.player_idx = idx
         self.buyin = buyin
         self.chip_stack = buyin
+        self.blackjack_payout = blackjack_payout if blackjack_payout is not None else self.DEFAULT_BLACKJACK_PAYOUT
         self.num_hands_played = 0
         self.num_wins = 0
         self.num_pushes = 0
@@ -203,13 +360,48 @@ class BlackjackPlayer(object):
 
         self.hands = []  # list of BlackjackHand objects; will be multiple when we split
 
-        self.bonus_plan_21_3 = BonusPlan(bonus_config['21_3']) if bonus_config and '21_3' in bonus_config else None
-        self.bonus_plan_bust = BonusPlan(bonus_config['bust']) if bonus_config and 'bust' in bonus_config else None
+        # The first plan of each bonus bet is the one the player bets. Any others are alternatives that are settled on
+        # the same rounds and reported alongside it, but don't change the chip stack.
+        self.bonus_plans_21_3 = [BonusPlan(c) for c in BonusPlan.get_configs(bonus_config['21_3'])] if bonus_config and '21_3' in bonus_config else []
+        self.bonus_plans_bust = [BonusPlan(c) for c in BonusPlan.get_configs(bonus_config['bust'])] if bonus_config and 'bust' in bonus_config else []
+
+        self.bonus_plan_21_3 = self.bonus_plans_21_3[0] if self.bonus_plans_21_3 else None
+        self.bonus_plan_bust = self.bonus_plans_bust[0] if self.bonus_plans_bust else None
+
+        # Net change of the chip stack in each round, bonus bets included; for the confidence interval of the house edge
+        self.round_start_stack = buyin
+        self.round_stats = RunningStats()
+
+        # Net of the bonus bets the player bet this round, for the recorder
+        self.round_net_21_3 = 0
+        self.round_net_bust = 0
 
 
     def reset_hands(self):
-        self.hands = []
+        self.hands.clear()
         self.allowed_to_split = True
+        self.round_start_stack = self.chip_stack
+        self.round_net_21_3 = 0
+        self.round_net_bust = 0
+
+    # Called once the round's hands and bonus bets have all been settled
+    def record_round(self):
+        self.round_stats.add(self.chip_stack - self.round_start_stack)
+
+    # Combine the counters of the same player from another part (shard) of the session
+    def merge(self, other):
+        self.chip_stack += other.chip_stack - other.buyin
+        self.num_hands_played += other.num_hands_played
+        self.num_wins += other.num_wins
+        self.num_pushes += other.num_pushes
+        self.num_losses += other.num_losses
+        self.round_stats.merge(other.round_stats)
+
+        for num_hands, num_times in other.num_split_hands_dict.items():
+            self.num_split_hands_dict[num_hands] = self.num_split_hands_dict.get(num_hands, 0) + num_times
+
+        for plan, other_plan in zip(self.bonus_plans_21_3 + self.bonus_plans_bust, other.bonus_plans_21_3 + other.bonus_plans_bust):
+            plan.merge(other_plan)
 
     def add_hand(self, bj_hand, split_limit):
         self.hands.append(bj_hand)
@@ -217,34 +409,37 @@ class BlackjackPlayer(object):
             self.allowed_to_split = False
 
     def will_play_21_3_bonus(self):
-        return True if self.bonus_plan_21_3 and self.bonus_plan_21_3.will_play_bonus_bet() else False
+        return any(plan.will_play_bonus_bet() for plan in self.bonus_plans_21_3)
 
     def will_play_bust_bonus(self, dealer_up_card):
-        return True if self.bonus_plan_bust and self.bonus_plan_bust.will_play_bonus_bet(dealer_up_card=dealer_up_card) else False
+        return any(plan.will_play_bonus_bet(dealer_up_card=dealer_up_card) for plan in self.bonus_plans_bust)
 
-    def record_21_3_bonus_result(self, payout):
-        bet_amt = self.bonus_plan_21_3.get_bet_amount()
+    # Payouts are the payer's multiplier times the bet, so the payer is only asked once for all of the plans
+    def record_21_3_bonus_result(self, multiplier):
+        self.round_net_21_3 = self._record_bonus_results(self.bonus_plans_21_3, multiplier)
 
-        self.bonus_plan_21_3.record_bonus_result(payout=payout, bet_amount=bet_amt)
+    # controls are the round's control variates, if any plan estimates with them (see BustBonusControlVariate)
+    def record_bust_bonus_result(self, multiplier, dealer_up_card, controls=None):
+        self.round_net_bust = self._record_bonus_results(self.bonus_plans_bust, multiplier, dealer_up_card=dealer_up_card, controls=controls)
 
-        if payout:
-            # win
-            self.chip_stack += payout
-        else:
-            # loss
-            self.chip_stack -= bet_amt
+    # Returns the change of the chip stack
+    def _record_bonus_results(self, plans, multiplier, dealer_up_card=None, controls=None):
+        net = 0
+        for plan_idx, plan in enumerate(plans):
+            if not plan.will_play_bonus_bet(dealer_up_card=dealer_up_card):
+                continue
 
-    def record_bust_bonus_result(self, payout, dealer_up_card):
-        bet_amt = self.bonus_plan_bust.get_bet_amount(dealer_up_card=dealer_up_card)
+            bet_amt = plan.get_bet_amount(dealer_up_card=dealer_up_card)
+            payout = multiplier * bet_amt
 
-        self.bonus_plan_bust.record_bonus_result(payout=payout, bet_amount=bet_amt)
+            plan.record_bonus_result(payout=payout, bet_amount=bet_amt, controls=controls)
 
-        if payout:
-            # win
-            self.chip_stack += payout
-        else:
-            # loss
-            self.chip_stack -= bet_amt
+            # Only the plan the player bets changes the stack
+            if plan_idx == 0:
+                net = payout if payout else -bet_amt
+                self.chip_stack += net
+
+        return net
 
     def record_hand_result(self, bj_hand):
         self.num_hands_played += 1
@@ -258,8 +453,8 @@ class BlackjackPlayer(object):
         if bj_hand.result == BlackjackHandResult.WIN:
             self.num_wins += 1
 
-            # pay player; 3:2 for blackjack
-            self.chip_stack += 1.5 * bj_hand.bet if bj_hand.is_blackjack else bj_hand.bet
+            # pay player; 3:2 for blackjack unless configured otherwise
+            self.chip_stack += self.blackjack_payout * bj_hand.bet if bj_hand.is_blackjack else bj_hand.bet
 
         elif bj_hand.result == BlackjackHandResult.PUSH:
             self.num_pushes += 1
@@ -275,6 +470,25 @@ class BlackjackPlayer(object):
         else:
             raise GameplayError('Tried to record unknown result')
 
+    # Bulk version of record_hand_result for counts tallied outside of hand objects (see batch_engine)
+    def record_hand_results(self, num_wins, num_pushes, num_losses, net_change, num_split_hands_dict=None, round_stats=None):
+        self.num_hands_played += num_wins + num_pushes + num_losses
+        self.num_wins += num_wins
+        self.num_pushes += num_pushes
+        self.num_losses += num_losses
+        self.chip_stack += net_change
+
+        if round_stats is not None:
+            self.round_stats.merge(round_stats)
+
+        if num_split_hands_dict:
+            for num_hands, num_times in num_split_hands_dict.items():
+                self.num_split_hands_dict[num_hands] = self.num_split_hands_dict.get(num_hands, 0) + num_times
+
+    # Half-width of the 95% confidence interval of the house edge per round, as a %
+    def get_edge_ci_halfwidth(self, min_bet):
+        return (self.round_stats.ci_halfwidth() / min_bet) * 100 if min_bet > 0 else 0
+
     def get_gameplay_result_str(self, min_bet):
         pct_win = (self.num_wins / self.num_hands_played) * 100 if self.num_hands_played > 0 else 0
         pct_push = (self.num_pushes / self.num_hands_played) * 100 if self.num_hands_played > 0 else 0
@@ -292,6 +506,11 @@ class BlackjackPlayer(object):
 
         results.append(f'Stack: ${self.chip_stack}, Net Change: ${net_change}, NC Per Hand: ${round(net_change_per_hand, 2)}, House Edge: {round(edge, 2)}%')
 
+        # Per round (initial bet) rather than per hand, so the rounds are independent samples for the confidence interval
+        if self.round_stats.count:
+            round_edge = -((self.round_stats.mean / min_bet) * 100) if min_bet > 0 else 0
+            results.append(f'House Edge Per Round: {round(round_edge, 2)}% ± {round(self.get_edge_ci_halfwidth(min_bet), 2)}% (95% CI, {self.round_stats.count} rounds)')
+
         sorted_num_split_hands = {k: v for k, v in sorted(self.num_split_hands_dict.items())}
 
         for num_hands, num_times in sorted_num_split_hands.items():
@@ -300,11 +519,9 @@ class BlackjackPlayer(object):
             results.append(f'Split to {num_hands}: {num_times} ({round(this_pct_split, 2)}%)')
 
         # Bonus results
-        if self.bonus_plan_21_3:
-            results.append(self.bonus_plan_21_3.get_result_str())
-
-        if self.bonus_plan_bust:
-            results.append(self.bonus_plan_bust.get_result_str())
+        for plans in [self.bonus_plans_21_3, self.bonus_plans_bust]:
+            for plan_idx, plan in enumerate(plans):
+                results.append(plan.get_result_str() + (' (alternative, not bet)' if plan_idx > 0 else ''))
 
         return '\n'.join(results)
 
@@ -0,0 +1,247 @@
+import json
+import os
+import sys
+from array import array
+from blackjack_sim.errors import *
+from blackjack_sim.game_models import BlackjackHandResult
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RoundRecorder(object):
+
+    """
+    Writes every round of a shard to a directory of column files (a part); RoundRecording reads the parts of a
+    recording back as memory mapped arrays. Each column is a flat file of fixed width values, so a column can be mapped
+    and sliced without parsing anything. Variable length data is stored as a flat column plus a column of lengths:
+
+        rounds:       dealer_num_cards             one row per round
+        dealer_cards: dealer_card                  every card of the dealer's hand in order, up card first
+        seats:        card_1, card_2, num_hands, net, net_21_3, net_bust
+                                                   one row per player per round; the player's first 2 cards, and
+                                                   the change of the chip stack in the round, in total and from
+                                                   each bonus bet the player bet
+        hands:        bet, result, blackjack, doubled, num_cards
+                                                   one row per hand of each seat, in the order the hands were created
+        hand_cards:   hand_card                    every card of each hand in order
+
+    Cards are card codes. The hands are enough to re-settle the main bets (see ReplayEngine) and, with the dealer's
+    cards and the first 2 cards of each seat, the bonus bets too; the player's actions show in the hands: splits in
+    num_hands, doubles in doubled and every other card past the second is a hit.
+
+    Bets and nets are stored as 8 byte floats, like the chip stacks they come from, so they're exact whatever the bets
+    and payouts.
+
+    meta.json is written last by close(), so a part without one is incomplete and isn't read.
+    """
+
+    VERSION = 1
+
+    # Column: (table, array typecode, NumPy dtype)
+    COLUMNS = {
+        'dealer_num_cards': ('rounds', 'B', 'u1'),
+        'dealer_card': ('dealer_cards', 'B', 'u1'),
+        'card_1': ('seats', 'B', 'u1'),
+        'card_2': ('seats', 'B', 'u1'),
+        'num_hands': ('seats', 'B', 'u1'),
+        'net': ('seats', 'd', 'f8'),
+        'net_21_3': ('seats', 'd', 'f8'),
+        'net_bust': ('seats', 'd', 'f8'),
+        'bet': ('hands', 'd', 'f8'),
+        'result': ('hands', 'B', 'u1'),
+        'blackjack': ('hands', 'B', 'u1'),
+        'doubled': ('hands', 'B', 'u1'),
+        'num_cards': ('hands', 'B', 'u1'),
+        'hand_card': ('hand_cards', 'B', 'u1')
+    }
+
+    # Hand results
+    LOSS = 1
+    PUSH = 2
+    WIN = 3
+
+    RESULT_CODES = {
+        BlackjackHandResult.LOSS: LOSS,
+        BlackjackHandResult.PUSH: PUSH,
+        BlackjackHandResult.WIN: WIN
+    }
+
+    FLUSH_SIZE = 1 << 16  # buffered values per column before writing them out
+
+    META_FILE_NAME = 'meta.json'
+
+    def __init__(self, path, num_players):
+        self.path = path
+        self.num_players = num_players
+        self.num_rounds = 0
+
+        os.makedirs(path, exist_ok=True)
+
+        # A part left over from an earlier run isn't complete until this run closes it
+        if os.path.exists(os.path.join(path, self.META_FILE_NAME)):
+            os.remove(os.path.join(path, self.META_FILE_NAME))
+
+        self._files = {column: open(os.path.join(path, f'{column}.bin'), 'wb') for column in self.COLUMNS}
+        self._lengths = {column: 0 for column in self.COLUMNS}
+        self._buffers = {column: array(typecode) for column, (table, typecode, dtype) in self.COLUMNS.items()}
+
+    # Part directory of a shard in a recording
+    @staticmethod
+    def get_part_name(session_idx, shard_idx):
+        return f'part-{session_idx:05d}-{shard_idx:06d}'
+
+    # Records a round played with hand objects (see Simulation.play_round); starting_cards are each player's first 2 cards
+    def record_round(self, dealer_hand, starting_cards, players):
+        buffers = self._buffers
+        result_codes = self.RESULT_CODES
+
+        buffers['dealer_num_cards'].append(len(dealer_hand.cards))
+        buffers['dealer_card'].extend(dealer_hand.cards)
+
+        for player, (card_1, card_2) in zip(players, starting_cards):
+            buffers['card_1'].append(card_1)
+            buffers['card_2'].append(card_2)
+            buffers['num_hands'].append(len(player.hands))
+            buffers['net'].append(player.chip_stack - player.round_start_stack)
+            buffers['net_21_3'].append(player.round_net_21_3)
+            buffers['net_bust'].append(player.round_net_bust)
+
+            for hand in player.hands:
+                buffers['bet'].append(hand.bet)
+                buffers['result'].append(result_codes[hand.result])
+                buffers['blackjack'].append(hand.is_blackjack)
+                buffers['doubled'].append(hand.is_doubled)
+                buffers['num_cards'].append(len(hand.cards))
+                buffers['hand_card'].extend(hand.cards)
+
+        self.num_rounds += 1
+
+        if len(buffers['hand_card']) >= self.FLUSH_SIZE:
+            self.flush()
+
+    # Records num_rounds rounds given as flat NumPy arrays (or sequences) per column (see BatchTables)
+    def record_rounds(self, num_rounds, **columns):
+        self.flush()
+
+        for column, values in columns.items():
+            dtype = self.COLUMNS[column][2]
+            np.ascontiguousarray(values, dtype=dtype).tofile(self._files[column])
+            self._lengths[column] += len(values)
+
+        self.num_rounds += num_rounds
+
+    def flush(self):
+        for column, buffer in self._buffers.items():
+            if buffer:
+                buffer.tofile(self._files[column])
+                self._lengths[column] += len(buffer)
+                del buffer[:]
+
+    # Pickled for checkpoints (see Checkpoints): the recorded values are written out and synced to disk, and only the
+    # # of values of each column is kept. Unpickling truncates the columns back to them, dropping rounds recorded since.
+    def __getstate__(self):
+        self.flush()
+
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+        return {'path': self.path, 'num_players': self.num_players, 'num_rounds': self.num_rounds, 'lengths': dict(self._lengths)}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.num_players = state['num_players']
+        self.num_rounds = state['num_rounds']
+
+        self._files = {}
+        self._lengths = state['lengths']
+        self._buffers = {column: array(typecode) for column, (table, typecode, dtype) in self.COLUMNS.items()}
+
+        # Closed when the run stopped, but it's only complete once the shard is
+        if os.path.exists(os.path.join(self.path, self.META_FILE_NAME)):
+            os.remove(os.path.join(self.path, self.META_FILE_NAME))
+
+        for column, (table, typecode, dtype) in self.COLUMNS.items():
+            f = open(os.path.join(self.path, f'{column}.bin'), 'r+b')
+            f.truncate(self._lengths[column] * array(typecode).itemsize)
+            f.seek(0, os.SEEK_END)
+
+            self._files[column] = f
+
+    def close(self):
+        self.flush()
+
+        for f in self._files.values():
+            f.close()
+
+        meta = {
+            'version': self.VERSION,
+            'num_players': self.num_players,
+            'num_rounds': self.num_rounds,
+            'byteorder': sys.byteorder,
+            'columns': {column: {'table': table, 'dtype': dtype, 'length': self._lengths[column]}
+                        for column, (table, typecode, dtype) in self.COLUMNS.items()}
+        }
+
+        with open(os.path.join(self.path, self.META_FILE_NAME), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+
+class RoundRecording(object):
+
+    """
+    Reads a recording written by RoundRecorder: every complete part in the directory, in part name order (session,
+    then shard). Columns are memory mapped, so only the pages that are used get read.
+    """
+
+    def __init__(self, path):
+        if np is None:
+            raise ConfigurationError('Reading recordings requires NumPy')
+
+        if not os.path.isdir(path):
+            raise ConfigurationError(f'No recording at {path}')
+
+        self.path = path
+        self.parts = []
+
+        for name in sorted(os.listdir(path)):
+            meta_path = os.path.join(path, name, RoundRecorder.META_FILE_NAME)
+
+            if name.startswith('part-') and os.path.exists(meta_path):
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+
+                if meta['version'] != RoundRecorder.VERSION:
+                    raise ConfigurationError(f'Unsupported recording version {meta["version"]} in {name}')
+
+                self.parts.append((name, meta))
+
+        if not self.parts:
+            raise ConfigurationError(f'No complete recording parts in {path}')
+
+        num_players = {meta['num_players'] for name, meta in self.parts}
+        if len(num_players) > 1:
+            raise ConfigurationError(f'Recording parts have different # of players: {sorted(num_players)}')
+
+        self.num_players = num_players.pop()
+        self.num_rounds = sum(meta['num_rounds'] for name, meta in self.parts)
+
+    # Column name -> read only array of the part's values
+    def get_columns(self, part_idx):
+        name, meta = self.parts[part_idx]
+        byteorder = '<' if meta['byteorder'] == 'little' else '>'
+
+        columns = {}
+        for column, column_meta in meta['columns'].items():
+            dtype = np.dtype(column_meta['dtype']).newbyteorder(byteorder)
+
+            # Empty files can't be mapped
+            if column_meta['length']:
+                columns[column] = np.memmap(os.path.join(self.path, name, f'{column}.bin'), dtype=dtype, mode='r', shape=(column_meta['length'],))
+            else:
+                columns[column] = np.zeros(0, dtype=dtype)
+
+        return meta['num_rounds'], columns
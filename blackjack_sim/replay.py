@@ -0,0 +1,164 @@
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from blackjack_sim.game_models import BlackjackPlayer
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.recording import RoundRecorder
+from blackjack_sim.stats import RunningStats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ReplayEngine(object):
+
+    """
+    Re-settles the rounds of a recording (see RoundRecorder) under a blackjack payout and bonus bets, without playing
+    any hands: the results of the main bets don't depend on the payouts, so only the money changes. Each part of the
+    recording is settled with a few vector operations over its memory mapped columns, so a replay is about as fast as
+    the recording can be read.
+
+    Results go into one BlackjackPlayer per seat, summed over all of the recording's sessions, so they're reported
+    like a simulation's. Bonus payouts come from the same multiplier tables as BatchTables, so payers with other payout
+    tables (see BustBonusPayer and TwentyOne3BonusPayer) can be compared on the same rounds. The one difference from
+    the simulation's reports is that split hands are counted by the final # of hands of the seat.
+    """
+
+    def __init__(self, buyin=0, blackjack_payout=None, bonus_config=None, bonus_payer_21_3=None, bonus_payer_bust=None):
+        if np is None:
+            raise ConfigurationError('Replaying recordings requires NumPy')
+
+        self.buyin = buyin
+        self.blackjack_payout = blackjack_payout if blackjack_payout is not None else BlackjackPlayer.DEFAULT_BLACKJACK_PAYOUT
+        self.bonus_config = bonus_config
+        self.bonus_payer_21_3 = bonus_payer_21_3
+        self.bonus_payer_bust = bonus_payer_bust
+
+        # Card lookup tables indexed by card code
+        self._values = np.array(Card.VALUES, dtype=np.int64)
+        self._ranks = np.array(Card.RANK_INDEXES, dtype=np.int64)
+        self._suits = np.array(Card.SUIT_INDEXES, dtype=np.int64)
+
+    # Returns the seats' BlackjackPlayers with the results of every round of the recording
+    def replay(self, recording):
+        players = [BlackjackPlayer(p, buyin=self.buyin, bonus_config=self.bonus_config, blackjack_payout=self.blackjack_payout) for p in range(recording.num_players)]
+
+        for part_idx in range(len(recording.parts)):
+            num_rounds, columns = recording.get_columns(part_idx)
+            self.settle_part(players, num_rounds, columns)
+
+        return players
+
+    def settle_part(self, players, num_rounds, columns):
+        num_players = len(players)
+        num_seats = num_rounds * num_players
+
+        num_hands = columns['num_hands'].astype(np.int64)
+        bets = columns['bet'].astype(np.float64)
+        results = columns['result']
+        blackjacks = columns['blackjack'].astype(bool)
+
+        # Seat (round * # of players + player) of each hand
+        hand_seats = np.repeat(np.arange(num_seats), num_hands)
+        hand_players = hand_seats % num_players
+
+        wins = results == RoundRecorder.WIN
+        pushes = results == RoundRecorder.PUSH
+        losses = results == RoundRecorder.LOSS
+        blackjack_wins = wins & blackjacks
+
+        hand_net = np.where(blackjack_wins, self.blackjack_payout * bets, np.where(wins, bets, np.where(losses, -bets, 0)))
+        round_net = np.bincount(hand_seats, weights=hand_net, minlength=num_seats).reshape(num_rounds, num_players)
+
+        self.settle_bonuses(players, num_rounds, columns, round_net)
+
+        split_hands = num_hands[hand_seats] > 1
+
+        for p, player in enumerate(players):
+            is_player = hand_players == p
+            net_change = round_net[:, p].sum()
+
+            round_stats = RunningStats()
+            round_stats.add_batch(round_net[:, p])
+
+            split_counts = np.bincount(num_hands[hand_seats[split_hands & is_player]])
+
+            player.record_hand_results(
+                num_wins=int(np.count_nonzero(wins & is_player)),
+                num_pushes=int(np.count_nonzero(pushes & is_player)),
+                num_losses=int(np.count_nonzero(losses & is_player)),
+                net_change=float(net_change),
+                num_split_hands_dict={n: int(c) for n, c in enumerate(split_counts) if c},
+                round_stats=round_stats
+            )
+
+    # Settles every bonus plan of the seats; the first plan of each bonus bet is added to round_net like a player's stack
+    def settle_bonuses(self, players, num_rounds, columns, round_net):
+        dealer_num_cards = columns['dealer_num_cards'].astype(np.int64)
+        dealer_cards = columns['dealer_card'].astype(np.int64)
+
+        # Where each dealer hand starts in the flat card column; every dealer hand has at least 2 cards
+        offsets = np.cumsum(dealer_num_cards) - dealer_num_cards
+
+        up_cards = dealer_cards[offsets]
+        up_ranks = self._ranks[up_cards]
+        up_suits = self._suits[up_cards]
+
+        if self.bonus_payer_21_3 and players[0].bonus_plans_21_3:
+            card_1 = columns['card_1'].astype(np.int64).reshape(num_rounds, -1)
+            card_2 = columns['card_2'].astype(np.int64).reshape(num_rounds, -1)
+
+            is_flush = (self._suits[card_1] == up_suits[:, None]) & (self._suits[card_2] == up_suits[:, None])
+            mx = BatchTables._get_multipliers(self.bonus_payer_21_3, BatchTables._get_21_3_multipliers)
+            multipliers = mx[up_ranks[:, None], self._ranks[card_1], self._ranks[card_2], is_flush.astype(np.int64)]
+
+            for plan_idx, plan in enumerate(players[0].bonus_plans_21_3):
+                if not plan.will_play_bonus_bet():
+                    continue
+
+                bets = np.full(multipliers.shape, plan.get_bet_amount())
+                self._record_bonus_results(players, 'bonus_plans_21_3', plan_idx, multipliers * bets, bets, round_net, np.arange(num_rounds))
+
+        if self.bonus_payer_bust and players[0].bonus_plans_bust:
+            card_idxs = np.repeat(np.arange(num_rounds), dealer_num_cards)
+            values = self._values[dealer_cards]
+
+            hard = np.add.reduceat(values, offsets)
+            has_ace = np.logical_or.reduceat(values == 1, offsets)
+            is_suited = np.logical_and.reduceat(self._suits[dealer_cards] == up_suits[card_idxs], offsets)
+            is_888 = np.logical_and.reduceat(values == 8, offsets) & (dealer_num_cards == 3)
+
+            # The bust bonus isn't settled when the dealer has blackjack
+            dealer_blackjack = (dealer_num_cards == 2) & has_ace & (hard == 11)
+
+            mx = BatchTables._get_multipliers(self.bonus_payer_bust, BatchTables._get_bust_multipliers)
+            multipliers = np.where(hard > 21, mx[up_ranks, is_suited.astype(np.int64), is_888.astype(np.int64)], 0)
+
+            up_cards_by_rank = [Card(Card.CARD_SUITS[0], rank) for rank in Card.CARD_RANKS]
+
+            for plan_idx, plan in enumerate(players[0].bonus_plans_bust):
+                plays = np.array([plan.will_play_bonus_bet(dealer_up_card=c) for c in up_cards_by_rank], dtype=bool)
+                bet_amounts = np.array([plan.get_bet_amount(dealer_up_card=c) or 0 for c in up_cards_by_rank])
+
+                rows = np.flatnonzero(~dealer_blackjack & plays[up_ranks])
+                bets = np.broadcast_to(bet_amounts[up_ranks[rows]][:, None], (rows.size, len(players)))
+
+                self._record_bonus_results(players, 'bonus_plans_bust', plan_idx, multipliers[rows][:, None] * bets, bets, round_net, rows)
+
+    # payouts and bets are [round, player] for the given rounds
+    @staticmethod
+    def _record_bonus_results(players, plans_attr, plan_idx, payouts, bets, round_net, rows):
+        wins = payouts > 0
+        net = np.where(wins, payouts, -bets)
+
+        for p, player in enumerate(players):
+            stats = RunningStats()
+            stats.add_batch(net[:, p])
+
+            num_wins = int(np.count_nonzero(wins[:, p]))
+            getattr(player, plans_attr)[plan_idx].record_bonus_results(num_wins, net.shape[0] - num_wins, net[:, p].sum().item(), stats=stats)
+
+        # Only the plan the players bet changes their stacks
+        if plan_idx == 0:
+            round_net[rows] += net
@@ -0,0 +1,135 @@
+from random import Random, SystemRandom
+from blackjack_sim.errors import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RandomStream(object):
+
+    """
+    A seeded source of random numbers that can derive independent child streams.
+
+    A stream is identified by its backend, seed and key (a tuple of ints). spawn() extends the key, so the child
+    streams for e.g. simulation 2 / session 0 / shard 5 are always the same for a given seed no matter which process
+    creates them or in what order. Backends provide backend, spawn(*key) (a child stream independent of this one and of
+    children with other keys), randint(a, b), randint_batch(a, b, n) (n of them), random_batch(n) (n uniform floats in
+    [0, 1)) and shuffled_batch(cards, num_copies) (num_copies independently shuffled copies of the cards); use
+    RandomStream.create() to get a stream for a backend:
+
+        random: stdlib random.Random; no NumPy needed
+        pcg64:  NumPy PCG64
+        philox: NumPy Philox (counter based)
+    """
+    BACKENDS = ['random', 'pcg64', 'philox']
+
+    DEFAULT_BACKEND = 'pcg64' if np is not None else 'random'
+
+    def __init__(self, seed, key=()):
+        self.seed = seed
+        self.key = tuple(key)
+
+    @staticmethod
+    def create(backend=None, seed=None):
+        backend = backend if backend else RandomStream.DEFAULT_BACKEND
+        seed = seed if seed is not None else RandomStream.new_seed()
+
+        if backend == 'random':
+            return StdlibRandomStream(seed)
+        elif backend in NumpyRandomStream.BIT_GENERATORS:
+            if np is None:
+                raise ConfigurationError(f'RNG backend {backend} requires NumPy')
+
+            return NumpyRandomStream(seed, bit_generator=backend)
+        else:
+            raise ConfigurationError(f'Unknown RNG backend: {backend}')
+
+    @staticmethod
+    def new_seed():
+        return SystemRandom().randrange(2 ** 32)
+
+
+class StdlibRandomStream(RandomStream):
+
+    def __init__(self, seed, key=()):
+        super().__init__(seed, key)
+
+        # String seeds are hashed with SHA-512, so the key path maps to a well mixed, stable state
+        self._random = Random(f'{self.seed}:' + '/'.join(str(k) for k in self.key))
+
+    @property
+    def backend(self):
+        return 'random'
+
+    def spawn(self, *key):
+        return StdlibRandomStream(self.seed, self.key + key)
+
+    def randint(self, a, b):
+        return self._random.randint(a, b)
+
+    def randint_batch(self, a, b, n):
+        return [self._random.randint(a, b) for i in range(n)]
+
+    def random_batch(self, n):
+        return [self._random.random() for i in range(n)]
+
+    def shuffled_batch(self, cards, num_copies):
+        return [self.shuffle(list(cards)) for c in range(num_copies)]
+
+    # Fisher-Yates shuffle; implementation taken from here:
+    # https://www.geeksforgeeks.org/shuffle-a-given-array-using-fisher-yates-shuffle-algorithm/
+    def shuffle(self, arr):
+        n = len(arr)
+        for i in range(n - 1, 0, -1):
+            j = self._random.randint(0, i)
+
+            # Swap arr[i] with the element at random index
+            arr[i], arr[j] = arr[j], arr[i]
+
+        return arr
+
+
+class NumpyRandomStream(RandomStream):
+
+    BIT_GENERATORS = {
+        'pcg64': 'PCG64',
+        'philox': 'Philox'
+    }
+
+    def __init__(self, seed, key=(), bit_generator='pcg64'):
+        super().__init__(seed, key)
+
+        self._bit_generator = bit_generator
+
+        # SeedSequence spawn keys are designed for exactly this kind of independent child stream
+        seed_seq = np.random.SeedSequence(entropy=self.seed, spawn_key=self.key)
+        self._generator = np.random.Generator(getattr(np.random, self.BIT_GENERATORS[bit_generator])(seed_seq))
+
+    @property
+    def backend(self):
+        return self._bit_generator
+
+    @property
+    def generator(self):
+        return self._generator
+
+    def spawn(self, *key):
+        return NumpyRandomStream(self.seed, self.key + key, bit_generator=self._bit_generator)
+
+    def randint(self, a, b):
+        return int(self._generator.integers(a, b, endpoint=True))
+
+    def randint_batch(self, a, b, n):
+        return self._generator.integers(a, b, size=n, endpoint=True)
+
+    def random_batch(self, n):
+        return self._generator.random(n)
+
+    # One vectorized permutation of every row; returns a (num_copies, len(cards)) uint8 array
+    def shuffled_batch(self, cards, num_copies):
+        cards = np.frombuffer(cards, dtype=np.uint8) if isinstance(cards, bytes) else np.asarray(cards, dtype=np.uint8)
+
+        return self._generator.permuted(np.broadcast_to(cards, (num_copies, len(cards))), axis=1)
+
@@ -0,0 +1,176 @@
+import itertools
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+from blackjack_sim.errors import *
+
+
+# Producer process: shuffles batches into free ring buffer slots until it gets a None slot
+def _produce_shoe_batches(shm_name, shoe_factory, batch_size, slot_size, free_slots, filled_slots, next_batch_idx):
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        while True:
+            slot_idx = free_slots.get()
+            if slot_idx is None:
+                break
+
+            # Claim the next batch only once there is a slot for it, so batches are produced roughly in order
+            with next_batch_idx.get_lock():
+                batch_idx = next_batch_idx.value
+                next_batch_idx.value += 1
+
+            shoes = shoe_factory.shuffle_batch(batch_idx, batch_size)
+
+            offset = slot_idx * slot_size
+            if hasattr(shoes, 'tobytes'):
+                shm.buf[offset:offset + slot_size] = shoes.tobytes()
+            else:
+                shm.buf[offset:offset + slot_size] = bytes(itertools.chain.from_iterable(shoes))
+
+            filled_slots.put((slot_idx, batch_idx))
+    finally:
+        shm.close()
+
+
+class ShoePrefetcher(object):
+
+    """
+    Shuffles shoe batches in background producer processes into a shared memory ring buffer of num_slots batches.
+    Drop-in replacement for ShoeFactory.get_shoe_batch: the returned shoes are zero-copy views of a slot, and the slot
+    goes back to the producers when the next batch is requested.
+
+    Batch n is always shuffled by the factory's child stream n (see ShoeFactory.shuffle_batch), so a run deals exactly
+    the same shoes with or without prefetching. If batch n isn't ready when it's needed the consumer doesn't wait; it
+    shuffles batch n itself and counts a stall. A high stall rate means more producers are needed to keep up.
+    """
+
+    def __init__(self, shoe_factory, batch_size, num_producers=1, num_slots=4):
+        if num_producers < 1:
+            raise ConfigurationError(f'Invalid # of shoe prefetch producers: {num_producers}')
+
+        if num_slots < 2:
+            raise ConfigurationError(f'Invalid # of shoe prefetch slots: {num_slots}')
+
+        self.shoe_factory = shoe_factory
+        self.batch_size = batch_size
+        self.num_producers = num_producers
+        self.num_slots = num_slots
+
+        self.shoe_size = shoe_factory.get_shoe_size()
+        self.slot_size = self.batch_size * self.shoe_size
+
+        # Stall counters
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_time = 0
+
+        self._next_batch_idx = 0      # next batch the consumer needs
+        self._ready_slots = {}        # key = batch idx, value = slot idx; batches produced ahead of time
+        self._current_slot_idx = None
+        self._current_shoes = []
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_size)
+        self._free_slots = multiprocessing.Queue()
+        self._filled_slots = multiprocessing.Queue()
+        self._producer_next_batch_idx = multiprocessing.Value('q', 0)
+
+        for slot_idx in range(self.num_slots):
+            self._free_slots.put(slot_idx)
+
+        self._producers = []
+        for p in range(self.num_producers):
+            producer = multiprocessing.Process(
+                target=_produce_shoe_batches,
+                args=(self._shm.name, shoe_factory, self.batch_size, self.slot_size, self._free_slots, self._filled_slots, self._producer_next_batch_idx),
+                daemon=True
+            )
+            producer.start()
+            self._producers.append(producer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_shoe_batch(self, num_shoes):
+        if num_shoes != self.batch_size:
+            raise GameplayError(f'Prefetcher produces batches of {self.batch_size} shoes, not {num_shoes}')
+
+        # The previous batch has been played; give its slot back to the producers
+        self._release_current_slot()
+
+        batch_idx = self._next_batch_idx
+
+        self._collect_filled_slots()
+
+        self._next_batch_idx += 1
+        self.num_batches += 1
+
+        if batch_idx in self._ready_slots:
+            self._current_slot_idx = self._ready_slots.pop(batch_idx)
+
+            offset = self._current_slot_idx * self.slot_size
+            self._current_shoes = [
+                self._shm.buf[offset + s * self.shoe_size:offset + (s + 1) * self.shoe_size] for s in range(self.batch_size)
+            ]
+
+            return self._current_shoes
+
+        # Buffer ran dry; don't wait for the producers
+        self.num_stalls += 1
+
+        start_time = time.perf_counter()
+        shoes = self.shoe_factory.shuffle_batch(batch_idx, self.batch_size)
+        self.stall_time += time.perf_counter() - start_time
+
+        # Producers don't need to shuffle batches the consumer already has
+        with self._producer_next_batch_idx.get_lock():
+            self._producer_next_batch_idx.value = max(self._producer_next_batch_idx.value, self._next_batch_idx)
+
+        return shoes
+
+    def close(self):
+        if self._shm is None:
+            return
+
+        self._release_current_slot()
+
+        for producer in self._producers:
+            self._free_slots.put(None)
+
+        for producer in self._producers:
+            producer.join(timeout=5)
+            if producer.is_alive():
+                producer.terminate()
+
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def _collect_filled_slots(self):
+        while True:
+            try:
+                slot_idx, batch_idx = self._filled_slots.get_nowait()
+            except queue.Empty:
+                break
+
+            if batch_idx < self._next_batch_idx:
+                # Already shuffled inline after a stall
+                self._free_slots.put(slot_idx)
+            else:
+                self._ready_slots[batch_idx] = slot_idx
+
+    def _release_current_slot(self):
+        # Views into the slot have to be released before it can be reused (or the shared memory closed)
+        for shoe in self._current_shoes:
+            if isinstance(shoe, memoryview):
+                shoe.release()
+
+        self._current_shoes = []
+
+        if self._current_slot_idx is not None:
+            self._free_slots.put(self._current_slot_idx)
+            self._current_slot_idx = None
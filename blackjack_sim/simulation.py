@@ -1,8 +1,24 @@
+import copy
 import json
 import logging
+import math
+import os
 import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from blackjack_sim.game_models import *
-from blackjack_sim.strategy import Strategy
+from blackjack_sim.strategy import Strategy, DealerStrategy
+from blackjack_sim.rng import RandomStream
+from blackjack_sim.shoe_prefetch import ShoePrefetcher
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds, BustBonusControlVariate
+from blackjack_sim.bonus_sampling import TwentyOne3BonusSampler, BustBonusSampler
+from blackjack_sim.bonus_counts import TwentyOne3OutcomeCounts, BustOutcomeCounts
+from blackjack_sim.recording import RoundRecorder, RoundRecording
+from blackjack_sim.replay import ReplayEngine
+from blackjack_sim.checkpoint import Checkpoints
+from blackjack_sim.timing import PhaseTimers
+from blackjack_sim.stats import RunningStats
 from blackjack_sim.utils import Utils
 from blackjack_sim.bonuses import *
 
@@ -11,22 +27,69 @@ class SimulationManager(object):
 
     DEFAULT_SIM_CONFIG_FILE_PATH = 'blackjack_sim/config/simulation_config.json'
 
-    def __init__(self, sim_config_file_path=None):
+    # Settings that may be given once at the top level of the config file and apply to every simulation
+    TOP_LEVEL_SIM_CONFIG_KEYS = ['seed', 'rng', 'checkpoint_path', 'checkpoint_interval']
+
+    # Settings that decide which shoes a simulation deals; they have to match within a comparison group
+    SHOE_SIM_CONFIG_KEYS = ['num_decks', 'seed', 'rng', 'engine', 'batch_tables', 'infinite_deck', 'num_sessions', 'max_session_hands', 'shard_hands']
+
+    def __init__(self, sim_config_file_path=None, workers=None, seed=None, rng=None, checkpoint_path=None, resume=False, phase_timing=False):
         self.simulations = []
+        self.workers = workers
+
+        # Compiled strategies keyed by config file path; each file is only loaded once no matter how many simulations use it
+        self.strategies = {}
 
         self.log = Utils.get_logger('SimulationManager', logging.INFO)
 
-        # load main config file; contains 1 or more simulations
+        # load main config file; contains 1 or more simulations, either as a list or as an object with top-level
+        # settings and a "simulations" list
         sim_config_list = self.load_json_file(sim_config_file_path if sim_config_file_path else self.DEFAULT_SIM_CONFIG_FILE_PATH)
 
+        top_level_config = {}
+        if isinstance(sim_config_list, dict):
+            top_level_config = {k: v for k, v in sim_config_list.items() if k in self.TOP_LEVEL_SIM_CONFIG_KEYS}
+            sim_config_list = sim_config_list['simulations'] if 'simulations' in sim_config_list else None
+
+        # Command line settings override the config
+        if seed is not None:
+            top_level_config['seed'] = seed
+
+        if rng:
+            top_level_config['rng'] = rng
+
+        if checkpoint_path:
+            top_level_config['checkpoint_path'] = checkpoint_path
+
+        # Simulations in the same comparison group play from the same shoes (common random numbers), so the
+        # differences between them can be measured much more precisely; see log_comparisons. Key = group, value =
+        # config of the group's first simulation.
+        comparison_group_configs = {}
+
         if sim_config_list:
             for sim_config in sim_config_list:
+                # Top-level settings are defaults; each simulation still gets its own child random stream
+                sim_config = dict(top_level_config, **sim_config)
+
+                if 'comparison_group' in sim_config:
+                    sim_config = self.get_comparison_group_config(sim_config, comparison_group_configs)
+
                 # load strategy config
                 if 'strategy_config_file' in sim_config and sim_config['strategy_config_file']:
-                    strategy_config = self.load_json_file(sim_config['strategy_config_file'])
+                    strategy = self.load_strategy(sim_config['strategy_config_file'])
+
+                    if strategy:
+                        # Command line setting overrides the per-simulation setting
+                        if workers:
+                            sim_config = dict(sim_config, workers=workers)
+
+                        if resume:
+                            sim_config = dict(sim_config, resume=1)
 
-                    if strategy_config:
-                        self.simulations.append(Simulation(len(self.simulations), sim_config, strategy_config))
+                        if phase_timing:
+                            sim_config = dict(sim_config, phase_timing=1)
+
+                        self.simulations.append(Simulation(len(self.simulations), sim_config, strategy))
                     else:
                         self.log.error('ERROR: Unable to load strategy config file')
                 else:
@@ -36,6 +99,113 @@ class SimulationManager(object):
         else:
             self.log.error('ERROR: Unable to load simulation config file')
 
+    # Same config, but sharing the seed and shoe stream of the first simulation in its comparison group
+    def get_comparison_group_config(self, sim_config, comparison_group_configs):
+        group = sim_config['comparison_group']
+
+        if group not in comparison_group_configs:
+            # Every simulation in the group needs the seed, so pick it now rather than in Simulation
+            comparison_group_configs[group] = dict(
+                sim_config,
+                seed=sim_config['seed'] if 'seed' in sim_config else RandomStream.new_seed(),
+                shoe_stream=len(self.simulations)
+            )
+
+        group_config = comparison_group_configs[group]
+        sim_config = dict(sim_config, seed=sim_config.get('seed', group_config['seed']), shoe_stream=group_config['shoe_stream'])
+
+        for key in self.SHOE_SIM_CONFIG_KEYS:
+            if sim_config.get(key) != group_config.get(key):
+                raise ConfigurationError(f'Simulations in comparison group {group} need the same {key}')
+
+        return sim_config
+
+    def get_comparison_groups(self):
+        groups = {}
+        for sim in self.simulations:
+            if sim.comparison_group is not None:
+                groups.setdefault(sim.comparison_group, []).append(sim)
+
+        return groups
+
+    # Edge difference of sim vs reference_sim in % points, its standard error from the paired per shard differences,
+    # and the standard error it would have if the simulations had been run independently. Both errors are measured
+    # over the shards (batch means), since players at the same table and rounds from the same shoe aren't independent.
+    def get_comparison(self, reference_sim, sim):
+        reference_edges = RunningStats()
+        edges = RunningStats()
+        edge_diffs = RunningStats()
+        for key in sorted(set(sim.shard_round_totals) & set(reference_sim.shard_round_totals)):
+            reference_edges.add(reference_sim.get_shard_edge(key))
+            edges.add(sim.get_shard_edge(key))
+            edge_diffs.add(sim.get_shard_edge(key) - reference_sim.get_shard_edge(key))
+
+        edge_diff = sim.get_round_edge() - reference_sim.get_round_edge()
+
+        return edge_diff, edge_diffs.std_error(), math.hypot(reference_edges.std_error(), edges.std_error())
+
+    # Paired comparison of every simulation in a comparison group with the group's first simulation
+    def log_comparisons(self):
+        for group, sims in self.get_comparison_groups().items():
+            if len(sims) < 2:
+                continue
+
+            reference_sim = sims[0]
+
+            self.log.info(Simulation.MAJOR_LOG_SEPARATOR)
+            self.log.info(f'Comparison group {group}: house edge per round vs {reference_sim.name}, paired on the same shoes')
+
+            for sim in sims[1:]:
+                edge_diff, paired_std_error, independent_std_error = self.get_comparison(reference_sim, sim)
+
+                # Variance ratio = how many times as many hands independent runs would need for the same precision
+                hands_factor_str = f', ~{round((independent_std_error / paired_std_error) ** 2, 1)}x fewer hands' \
+                    if 0 < paired_std_error < math.inf else ''
+
+                self.log.info(f'{sim.name}: Difference: {round(edge_diff, 3)}% ± {round(RunningStats.Z_95 * paired_std_error, 3)}% (95% CI), '
+                              f'Paired SE: {round(paired_std_error, 4)}%, Independent SE: {round(independent_std_error, 4)}%{hands_factor_str}')
+
+    # Logs the exact bonus bet odds of every simulation instead of simulating them
+    def log_exact_bonus_results(self):
+        for sim in self.simulations:
+            sim.log_exact_bonus_results()
+
+    # Logs bonus bet odds estimated by stratified importance sampling of num_rounds rounds per bonus bet of every
+    # simulation instead of simulating them
+    def log_sampled_bonus_results(self, num_rounds):
+        for sim in self.simulations:
+            sim.log_sampled_bonus_results(num_rounds)
+
+    # Re-settles the recording at path with the payouts and bonus bets of every simulation instead of simulating them
+    def log_replay_results(self, path):
+        for sim in self.simulations:
+            sim.log_replay_results(path)
+
+    # Logs what-ifs of every simulation with the payout tables in payout_tables_path (see Simulation.log_what_if_results),
+    # from the counts saved in counts_path if given, otherwise from running the simulations
+    def log_what_if_results(self, payout_tables_path, counts_path=None):
+        payout_tables = self.load_json_file(payout_tables_path)
+
+        if payout_tables is None:
+            raise ConfigurationError(f'Unable to load payout tables from {payout_tables_path}')
+
+        if counts_path:
+            for sim in self.simulations:
+                sim.load_bonus_counts(counts_path)
+        else:
+            self.run_simulations()
+
+        for sim in self.simulations:
+            sim.log_what_if_results(payout_tables)
+
+    def load_strategy(self, strategy_config_file):
+        if strategy_config_file not in self.strategies:
+            strategy_config = self.load_json_file(strategy_config_file)
+
+            self.strategies[strategy_config_file] = Strategy(strategy_config) if strategy_config else None
+
+        return self.strategies[strategy_config_file]
+
     def load_json_file(self, file_name_and_path):
         json_file = None
 
@@ -48,17 +218,119 @@ class SimulationManager(object):
         return json_file
 
     def run_simulations(self):
+        # Pool size defaults to the largest # of workers any simulation asked for
+        pool_size = self.workers if self.workers else max([sim.workers for sim in self.simulations], default=1)
+
+        if pool_size > 1:
+            self.run_simulations_on_pool(pool_size)
+        else:
+            for sim in self.simulations:
+                sim.run()
+
+        self.log_comparisons()
+
+    def run_simulations_on_pool(self, pool_size):
+        start_time = time.perf_counter()
+
+        # Schedule every shard of every simulation longest job first so the batch finishes when the pool runs dry,
+        # not when the most expensive simulation that happened to be queued last finishes.
+        # Simulations with a target precision decide as they go how many shards to play, so they run after the others
+        targeted_sims = [sim for sim in self.simulations if sim.target_ci_halfwidth is not None]
+
+        tasks = []
         for sim in self.simulations:
-            sim.run()
+            if sim in targeted_sims:
+                continue
+
+            sim.start_checkpoints()
+
+            for shard in sim.get_shards():
+                tasks.append((sim.get_shard_cost(shard), sim, shard))
+
+        tasks.sort(key=lambda t: t[0], reverse=True)
+
+        self.log.info(f'Running {len(self.simulations)} simulations ({len(tasks)} shards) on {pool_size} workers')
+
+        shard_results = {sim.idx: [] for sim in self.simulations}
+        num_shards_left = {sim.idx: len(sim.get_shards()) for sim in self.simulations}
+        failed_sim_idxs = set()
+
+        strategies = {key: strategy for key, strategy in self.strategies.items() if strategy}
+
+        with ProcessPoolExecutor(max_workers=pool_size, initializer=_init_worker, initargs=(strategies,)) as executor:
+            futures = {}
+            for cost, sim, shard in tasks:
+                future = executor.submit(_run_simulation_shard, sim.idx, sim.worker_config, sim.strategy_key, shard)
+                futures[future] = sim
+
+            for future in as_completed(futures):
+                sim = futures[future]
+                num_shards_left[sim.idx] -= 1
+
+                try:
+                    shard_results[sim.idx].append(future.result())
+                except Exception as ex:
+                    failed_sim_idxs.add(sim.idx)
+                    sim.log.error(ex, exc_info=True)
+
+                if num_shards_left[sim.idx] == 0 and sim.idx not in failed_sim_idxs:
+                    sim.log.info(sim.MAJOR_LOG_SEPARATOR)
+                    sim.log.info(f'\nRunning: {sim.name}')
+                    sim.finish_run(shard_results[sim.idx], start_time)
+
+            for sim in targeted_sims:
+                sim.run(executor=executor)
+
+        self.log.info(f'Finished all simulations in {time.perf_counter() - start_time:0.4f} seconds')
+
+# A contiguous block of hands within a session. Each shard is played with its own shoe factory and random stream, so
+# shards can be played in any order (or in parallel) and still produce the same results for a given seed.
+SimulationShard = namedtuple('SimulationShard', ['session_idx', 'shard_idx', 'first_hand', 'num_hands'])
+
+# Counters produced by playing a shard; merged back into the Simulation that created the shard
+ShardResult = namedtuple('ShardResult', ['shard', 'session', 'num_hands_played', 'num_shoes_used', 'num_prefetch_batches', 'num_prefetch_stalls',
+                                         'bonus_counts_21_3', 'bonus_counts_bust', 'phase_timers'])
+
+
+# Compiled strategies shared with a worker process when its pool starts; keyed by strategy config file path
+_worker_strategies = {}
+
+
+def _init_worker(strategies):
+    global _worker_strategies
+    _worker_strategies = strategies
+
+
+# Entry point for worker processes; the simulation is rebuilt from its config rather than pickled
+def _run_simulation_shard(idx, sim_config, strategy_key, shard):
+    return Simulation(idx, sim_config, _worker_strategies[strategy_key]).run_shard(shard)
+
 
 class Simulation(object):
 
     MINOR_LOG_SEPARATOR = '---------------------------------------------------------------------------------------'
     MAJOR_LOG_SEPARATOR = '======================================================================================='
 
-    SHOE_CUTOFF = 30  # if there are fewer than this many cards left then we get a new shoe
+    SHOE_CUTOFF = 30  # default cut card; if there are fewer than this many cards left then we get a new shoe
+
+    DEFAULT_SHARD_HANDS = 20000  # max # of hands in a shard of a session
+
+    DEFAULT_SHOE_BATCH_SIZE = 100  # # of shoes shuffled at once
+
+    DEFAULT_SHOE_PREFETCH_SLOTS = 4  # # of shoe batches in the prefetch ring buffer
+
+    BONUS_SAMPLING_STREAM = 2 ** 32  # stream key for bonus sampling; past any session index so it never shares a shard stream
+
+    ENGINES = ['object', 'batch']
+
+    DEFAULT_BATCH_TABLES = 10000  # # of tables played in lockstep by the batch engine
+
+    DEFAULT_BATCH_SHARD_HANDS = 1000000  # batch shards are larger so each table plays a few shoes
+
+    MIN_TARGET_CI_WAVES = 10  # a simulation with a target precision plays each session in at least this many shards
 
     def __init__(self, idx, sim_config, strategy_config):
+        self.idx = idx
         self.name = sim_config['name']
         self.num_decks = sim_config['num_decks']
         self.num_players = sim_config['num_players']
@@ -68,74 +340,288 @@ class Simulation(object):
         self.buyin_num_bets = sim_config['buyin_num_bets']
         self.split_limit = int(sim_config['split_limit']) if 'split_limit' in sim_config else None
         self.verbose = True if 'verbose' in sim_config and int(sim_config['verbose']) == 1 else False
+        self.workers = int(sim_config['workers']) if 'workers' in sim_config else 1
+        self.engine = sim_config['engine'] if 'engine' in sim_config else 'object'
+        self.shard_hands = int(sim_config['shard_hands']) if 'shard_hands' in sim_config \
+            else self.DEFAULT_BATCH_SHARD_HANDS if self.engine == 'batch' else self.DEFAULT_SHARD_HANDS
+
+        if self.workers < 1:
+            raise ConfigurationError(f'Invalid # of workers: {self.workers}')
+
+        if self.shard_hands < 1:
+            raise ConfigurationError(f'Invalid # of shard hands: {self.shard_hands}')
+
+        # Stop once the 95% confidence interval of every player's and bonus plan's house edge is at most this wide on
+        # each side (in % points); max_session_hands is still the limit. Checked after every shard of each session, so
+        # shards are made small enough that there are a few checks before the limit.
+        self.target_ci_halfwidth = float(sim_config['target_ci_halfwidth']) if 'target_ci_halfwidth' in sim_config else None
+
+        if self.target_ci_halfwidth is not None:
+            if self.target_ci_halfwidth <= 0:
+                raise ConfigurationError(f'Invalid target CI half-width: {self.target_ci_halfwidth}')
+
+            self.shard_hands = min(self.shard_hands, -(-self.max_session_hands // self.MIN_TARGET_CI_WAVES))
+
+        # Checkpoint each shard to a directory every checkpoint_interval seconds; with resume, a run that was stopped
+        # picks up from its checkpoints and finishes with the same results (see Checkpoints)
+        self.checkpoint_path = sim_config['checkpoint_path'] if 'checkpoint_path' in sim_config else None
+        self.checkpoint_interval = float(sim_config['checkpoint_interval']) if 'checkpoint_interval' in sim_config else None
+        self.resume = int(sim_config['resume']) == 1 if 'resume' in sim_config else False
+        self.checkpoints = Checkpoints(os.path.join(self.checkpoint_path, f'sim-{idx:03d}'), interval=self.checkpoint_interval) \
+            if self.checkpoint_path else None
+
+        # Pick a seed if none was given so the run can still be reproduced from the logged seed; a resumed run keeps the
+        # seed it was started with
+        run_config = self.checkpoints.load_run_config() if self.checkpoints and self.resume and 'seed' not in sim_config else None
+
+        if 'seed' in sim_config:
+            self.seed = int(sim_config['seed'])
+        elif run_config:
+            self.seed = int(run_config['seed'])
+        else:
+            self.seed = RandomStream.new_seed()
+
+        self.rng_backend = sim_config['rng'] if 'rng' in sim_config else RandomStream.DEFAULT_BACKEND
 
-        self.strategy = Strategy(strategy_config)
+        # Streams for each shard of this simulation derive from this one; see get_shard_rng. Simulations with the same
+        # seed and shoe stream deal the same shoes (see SimulationManager comparison groups).
+        self.shoe_stream = int(sim_config['shoe_stream']) if 'shoe_stream' in sim_config else idx
+        self.comparison_group = sim_config['comparison_group'] if 'comparison_group' in sim_config else None
+        self.rng = RandomStream.create(backend=self.rng_backend, seed=self.seed).spawn(self.shoe_stream)
+
+        # Kept so worker processes can rebuild this simulation with the same seed
+        self.worker_config = dict(sim_config, seed=self.seed, rng=self.rng_backend)
+
+        # Accept an already compiled strategy so it can be shared between simulations
+        self.strategy = strategy_config if isinstance(strategy_config, Strategy) else Strategy(strategy_config)
+        self.strategy_key = sim_config['strategy_config_file'] if 'strategy_config_file' in sim_config else None
+
+        # Dealer hits soft 17 unless configured otherwise
+        self.dealer_hits_soft_17 = int(sim_config['dealer_hits_soft_17']) == 1 if 'dealer_hits_soft_17' in sim_config else True
+        self.dealer_strategy = DealerStrategy(hits_soft_17=self.dealer_hits_soft_17)
 
         # Bonus bets are really more strategy but putting it in sim config makes it easier
-        # to compare simulations of playing vs not playing bonus bets.
+        # to compare simulations of playing vs not playing bonus bets. Each bonus bet can also
+        # be a list of plans; they're all settled on the same rounds (see BlackjackPlayer).
         self.bonus_payer_21_3 = None
         self.bonus_payer_bust = None
         self.bonus_bet_config = None
+
+        # Payout tables other than the usual ones, e.g. {"bust": {"suited_888": 100}}; see the payers
+        self.bonus_payouts = sim_config['bonus_payouts'] if 'bonus_payouts' in sim_config else {}
+
         if 'bonus_bets' in sim_config:
             self.bonus_bet_config = sim_config['bonus_bets']
 
             if '21_3' in sim_config['bonus_bets']:
-                self.bonus_payer_21_3 = TwentyOne3BonusPayer()
+                self.bonus_payer_21_3 = TwentyOne3BonusPayer(payouts=self.bonus_payouts.get('21_3'))
 
             if 'bust' in sim_config['bonus_bets']:
-                self.bonus_payer_bust = BustBonusPayer()
+                self.bonus_payer_bust = BustBonusPayer(payouts=self.bonus_payouts.get('bust'))
+
+        # How many times each payout class of the bonus bets came up, by dealer up card, for what-ifs with other payout
+        # tables (see BonusOutcomeCounts); the current shard's and the totals. Saved to bonus_counts_path if given.
+        self.current_bonus_counts_21_3 = None
+        self.current_bonus_counts_bust = None
+        self.bonus_counts_21_3 = None
+        self.bonus_counts_bust = None
+        self.bonus_counts_path = sim_config['bonus_counts_path'] if 'bonus_counts_path' in sim_config else None
+
+        # Multiple of the bet a blackjack pays, 1.5 (3:2) unless configured otherwise, e.g. 1.2 for 6:5
+        self.blackjack_payout = float(sim_config['blackjack_payout']) if 'blackjack_payout' in sim_config else BlackjackPlayer.DEFAULT_BLACKJACK_PAYOUT
+
+        # Write every round to a recording in this directory, one part per shard (see RoundRecorder and ReplayEngine)
+        self.record_path = sim_config['record_path'] if 'record_path' in sim_config else None
+        self.recorder = None
+
+        # Draw cards with replacement instead of dealing from shuffled shoes; a quick approximation (see InfiniteShoe).
+        # finite_reference_hands > 0 also plays that many hands from real shoes to report how far off the edge is.
+        self.infinite_deck = int(sim_config['infinite_deck']) == 1 if 'infinite_deck' in sim_config else False
+        self.finite_reference_hands = int(sim_config['finite_reference_hands']) if 'finite_reference_hands' in sim_config else 0
+
+        # Bust bonus plans with control_variate also estimate their edge with the dealer's exact bust odds as control
+        # variates (see BustBonusControlVariate); 21+3 has nothing to control for
+        self.bust_control_variate = None
+        if self.bonus_payer_21_3 and any(plan.control_variate for plan in self.get_bonus_plans('21_3')):
+            raise ConfigurationError('Control variates are only available for the bust bonus')
+
+        if self.bonus_payer_bust and any(plan.control_variate for plan in self.get_bonus_plans('bust')):
+            self.bust_control_variate = BustBonusControlVariate(
+                num_decks=None if self.infinite_deck else self.num_decks,
+                hits_soft_17=self.dealer_hits_soft_17,
+                payer=self.bonus_payer_bust
+            )
+
+        # Cut card position as a fraction of the shoe; defaults to SHOE_CUTOFF cards from the end
+        self.penetration = float(sim_config['penetration']) if 'penetration' in sim_config else None
+
+        shoe_size = self.num_decks * Card.NUM_CARDS
+        if self.penetration is None:
+            self.cut_card_position = shoe_size - self.SHOE_CUTOFF
+        elif 0 < self.penetration <= 1:
+            self.cut_card_position = int(shoe_size * self.penetration)
+        else:
+            raise ConfigurationError(f'Invalid penetration: {self.penetration}')
+
+        self.shoe_batch_size = int(sim_config['shoe_batch_size']) if 'shoe_batch_size' in sim_config else self.DEFAULT_SHOE_BATCH_SIZE
+
+        if self.shoe_batch_size < 1:
+            raise ConfigurationError(f'Invalid shoe batch size: {self.shoe_batch_size}')
+
+        # 'object' plays one table with session/player/hand objects; 'batch' plays batch_tables tables in lockstep on
+        # NumPy arrays (see BatchTables)
+        self.batch_tables = int(sim_config['batch_tables']) if 'batch_tables' in sim_config else self.DEFAULT_BATCH_TABLES
+
+        if self.engine not in self.ENGINES:
+            raise ConfigurationError(f'Unknown engine: {self.engine}')
 
-        self.shoe_factory = ShoeFactory(self.num_decks)
+        if self.engine == 'batch' and not BatchTables.AVAILABLE:
+            raise ConfigurationError('The batch engine requires NumPy')
 
-        self.shoe = []
+        if self.batch_tables < 1:
+            raise ConfigurationError(f'Invalid # of batch tables: {self.batch_tables}')
+
+        # Replaced for each shard; same stream as the first shard of the first session
+        self.shoe_factory_class = InfiniteShoeFactory if self.infinite_deck else ShoeFactory
+        self.shoe_factory = self.shoe_factory_class(self.num_decks, rng=self.rng.spawn(0, 0))
+
+        # Optional background shuffling of shoe batches; 0 producers means shuffle inline
+        self.shoe_prefetch_producers = int(sim_config['shoe_prefetch_producers']) if 'shoe_prefetch_producers' in sim_config else 0
+        self.shoe_prefetch_slots = int(sim_config['shoe_prefetch_slots']) if 'shoe_prefetch_slots' in sim_config else self.DEFAULT_SHOE_PREFETCH_SLOTS
+        self.num_prefetch_batches = 0
+        self.num_prefetch_stalls = 0
+
+        # Where shoe batches come from; the shoe factory or a prefetcher in front of it
+        self.shoe_source = self.shoe_factory
+
+        # Shuffled shoes waiting to be played
+        self.shoe_batch = []
+        self.shoe_batch_idx = 0
+
+        self.shoe = None
         self.dealer_hand = None
+
+        # Hand objects are reused from round to round
+        self.hand_pool = BlackjackHandPool()
+
         self.num_hands_played = 0
         self.num_shoes_used = 0
 
         self.sessions = []
         self.current_session = None
 
+        # Key = (session idx, shard idx), value = (net stack change, # of rounds) of all of the players in the shard
+        self.shard_round_totals = {}
+
         log_level = logging.DEBUG if self.verbose else logging.INFO
 
         self.log = Utils.get_logger(f'Simulation-{idx}', log_level)
 
+        # Time each phase of playing rounds (see PhaseTimers); the current shard's timings and the totals of the run
+        self.phase_timing = int(sim_config['phase_timing']) == 1 if 'phase_timing' in sim_config else False
+        self.phase_timers = None
+        self.total_phase_timers = None
+
+        if self.phase_timing:
+            self.phase_timers = PhaseTimers()
+            self.instrument_phases()
+
+    # Times the object engine's phases; batch tables are instrumented as they're created (see run_batch_shard)
+    def instrument_phases(self):
+        timers = self.phase_timers
+
+        timers.instrument(self, 'next_shoe_cards', PhaseTimers.SHOE)
+        timers.instrument(self, 'deal_initial_cards', PhaseTimers.DEAL)
+        timers.instrument(self, 'play_player_hand', PhaseTimers.PLAYER)
+        timers.instrument(self, 'play_dealer_hand', PhaseTimers.DEALER)
+        timers.instrument(self, 'evaluate_hand_result', PhaseTimers.SETTLE)
+
+        # The strategy may be shared with other simulations, so only this simulation's copy is timed
+        self.strategy = copy.copy(self.strategy)
+        timers.instrument(self.strategy, 'determine_player_action_code', PhaseTimers.STRATEGY)
+
+        # The batch engine pays bonuses from multiplier tables built by asking the payers
+        if self.engine == 'object':
+            for payer in [self.bonus_payer_21_3, self.bonus_payer_bust]:
+                if payer:
+                    timers.instrument(payer, 'get_payout', PhaseTimers.BONUS)
+
     def get_next_card(self):
-        if len(self.shoe) == 0:
+        if self.shoe.remaining() == 0:
             self.log.warn('WARNING: Tried to get card from empty shoe')
 
             self.new_shoe()
 
-        return self.shoe.pop(0)
+        return self.shoe.deal()
 
-    def run(self):
+    # Runs on its own pool of workers if it has more than 1, unless given a pool (executor) to share
+    def run(self, executor=None):
         self.log.info(self.MAJOR_LOG_SEPARATOR)
         self.log.info(f'\nRunning: {self.name}')
 
         start_time = time.perf_counter()
 
         try:
-            for s in range(self.num_sessions):
+            self.start_checkpoints()
 
-                self.current_session = BlackjackSession(
-                    idx=s,
-                    num_players=self.num_players,
-                    buyin=self.buyin_num_bets * self.min_bet,
-                    bonus_config=self.bonus_bet_config
-                )
+            shards = self.get_shards()
+
+            if executor:
+                shard_results = self.run_shards(shards, executor)
+            elif self.workers > 1 and len(shards) > 1:
+                strategies = {self.strategy_key: self.strategy}
+
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(strategies,)) as executor:
+                    shard_results = self.run_shards(shards, executor)
+            else:
+                shard_results = self.run_shards(shards)
 
-                self.sessions.append(self.current_session)
+            self.finish_run(shard_results, start_time)
 
-                for h in range(self.max_session_hands):
-                    # Show progress for large numbers of hands
-                    if self.max_session_hands >= 10000:
-                        if h % 10000 == 0:
-                            self.log.info(f'playing hand {h}')
+        except Exception as ex:
+            self.log.error(ex, exc_info=True)
+
+            self.log.info(f"Finished in {time.perf_counter() - start_time:0.4f} seconds")
+            self.log.info(self.MAJOR_LOG_SEPARATOR)
 
-                    self.play_round()
+    # Starts a new run in the checkpoint directory, or continues the one there with resume
+    def start_checkpoints(self):
+        if self.checkpoints:
+            self.checkpoints.start(self.worker_config, resume=self.resume)
+
+            if self.resume:
+                self.log.info(f'Resuming from checkpoints in {self.checkpoints.path}')
+
+    # Merge the shard results and log them
+    def finish_run(self, shard_results, start_time):
+        self.log.info(f'Seed: {self.seed}, RNG: {self.rng_backend}, Workers: {self.workers}')
+
+        try:
+            # Merge in shard order so the combined results don't depend on the # of workers or the scheduling order
+            self.sessions = []
+            self.num_hands_played = 0
+            self.num_shoes_used = 0
+            self.num_prefetch_batches = 0
+            self.num_prefetch_stalls = 0
+            self.shard_round_totals = {}
+            self.bonus_counts_21_3 = TwentyOne3OutcomeCounts() if self.bonus_payer_21_3 else None
+            self.bonus_counts_bust = BustOutcomeCounts() if self.bonus_payer_bust else None
+            self.total_phase_timers = PhaseTimers() if self.phase_timing else None
+            for shard_result in sorted(shard_results, key=lambda r: (r.shard.session_idx, r.shard.shard_idx)):
+                self.merge_shard_result(shard_result)
+
+            if self.bonus_counts_path:
+                self.save_bonus_counts(self.bonus_counts_path)
 
             self.log_results()
             self.log.info(self.MINOR_LOG_SEPARATOR)
 
+            if self.total_phase_timers:
+                self.log_phase_timers()
+
+            if self.infinite_deck:
+                self.log_infinite_deck_comparison()
+
         except Exception as ex:
             self.log.error(ex, exc_info=True)
 
@@ -144,6 +630,362 @@ class Simulation(object):
         self.log.info(f"Finished in {end_time - start_time:0.4f} seconds")
         self.log.info(self.MAJOR_LOG_SEPARATOR)
 
+    # Plays the shards, on the executor's workers if given one. With a target CI half-width the shards are played in
+    # waves of one shard per session and the run stops after the first wave that reaches it. A wave is only submitted
+    # once the one before it has been checked, so where a run stops doesn't depend on the # of workers.
+    def run_shards(self, shards, executor=None):
+        if self.target_ci_halfwidth is None:
+            waves = [shards]
+        else:
+            waves = [[s for s in shards if s.shard_idx == w] for w in range(max(s.shard_idx for s in shards) + 1)]
+
+        shard_results = []
+        for w, wave in enumerate(waves):
+            if executor:
+                futures = [executor.submit(_run_simulation_shard, self.idx, self.worker_config, self.strategy_key, shard) for shard in wave]
+                shard_results += [f.result() for f in futures]
+            else:
+                shard_results += [self.run_shard(shard) for shard in wave]
+
+            if self.target_ci_halfwidth is None:
+                continue
+
+            num_hands = sum(r.num_hands_played for r in shard_results)
+            halfwidth = self.get_widest_ci_halfwidth(shard_results)
+            self.log.info(f'{num_hands} hands: widest 95% CI ± {round(halfwidth, 3)}% (target ± {self.target_ci_halfwidth}%)')
+
+            if halfwidth <= self.target_ci_halfwidth:
+                self.log.info(f'Target precision reached after {num_hands} of {self.num_sessions * self.max_session_hands} hands')
+                break
+
+            if w == len(waves) - 1:
+                self.log.info(f'Target precision not reached; played all {num_hands} hands')
+
+        return shard_results
+
+    # Widest 95% CI half-width (in % points) of the house edge of any player or bonus plan, over all of the sessions
+    def get_widest_ci_halfwidth(self, shard_results):
+        halfwidths = []
+        for p in range(self.num_players):
+            player = BlackjackPlayer(p, bonus_config=self.bonus_bet_config)
+            for shard_result in shard_results:
+                player.merge(shard_result.session.players[p])
+
+            halfwidths.append(player.get_edge_ci_halfwidth(self.min_bet))
+
+            # Plans that never bet (e.g. every up card bet is 0) have no edge to estimate
+            for plan in player.bonus_plans_21_3 + player.bonus_plans_bust:
+                if plan.stats.count:
+                    halfwidths.append(plan.get_edge_ci_halfwidth())
+
+        return max(halfwidths)
+
+    # Rough relative cost of playing a shard, used to schedule the most expensive work first
+    def get_shard_cost(self, shard):
+        return shard.num_hands * self.num_players * self.num_decks
+
+    def get_shards(self):
+        shards = []
+        for s in range(self.num_sessions):
+            for shard_idx, first_hand in enumerate(range(0, self.max_session_hands, self.shard_hands)):
+                shards.append(SimulationShard(
+                    session_idx=s,
+                    shard_idx=shard_idx,
+                    first_hand=first_hand,
+                    num_hands=min(self.shard_hands, self.max_session_hands - first_hand)
+                ))
+
+        return shards
+
+    # Random stream for a shard; depends only on the seed, the simulation and the shard's session and position
+    def get_shard_rng(self, shard):
+        return self.rng.spawn(shard.session_idx).spawn(shard.shard_idx)
+
+    def run_shard(self, shard):
+        checkpoint = self.checkpoints.load_shard(shard) if self.checkpoints and self.resume else None
+
+        # Finished before the run stopped
+        if checkpoint and checkpoint[0] == Checkpoints.FINISHED:
+            return checkpoint[1]
+
+        state = checkpoint[1] if checkpoint else None
+
+        if self.engine == 'batch':
+            shard_result = self.run_batch_shard(shard, state=state)
+        else:
+            shard_result = self.run_object_shard(shard, state=state)
+
+        if self.checkpoints:
+            self.checkpoints.save_finished_shard(shard, shard_result)
+
+        return shard_result
+
+    # Plays the shard with session/player/hand objects, from its start or from a state saved by get_shard_state
+    def run_object_shard(self, shard, state=None):
+        self.shoe_factory = self.shoe_factory_class(self.num_decks, rng=self.get_shard_rng(shard))
+        self.shoe_batch = []
+        self.shoe_batch_idx = 0
+        self.shoe = None
+        self.num_hands_played = 0
+        self.num_shoes_used = 0
+        self.num_prefetch_batches = 0
+        self.num_prefetch_stalls = 0
+
+        self.current_bonus_counts_21_3 = TwentyOne3OutcomeCounts() if self.bonus_payer_21_3 else None
+        self.current_bonus_counts_bust = BustOutcomeCounts() if self.bonus_payer_bust else None
+
+        self.current_session = BlackjackSession(
+            idx=shard.session_idx,
+            num_players=self.num_players,
+            buyin=self.buyin_num_bets * self.min_bet,
+            bonus_config=self.bonus_bet_config,
+            blackjack_payout=self.blackjack_payout
+        )
+
+        first_hand = shard.first_hand
+        if state:
+            first_hand = self.restore_shard_state(state)
+
+        # The prefetcher starts from the factory's first batch, so a restored shard shuffles its own; prefetched shoes
+        # only live in the prefetcher's shared memory, so shards that use it are only checkpointed once they're finished
+        prefetcher = None
+        if self.shoe_prefetch_producers and not state:
+            prefetcher = ShoePrefetcher(
+                shoe_factory=self.shoe_factory,
+                batch_size=self.shoe_batch_size,
+                num_producers=self.shoe_prefetch_producers,
+                num_slots=self.shoe_prefetch_slots
+            )
+            self.shoe_source = prefetcher
+        else:
+            self.shoe_source = self.shoe_factory
+
+        if not state:
+            self.recorder = self.get_shard_recorder(shard)
+
+        checkpoints = self.checkpoints if not prefetcher else None
+
+        start_time = time.perf_counter() if self.phase_timers else None
+
+        try:
+            for h in range(first_hand, shard.first_hand + shard.num_hands):
+                # Show progress for large numbers of hands
+                if self.max_session_hands >= 10000:
+                    if h % 10000 == 0:
+                        self.log.info(f'playing hand {h}')
+
+                self.play_round()
+
+                if checkpoints:
+                    checkpoints.save_partial_shard(shard, lambda: self.get_shard_state(h + 1))
+
+            if self.phase_timers:
+                self.phase_timers.add_rounds(shard.first_hand + shard.num_hands - first_hand, time.perf_counter() - start_time)
+
+        finally:
+            if prefetcher:
+                self.num_prefetch_batches = prefetcher.num_batches
+                self.num_prefetch_stalls = prefetcher.num_stalls
+
+                # Shoes are views into the prefetcher's shared memory
+                self.shoe = None
+                self.shoe_batch = []
+                self.shoe_source = self.shoe_factory
+
+                prefetcher.close()
+
+            if self.recorder:
+                self.recorder.close()
+                self.recorder = None
+
+        return ShardResult(
+            shard=shard,
+            session=self.current_session,
+            num_hands_played=self.num_hands_played,
+            num_shoes_used=self.num_shoes_used,
+            num_prefetch_batches=self.num_prefetch_batches,
+            num_prefetch_stalls=self.num_prefetch_stalls,
+            bonus_counts_21_3=self.current_bonus_counts_21_3,
+            bonus_counts_bust=self.current_bonus_counts_bust,
+            phase_timers=self.phase_timers.pop() if self.phase_timers else None
+        )
+
+    # Plays the shard's hands spread over up to batch_tables tables in lockstep. The tables take their shoes from the
+    # shard's shoe stream in table order, so the results depend on the # of tables but not on the # of workers. A state
+    # saved by a checkpoint has the tables' state and the # of rounds they had played.
+    def run_batch_shard(self, shard, state=None):
+        self.shoe_factory = state['shoe_factory'] if state else self.shoe_factory_class(self.num_decks, rng=self.get_shard_rng(shard))
+        num_tables = min(self.batch_tables, shard.num_hands)
+
+        # Like run_object_shard, a restored shard shuffles its own shoes and shards that prefetch aren't checkpointed
+        prefetcher = None
+        if self.shoe_prefetch_producers and not state:
+            prefetcher = ShoePrefetcher(
+                shoe_factory=self.shoe_factory,
+                batch_size=self.shoe_batch_size,
+                num_producers=self.shoe_prefetch_producers,
+                num_slots=self.shoe_prefetch_slots
+            )
+
+        recorder = state['tables']['recorder'] if state else self.get_shard_recorder(shard)
+
+        tables = BatchTables(
+            num_tables=num_tables,
+            shoe_source=prefetcher if prefetcher else self.shoe_factory,
+            num_decks=self.num_decks,
+            num_players=self.num_players,
+            min_bet=self.min_bet,
+            split_limit=self.split_limit,
+            strategy=self.strategy,
+            dealer_strategy=self.dealer_strategy,
+            cut_card_position=self.cut_card_position,
+            shoe_batch_size=self.shoe_batch_size,
+            bonus_config=self.bonus_bet_config,
+            bonus_payer_21_3=self.bonus_payer_21_3,
+            bonus_payer_bust=self.bonus_payer_bust,
+            bust_control_variate=self.bust_control_variate,
+            blackjack_payout=self.blackjack_payout,
+            recorder=recorder,
+            infinite_deck=self.infinite_deck,
+            log=self.log
+        )
+
+        first_round = 0
+        if state:
+            tables.set_state(state['tables'])
+            first_round = state['next_round']
+
+        if self.phase_timers:
+            self.instrument_batch_phases(tables)
+            first_hands_played = tables.num_hands_played
+            start_time = time.perf_counter()
+
+        def checkpoint(num_rounds):
+            self.checkpoints.save_partial_shard(shard, lambda: {'next_round': num_rounds, 'shoe_factory': self.shoe_factory, 'tables': tables.get_state()})
+
+        try:
+            tables.play([shard.num_hands // num_tables + (1 if t < shard.num_hands % num_tables else 0) for t in range(num_tables)],
+                        first_round=first_round, checkpoint=checkpoint if self.checkpoints and not prefetcher else None)
+
+            if self.phase_timers:
+                self.phase_timers.add_rounds(tables.num_hands_played - first_hands_played, time.perf_counter() - start_time)
+        finally:
+            if prefetcher:
+                # The tables copy their shoes out of the prefetcher's shared memory
+                tables.shoe_batch = []
+                prefetcher.close()
+
+            if recorder:
+                recorder.close()
+
+        session = BlackjackSession(
+            idx=shard.session_idx,
+            num_players=self.num_players,
+            buyin=self.buyin_num_bets * self.min_bet,
+            bonus_config=self.bonus_bet_config,
+            blackjack_payout=self.blackjack_payout
+        )
+
+        return ShardResult(
+            shard=shard,
+            session=tables.record_session(session),
+            num_hands_played=tables.num_hands_played,
+            num_shoes_used=tables.num_shoes_used,
+            num_prefetch_batches=prefetcher.num_batches if prefetcher else 0,
+            num_prefetch_stalls=prefetcher.num_stalls if prefetcher else 0,
+            bonus_counts_21_3=tables.bonus_counts_21_3,
+            bonus_counts_bust=tables.bonus_counts_bust,
+            phase_timers=self.phase_timers.pop() if self.phase_timers else None
+        )
+
+    # Strategy lookups are part of the vectorized player play, so they aren't timed on their own
+    def instrument_batch_phases(self, tables):
+        timers = self.phase_timers
+
+        timers.instrument(tables, 'new_shoe', PhaseTimers.SHOE)
+        timers.instrument(tables, 'deal_initial_cards', PhaseTimers.DEAL)
+        timers.instrument(tables, 'play_player_hands', PhaseTimers.PLAYER)
+        timers.instrument(tables, 'play_dealer_hands', PhaseTimers.DEALER)
+        timers.instrument(tables, 'settle_dealer_blackjack', PhaseTimers.SETTLE)
+        timers.instrument(tables, 'settle_hands', PhaseTimers.SETTLE)
+        timers.instrument(tables, 'settle_21_3_bonus', PhaseTimers.BONUS)
+        timers.instrument(tables, 'settle_bust_bonus', PhaseTimers.BONUS)
+
+    # State of the shard being played by the object engine before hand next_hand, for checkpoints. Hands are dealt
+    # fresh every round, so between rounds it's the session, the shoes and the counters; of the shoe batch only the
+    # shoes that haven't been played are kept.
+    def get_shard_state(self, next_hand):
+        return {
+            'next_hand': next_hand,
+            'session': self.current_session,
+            'num_hands_played': self.num_hands_played,
+            'num_shoes_used': self.num_shoes_used,
+            'shoe_factory': self.shoe_factory,
+            'shoe_batch': self.shoe_batch[self.shoe_batch_idx:],
+            'shoe': self.shoe,
+            'bonus_counts_21_3': self.current_bonus_counts_21_3,
+            'bonus_counts_bust': self.current_bonus_counts_bust,
+            'recorder': self.recorder
+        }
+
+    # Restores a state from get_shard_state; returns the next hand to play
+    def restore_shard_state(self, state):
+        self.current_session = state['session']
+        self.num_hands_played = state['num_hands_played']
+        self.num_shoes_used = state['num_shoes_used']
+        self.shoe_factory = state['shoe_factory']
+        self.shoe_batch = state['shoe_batch']
+        self.shoe_batch_idx = 0
+        self.shoe = state['shoe']
+        self.current_bonus_counts_21_3 = state['bonus_counts_21_3']
+        self.current_bonus_counts_bust = state['bonus_counts_bust']
+        self.recorder = state['recorder']
+
+        if isinstance(self.shoe, InfiniteShoe):
+            self.shoe.set_next_cards(self.next_shoe_cards)
+
+        return state['next_hand']
+
+    # Recorder for a shard's part of the recording, if recording
+    def get_shard_recorder(self, shard):
+        if not self.record_path:
+            return None
+
+        return RoundRecorder(os.path.join(self.record_path, RoundRecorder.get_part_name(shard.session_idx, shard.shard_idx)), self.num_players)
+
+    def merge_shard_result(self, shard_result):
+        players = shard_result.session.players
+        self.shard_round_totals[(shard_result.shard.session_idx, shard_result.shard.shard_idx)] = (
+            sum(p.round_stats.mean * p.round_stats.count for p in players),
+            sum(p.round_stats.count for p in players)
+        )
+
+        self.num_hands_played += shard_result.num_hands_played
+        self.num_shoes_used += shard_result.num_shoes_used
+        self.num_prefetch_batches += shard_result.num_prefetch_batches
+        self.num_prefetch_stalls += shard_result.num_prefetch_stalls
+
+        for counts, shard_counts in [(self.bonus_counts_21_3, shard_result.bonus_counts_21_3), (self.bonus_counts_bust, shard_result.bonus_counts_bust)]:
+            if counts is not None and shard_counts is not None:
+                counts.merge(shard_counts)
+
+        if self.total_phase_timers and shard_result.phase_timers:
+            self.total_phase_timers.merge(shard_result.phase_timers)
+
+        if shard_result.shard.shard_idx == 0:
+            self.sessions.append(shard_result.session)
+        else:
+            session = next(s for s in self.sessions if s.session_idx == shard_result.shard.session_idx)
+            session.merge(shard_result.session)
+
+    def log_phase_timers(self):
+        self.log.info(f'Phase timings ({self.engine} engine):')
+
+        for line in self.total_phase_timers.get_report_lines():
+            self.log.info(line)
+
+        self.log.info(self.MINOR_LOG_SEPARATOR)
+
     def log_all_hands(self):
         self.log.debug('')
         self.log_hand(self.dealer_hand, True)
@@ -159,7 +1001,12 @@ class Simulation(object):
         self.log.info(self.MAJOR_LOG_SEPARATOR)
         self.log.info('Simulation Results:')
         self.log.info(f'# Hands: {self.num_hands_played}')
-        self.log.info(f'# Shoes: {self.num_shoes_used}')
+        self.log.info(f'# Shoes: {self.num_shoes_used}' if not self.infinite_deck else '# Shoes: none (infinite deck)')
+
+        if self.shoe_prefetch_producers:
+            pct_stalls = (self.num_prefetch_stalls / self.num_prefetch_batches) * 100 if self.num_prefetch_batches > 0 else 0
+            self.log.info(f'# Shoe prefetch: Producers={self.shoe_prefetch_producers}, Batches={self.num_prefetch_batches}, Stalls={self.num_prefetch_stalls} ({round(pct_stalls, 1)}%)')
+
         self.log.info(f'# Sessions: {self.num_sessions}')
         self.log.info(f'# Players: {self.num_players}')
 
@@ -172,19 +1019,282 @@ class Simulation(object):
                 self.log.info(self.MINOR_LOG_SEPARATOR)
                 self.log.info(result_str)
 
+    # Exact odds of the configured bonus bets for this shoe and dealer rule, off the top of a full shoe
+    def log_exact_bonus_results(self):
+        self.log.info(self.MAJOR_LOG_SEPARATOR)
+        self.log.info(f'Exact Bonus Odds: {self.name}')
+        self.log.info(f'# Decks: {self.num_decks}, Dealer hits soft 17: {self.dealer_hits_soft_17}')
+
+        if not self.bonus_payer_21_3 and not self.bonus_payer_bust:
+            self.log.info('No bonus bets configured')
+
+        if self.bonus_payer_21_3:
+            odds = TwentyOne3BonusOdds(num_decks=self.num_decks, payer=self.bonus_payer_21_3)
+
+            self.log.info(self.MINOR_LOG_SEPARATOR)
+            self.log.info(', '.join(f'{outcome}: {round(p * 100, 4)}%' for outcome, p in odds.get_outcome_probabilities().items()))
+
+            for plan in self.get_bonus_plans('21_3'):
+                self.log.info(f'{plan.name}: EV Per Bet: ${round(odds.get_plan_ev(plan), 4)}, House Edge: {round(odds.get_house_edge(), 4)}%')
+
+        if self.bonus_payer_bust:
+            odds = BustBonusOdds(num_decks=self.num_decks, hits_soft_17=self.dealer_hits_soft_17, payer=self.bonus_payer_bust)
+
+            self.log.info(self.MINOR_LOG_SEPARATOR)
+            for rank in ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'A']:
+                outcomes = odds.get_outcome_probabilities(rank)
+
+                self.log.info(f'Up card {rank}: ' + ', '.join(f'{outcome}: {round(p * 100, 4)}%' for outcome, p in outcomes.items())
+                              + f', EV Per $1: ${round(odds.get_up_card_ev(rank), 4)}')
+
+            for plan in self.get_bonus_plans('bust'):
+                self.log.info(f'{plan.name}: EV Per Bet: ${round(odds.get_plan_ev(plan), 4)}, House Edge: {round(odds.get_house_edge(plan), 4)}%')
+
+    # Bonus bet odds estimated from the cards left at the start of num_rounds rounds of this simulation's own shoes, so
+    # at the depths they're really dealt at (see BonusSampler), with each payout class's contribution to the EV and how
+    # many times as many rounds plain simulation would need for the same precision
+    def log_sampled_bonus_results(self, num_rounds):
+        self.log.info(self.MAJOR_LOG_SEPARATOR)
+        self.log.info(f'Sampled Bonus Odds: {self.name}')
+        self.log.info(f'# Decks: {self.num_decks if not self.infinite_deck else "infinite"}, Dealer hits soft 17: {self.dealer_hits_soft_17}, '
+                      f'# Rounds: {num_rounds}, Seed: {self.seed}, RNG: {self.rng_backend}')
+
+        if not self.bonus_payer_21_3 and not self.bonus_payer_bust:
+            self.log.info('No bonus bets configured')
+            return
+
+        num_decks = self.num_decks if not self.infinite_deck else None
+        rng = self.rng.spawn(self.BONUS_SAMPLING_STREAM)
+
+        samplers = []
+        if self.bonus_payer_21_3:
+            samplers.append(('21+3', TwentyOne3BonusSampler(num_decks=num_decks, rng=rng.spawn(0), payer=self.bonus_payer_21_3)))
+
+        if self.bonus_payer_bust:
+            samplers.append(('Bust', BustBonusSampler(num_decks=num_decks, hits_soft_17=self.dealer_hits_soft_17, rng=rng.spawn(1), payer=self.bonus_payer_bust)))
+
+        # The rounds are played by a copy of this simulation that doesn't record, checkpoint or stop early
+        sampling_config = dict(self.worker_config, engine='object', num_sessions=1, max_session_hands=num_rounds, verbose=0, shoe_prefetch_producers=0)
+        for key in ['record_path', 'checkpoint_path', 'resume', 'bonus_counts_path', 'target_ci_halfwidth', 'phase_timing']:
+            sampling_config.pop(key, None)
+
+        sampling_sim = Simulation(self.idx, sampling_config, self.strategy)
+
+        # Samples every round from the cards left once the shoe has been replaced if needed, before any are dealt
+        reset_hands_for_next_round = sampling_sim.reset_hands_for_next_round
+        last_shoe = None
+
+        def sample_round():
+            nonlocal last_shoe
+
+            if sampling_sim.shoe is not last_shoe:
+                last_shoe = sampling_sim.shoe
+                for name, sampler in samplers:
+                    sampler.end_batch()
+
+            cards = sampling_sim.shoe if not sampling_sim.infinite_deck else None
+            for name, sampler in samplers:
+                sampler.sample_round(cards)
+
+            reset_hands_for_next_round()
+
+        sampling_sim.reset_hands_for_next_round = sample_round
+
+        for shard in sampling_sim.get_shards():
+            sampling_sim.run_shard(shard)
+
+        for name, sampler in samplers:
+            self.log.info(self.MINOR_LOG_SEPARATOR)
+
+            probabilities = sampler.get_outcome_probabilities()
+            for outcome, (contribution, std_error, variance_reduction) in sampler.get_contributions().items():
+                probability, probability_std_error = probabilities[outcome]
+
+                self.log.info(f'{name} {outcome}: {round(probability * 100, 4)}% ± {round(RunningStats.Z_95 * probability_std_error * 100, 4)}%, '
+                              f'EV Contribution Per $1: ${round(contribution, 4)} ± ${round(RunningStats.Z_95 * std_error, 4)}, '
+                              f'~{round(variance_reduction, 1)}x fewer rounds than plain sampling')
+
+            edge, edge_ci_halfwidth = sampler.get_house_edge()
+            self.log.info(f'{name} House Edge Per $1: {round(edge, 3)}% ± {round(edge_ci_halfwidth, 3)}% (95% CI), '
+                          f'~{round(sampler.get_ev()[2], 1)}x fewer rounds than plain sampling')
+
+    # Re-settles the rounds of a recording with this simulation's blackjack payout and bonus bets instead of playing
+    # any (see ReplayEngine); the bets and the players' decisions are the ones recorded
+    def log_replay_results(self, path):
+        start_time = time.perf_counter()
+
+        recording = RoundRecording(path)
+        engine = ReplayEngine(
+            buyin=self.buyin_num_bets * self.min_bet,
+            blackjack_payout=self.blackjack_payout,
+            bonus_config=self.bonus_bet_config,
+            bonus_payer_21_3=self.bonus_payer_21_3,
+            bonus_payer_bust=self.bonus_payer_bust
+        )
+        players = engine.replay(recording)
+
+        self.log.info(self.MAJOR_LOG_SEPARATOR)
+        self.log.info(f'Replay Results: {self.name}')
+        self.log.info(f'Recording: {path}, # Parts: {len(recording.parts)}, # Rounds: {recording.num_rounds}, # Players: {recording.num_players}')
+        self.log.info(f'Blackjack pays: {self.blackjack_payout}x')
+
+        for p in players:
+            self.log.info(self.MINOR_LOG_SEPARATOR)
+            self.log.info(p.get_gameplay_result_str(min_bet=self.min_bet))
+
+        self.log.info(self.MINOR_LOG_SEPARATOR)
+        self.log.info(f'Replay time: {round(time.perf_counter() - start_time, 2)}s')
+
+        return players
+
+    def save_bonus_counts(self, path):
+        counts = {bonus_bet: c.to_dict() for bonus_bet, c in [('21_3', self.bonus_counts_21_3), ('bust', self.bonus_counts_bust)] if c is not None}
+
+        with open(path, 'w') as f:
+            json.dump(counts, f)
+
+    def load_bonus_counts(self, path):
+        with open(path, 'r') as f:
+            counts = json.load(f)
+
+        self.bonus_counts_21_3 = TwentyOne3OutcomeCounts.from_dict(counts['21_3']) if '21_3' in counts else None
+        self.bonus_counts_bust = BustOutcomeCounts.from_dict(counts['bust']) if 'bust' in counts else None
+
+    # EV and house edge of every bonus plan under each payout table (like bonus_payouts, plus a name), settled from the
+    # payout class counts of the last run or of load_bonus_counts instead of simulated. The configured payouts are
+    # listed first.
+    def log_what_if_results(self, payout_tables):
+        self.log.info(self.MAJOR_LOG_SEPARATOR)
+        self.log.info(f'What-If Bonus Payouts: {self.name}')
+
+        if self.bonus_counts_21_3 is None and self.bonus_counts_bust is None:
+            self.log.info('No bonus bet outcome counts')
+
+        results = {}
+        for payout_table in [dict(self.bonus_payouts, name='Configured')] + list(payout_tables):
+            unknown_keys = set(payout_table) - {'name', '21_3', 'bust'}
+            if unknown_keys:
+                raise ConfigurationError(f'Unknown payout table keys: {sorted(unknown_keys)}')
+
+            self.log.info(self.MINOR_LOG_SEPARATOR)
+
+            for bonus_bet, counts in [('21_3', self.bonus_counts_21_3), ('bust', self.bonus_counts_bust)]:
+                if counts is None or not self.bonus_bet_config or bonus_bet not in self.bonus_bet_config:
+                    continue
+
+                for plan in self.get_bonus_plans(bonus_bet):
+                    result = counts.what_if(payouts=payout_table.get(bonus_bet), plan=plan)
+                    results[(payout_table['name'], plan.name)] = result
+
+                    self.log.info(f'{payout_table["name"]} - {plan.name}: EV Per Bet: ${round(result.ev, 4)}, '
+                                  f'House Edge: {round(result.house_edge, 3)}% ± {round(result.ci_halfwidth, 3)}% ({result.num_bets} bets)')
+
+        return results
+
+    # Fresh BonusPlans for every plan configured for a bonus bet ('21_3' or 'bust')
+    def get_bonus_plans(self, bonus_bet):
+        return [BonusPlan(c) for c in BonusPlan.get_configs(self.bonus_bet_config[bonus_bet])]
+
+    # Net stack change per round of all of the players in all of the sessions combined
+    def get_round_stats(self):
+        stats = RunningStats()
+        for session in self.sessions:
+            for player in session.players:
+                stats.merge(player.round_stats)
+
+        return stats
+
+    # House edge per round, as a %
+    def get_round_edge(self, stats=None):
+        stats = stats if stats is not None else self.get_round_stats()
+
+        return -((stats.mean / self.min_bet) * 100) if self.min_bet > 0 else 0
+
+    # House edge per round of a single shard, as a %
+    def get_shard_edge(self, key):
+        net_change, num_rounds = self.shard_round_totals[key]
+
+        return -((net_change / num_rounds / self.min_bet) * 100) if num_rounds > 0 and self.min_bet > 0 else 0
+
+    # House edge of all of the players' hands combined, as a % of the min bet
+    def get_house_edge(self):
+        players = [p for s in self.sessions for p in s.players]
+        num_hands = sum(p.num_hands_played for p in players)
+        net_change = sum(p.chip_stack - p.buyin for p in players)
+
+        return -((net_change / num_hands) / self.min_bet) * 100 if num_hands > 0 and self.min_bet > 0 else 0
+
+    # How far the infinite deck results are from a shoe of num_decks decks. Bonus bet edges are exact; the main game is
+    # compared with finite_reference_hands hands played from real shoes, if any.
+    def log_infinite_deck_comparison(self):
+        self.log.info(f'Infinite deck vs {self.num_decks} deck shoe:')
+
+        if self.finite_reference_hands:
+            reference = Simulation(self.idx, dict(
+                self.worker_config, infinite_deck=0, finite_reference_hands=0, num_sessions=1, max_session_hands=self.finite_reference_hands,
+                verbose=0, shoe_prefetch_producers=0
+            ), self.strategy)
+            for shard in reference.get_shards():
+                reference.merge_shard_result(reference.run_shard(shard))
+
+            edge = self.get_house_edge()
+            reference_edge = reference.get_house_edge()
+
+            self.log.info(f'House Edge: {round(edge, 3)}% infinite deck, {round(reference_edge, 3)}% finite shoe ({self.finite_reference_hands} hands), '
+                          f'Difference: {round(edge - reference_edge, 3)}%')
+
+        if self.bonus_payer_21_3:
+            infinite_edge = TwentyOne3BonusOdds(num_decks=None, payer=self.bonus_payer_21_3).get_house_edge()
+            finite_edge = TwentyOne3BonusOdds(num_decks=self.num_decks, payer=self.bonus_payer_21_3).get_house_edge()
+
+            for plan in self.get_bonus_plans('21_3'):
+                self.log.info(f'{plan.name} Exact House Edge: {round(infinite_edge, 3)}% infinite deck, {round(finite_edge, 3)}% finite shoe, '
+                              f'Difference: {round(infinite_edge - finite_edge, 3)}%')
+
+        if self.bonus_payer_bust:
+            infinite_odds = BustBonusOdds(num_decks=None, hits_soft_17=self.dealer_hits_soft_17, payer=self.bonus_payer_bust)
+            finite_odds = BustBonusOdds(num_decks=self.num_decks, hits_soft_17=self.dealer_hits_soft_17, payer=self.bonus_payer_bust)
+
+            for plan in self.get_bonus_plans('bust'):
+                infinite_edge = infinite_odds.get_house_edge(plan)
+                finite_edge = finite_odds.get_house_edge(plan)
+
+                self.log.info(f'{plan.name} Exact House Edge: {round(infinite_edge, 3)}% infinite deck, {round(finite_edge, 3)}% finite shoe, '
+                              f'Difference: {round(infinite_edge - finite_edge, 3)}%')
+
+    # Next shoe from the current batch; refills the batch when it runs out
+    def next_shoe_cards(self):
+        if self.shoe_batch_idx >= len(self.shoe_batch):
+            self.shoe_batch = self.shoe_source.get_shoe_batch(self.shoe_batch_size)
+            self.shoe_batch_idx = 0
+
+        cards = self.shoe_batch[self.shoe_batch_idx]
+        self.shoe_batch_idx += 1
+
+        return cards
+
     def new_shoe(self):
+        # One endless shoe per shard; it refills itself from the shoe batches
+        if self.infinite_deck:
+            self.shoe = InfiniteShoe(self.next_shoe_cards)
+            return
+
         self.num_shoes_used += 1
-        self.shoe = self.shoe_factory.get_shoe()
-        burn_card = self.get_next_card()
 
-        self.log.debug(f'New shoe of {self.num_decks} decks, {len(self.shoe)} cards; burn card: {burn_card}')
+        self.shoe = Shoe(self.next_shoe_cards(), cut_card_position=self.cut_card_position)
+
+        burn_card = self.shoe.deal()
+
+        self.log.debug(f'New shoe of {self.num_decks} decks, {self.shoe.remaining()} cards; burn card: {Card.to_str(burn_card)}')
 
     def reset_hands_for_next_round(self):
-        self.dealer_hand = BlackjackHand(player=None, dealer_hand=True)
+        self.hand_pool.release_all()
+
+        self.dealer_hand = self.hand_pool.acquire(player=None, dealer_hand=True)
         for player in self.current_session.players:
             player.reset_hands()
             player.add_hand(
-                bj_hand=BlackjackHand(player=player, dealer_hand=False, bet=self.min_bet),
+                bj_hand=self.hand_pool.acquire(player=player, dealer_hand=False, bet=self.min_bet),
                 split_limit=self.split_limit
             )
 
@@ -196,36 +1306,44 @@ class Simulation(object):
         self.current_session.num_hands_played += 1
 
         # Check if we need a new shoe
-        if len(self.shoe) < self.SHOE_CUTOFF:
+        if self.shoe is None or self.shoe.is_cut_card_reached():
             self.new_shoe()
 
         # Reset hands
         self.reset_hands_for_next_round()
 
         # Deal 2 rounds of cards
-        self.deal_round_of_cards()
-        self.deal_round_of_cards()
+        self.deal_initial_cards()
 
         if self.verbose:
             self.log_all_hands()
 
         dealer_up_card = self.dealer_hand.cards[0]
 
+        # Splits change the starting hands' cards, so the recorder gets copies
+        starting_cards = []
+
         # Get starting hands before playing/splitting
         starting_hands = []
         for player in self.current_session.players:
             for player_hand in player.hands:
                 starting_hands.append(player_hand)
 
+                if self.recorder:
+                    starting_cards.append(tuple(player_hand.cards))
+
+                if self.current_bonus_counts_21_3:
+                    self.current_bonus_counts_21_3.add_hand(dealer_up_card, player_hand.cards)
+
                 # Pay 3 card bonus if configured
                 if player.will_play_21_3_bonus():
-                    bonus_payout = self.bonus_payer_21_3.get_payout(
+                    bonus_multiplier = self.bonus_payer_21_3.get_payout(
                         dealer_up_card=dealer_up_card,
                         player_hand=player_hand,
-                        bonus_bet=player.bonus_plan_21_3.get_bet_amount()
+                        bonus_bet=1
                     )
 
-                    player.record_21_3_bonus_result(payout=bonus_payout)
+                    player.record_21_3_bonus_result(multiplier=bonus_multiplier)
 
         # Check if dealer has blackjack
         if self.dealer_hand.is_blackjack:
@@ -243,6 +1361,12 @@ class Simulation(object):
             # Play dealer's hand
             self.play_dealer_hand()
 
+            if self.current_bonus_counts_bust:
+                self.current_bonus_counts_bust.add_dealer_hand(self.dealer_hand)
+
+            # Same for every player's bust bonus
+            bust_controls = self.bust_control_variate.get_controls(self.dealer_hand) if self.bust_control_variate else None
+
             # Evaluate each player's hand; get from players, not starting hands
             for player in self.current_session.players:
                 for player_hand in player.hands:
@@ -253,82 +1377,113 @@ class Simulation(object):
 
                 # Pay bust bonus if configured
                 if player.will_play_bust_bonus(dealer_up_card=dealer_up_card):
-                    bonus_payout = self.bonus_payer_bust.get_payout(
+                    bonus_multiplier = self.bonus_payer_bust.get_payout(
                         dealer_hand=self.dealer_hand,
-                        bonus_bet=player.bonus_plan_bust.get_bet_amount(dealer_up_card=dealer_up_card)
+                        bonus_bet=1
                     )
 
-                    player.record_bust_bonus_result(payout=bonus_payout, dealer_up_card=dealer_up_card)
+                    player.record_bust_bonus_result(multiplier=bonus_multiplier, dealer_up_card=dealer_up_card, controls=bust_controls)
+
+        for player in self.current_session.players:
+            player.record_round()
+
+        if self.recorder:
+            self.recorder.record_round(self.dealer_hand, starting_cards, self.current_session.players)
 
         if self.verbose:
             self.log_all_hands()
 
 
-    def deal_round_of_cards(self):
-        # Deal to players
-        for player in self.current_session.players:
-            for player_hand in player.hands:
-                player_hand.add_card(self.get_next_card())
+    # Deal 2 rounds of cards; 1 card to each player and then the dealer per round
+    def deal_initial_cards(self):
+        num_cards = 2 * (self.num_players + 1)
 
-        # Dealer takes card
-        self.dealer_hand.add_card(self.get_next_card())
+        if self.shoe.remaining() >= num_cards:
+            cards = self.shoe.deal_many(num_cards)
+        else:
+            cards = [self.get_next_card() for c in range(num_cards)]
+
+        card_idx = 0
+        for deal_round in range(2):
+            # Deal to players
+            for player in self.current_session.players:
+                for player_hand in player.hands:
+                    player_hand.add_card(cards[card_idx])
+                    card_idx += 1
+
+            # Dealer takes card
+            self.dealer_hand.add_card(cards[card_idx])
+            card_idx += 1
 
     def play_dealer_hand(self):
-        action = self.determine_dealer_action()
+        dealer_hand = self.dealer_hand
+        dealer_actions = self.dealer_strategy.actions
 
-        self.log.debug(f'Playing dealer hand {self.dealer_hand}, Action: {action}')
+        # hit until the table says stand
+        while dealer_actions[2 * dealer_hand.hard_value + (dealer_hand.soft_value is not None)] == Strategy.HIT:
+            if self.verbose:
+                self.log.debug(f'Playing dealer hand {dealer_hand}, Action: H')
 
-        # stand
-        if action == 'S':
-            return
+            dealer_hand.add_card(self.get_next_card())
 
-        # hit
-        elif action == 'H':
-            self.dealer_hand.add_card(self.get_next_card())
-            self.play_dealer_hand()
+        if self.verbose:
+            self.log.debug(f'Playing dealer hand {dealer_hand}, Action: S')
 
     def determine_dealer_action(self):
-        if self.dealer_hand.soft_value and self.dealer_hand.soft_value > 17:
-            return 'S'
-        elif self.dealer_hand.hard_value >= 17:
-            return 'S'
-        else:
-            return 'H'
+        return self.dealer_strategy.determine_dealer_action_code(self.dealer_hand)
 
+    # Plays the hand and any hands split from it. Split hands go on a stack and are played after the hand they were
+    # split from, in the same order the cards would be dealt at the table.
     def play_player_hand(self, dealer_up_card, player_hand):
-        action = self.strategy.determine_player_action(dealer_up_card=dealer_up_card, player_hand=player_hand)
+        determine_player_action_code = self.strategy.determine_player_action_code
 
-        self.log.debug(f'Playing player hand {player_hand}, Action: {action}')
+        hands_to_play = [player_hand]
 
-        # stand
-        if action == 'S':
-            return
+        while hands_to_play:
+            player_hand = hands_to_play.pop()
 
-        # hit
-        elif action == 'H':
-            player_hand.add_card(self.get_next_card())
+            while True:
+                action = determine_player_action_code(dealer_up_card, player_hand)
 
-            # Check if we busted
-            if player_hand.hard_value > 21:
-                player_hand.result = BlackjackHandResult.LOSS
+                if self.verbose:
+                    self.log.debug(f'Playing player hand {player_hand}, Action: {Strategy.ACTION_STRS[action]}')
 
-                player_hand.player.record_hand_result(bj_hand=player_hand)
+                # stand
+                if action == Strategy.STAND:
+                    break
+
+                # hit
+                elif action == Strategy.HIT:
+                    player_hand.add_card(self.get_next_card())
+
+                    # Check if we busted
+                    if player_hand.hard_value > 21:
+                        player_hand.result = BlackjackHandResult.LOSS
 
-            self.play_player_hand(dealer_up_card=dealer_up_card, player_hand=player_hand)
+                        player_hand.player.record_hand_result(bj_hand=player_hand)
 
-        # double
-        elif action == 'D':
-            player_hand.bet *= 2
-            player_hand.add_card(self.get_next_card())
+                        if self.verbose:
+                            self.log.debug(f'Playing player hand {player_hand}, Action: S')
 
-        # split
-        elif action == 'SP':
-            new_hand = player_hand.split_hand()
+                        break
 
-            player_hand.player.add_hand(bj_hand=new_hand, split_limit=self.split_limit)
+                # double
+                elif action == Strategy.DOUBLE:
+                    player_hand.bet *= 2
+                    player_hand.is_doubled = True
+                    player_hand.add_card(self.get_next_card())
+                    break
 
-            self.play_player_hand(dealer_up_card=dealer_up_card, player_hand=player_hand)
-            self.play_player_hand(dealer_up_card=dealer_up_card, player_hand=new_hand)
+                # split; keep playing this hand and play the new one after it
+                elif action == Strategy.SPLIT:
+                    new_hand = player_hand.split_hand(new_hand=self.hand_pool.acquire(player=player_hand.player, dealer_hand=False))
+
+                    player_hand.player.add_hand(bj_hand=new_hand, split_limit=self.split_limit)
+
+                    hands_to_play.append(new_hand)
+
+                else:
+                    raise DetermineActionError(f'Unknown player action: {action}')
 
     def evaluate_hand_result(self, player_hand, dealer_hand):
         if dealer_hand.is_blackjack:
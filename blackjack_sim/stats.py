@@ -0,0 +1,194 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RunningStats(object):
+
+    """
+    Streaming mean and variance (Welford). Values are added one at a time with add() or a batch at a time with
+    add_batch(); merge() combines two accumulators (Chan et al.), so shards and batch tables can each keep their own
+    and combine them at the end without keeping the values.
+    """
+
+    Z_95 = 1.959963984540054  # two-sided 95% normal quantile
+
+    __slots__ = ['count', 'mean', 'm2']
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, x):
+        self.count += 1
+
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def add_batch(self, values):
+        if np is not None and isinstance(values, np.ndarray):
+            count = values.size
+            if count == 0:
+                return
+
+            mean = float(values.mean())
+            m2 = float(np.square(values - mean).sum())
+        else:
+            values = list(values)
+            count = len(values)
+            if count == 0:
+                return
+
+            mean = sum(values) / count
+            m2 = sum((x - mean) ** 2 for x in values)
+
+        self._combine(count, mean, m2)
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    # Sample variance
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def std_error(self):
+        return math.sqrt(self.variance() / self.count) if self.count > 1 else math.inf
+
+    # Half-width of the confidence interval of the mean; infinite until there are at least 2 values
+    def ci_halfwidth(self, z=Z_95):
+        return z * self.std_error()
+
+
+class RunningCovariance(object):
+
+    """
+    Streaming means and co-moments (sums of products of differences from the means) of a vector of values, with the
+    same add / add_batch / merge interface as RunningStats.
+
+    get_control_variate_estimate() treats the first value as the quantity being estimated and the rest as control
+    variates whose true means are 0: values that are correlated with it but whose expectation is known exactly.
+    """
+
+    __slots__ = ['num_values', 'count', 'means', 'comoments']
+
+    def __init__(self, num_values):
+        self.num_values = num_values
+        self.count = 0
+        self.means = [0.0] * num_values
+        self.comoments = [[0.0] * num_values for i in range(num_values)]
+
+    def add(self, values):
+        self.count += 1
+
+        deltas = [v - m for v, m in zip(values, self.means)]
+        self.means = [m + d / self.count for m, d in zip(self.means, deltas)]
+
+        weight = (self.count - 1) / self.count
+        for row, d_i in zip(self.comoments, deltas):
+            d_i *= weight
+            for j, d_j in enumerate(deltas):
+                row[j] += d_i * d_j
+
+    # rows of values; a 2D NumPy array or a list of lists
+    def add_batch(self, rows):
+        if np is not None and isinstance(rows, np.ndarray):
+            count = rows.shape[0]
+            if count == 0:
+                return
+
+            means = rows.mean(axis=0)
+            diffs = rows - means
+            self._combine(count, means.tolist(), (diffs.T @ diffs).tolist())
+        else:
+            for values in rows:
+                self.add(values)
+
+    def merge(self, other):
+        self._combine(other.count, other.means, other.comoments)
+
+    def _combine(self, count, means, comoments):
+        if count == 0:
+            return
+
+        total = self.count + count
+        deltas = [m - self_m for m, self_m in zip(means, self.means)]
+        weight = self.count * count / total
+
+        for i in range(self.num_values):
+            for j in range(self.num_values):
+                self.comoments[i][j] += comoments[i][j] + deltas[i] * deltas[j] * weight
+
+        self.means = [self_m + d * count / total for self_m, d in zip(self.means, deltas)]
+        self.count = total
+
+    # (estimate, standard error, variance reduction factor) of the mean of the first value using the others as control
+    # variates. The coefficients are the least squares fit of the first value on the controls; controls that never
+    # varied are left out, and with none left this is the plain mean.
+    def get_control_variate_estimate(self):
+        controls = [i for i in range(1, self.num_values) if self.comoments[i][i] > 0]
+
+        if self.count <= len(controls) + 1:
+            return self.means[0], math.inf, 1.0
+
+        raw_variance = self.comoments[0][0] / (self.count - 1)
+
+        coefficients = _solve(
+            [[self.comoments[i][j] for j in controls] for i in controls],
+            [self.comoments[i][0] for i in controls]
+        ) if controls else None
+
+        if coefficients is None:
+            return self.means[0], math.sqrt(raw_variance / self.count), 1.0
+
+        estimate = self.means[0] - sum(b * self.means[i] for b, i in zip(coefficients, controls))
+
+        residual = self.comoments[0][0] - sum(b * self.comoments[i][0] for b, i in zip(coefficients, controls))
+        residual_variance = max(residual, 0.0) / (self.count - len(controls) - 1)
+
+        variance_reduction = raw_variance / residual_variance if residual_variance > 0 else math.inf
+
+        return estimate, math.sqrt(residual_variance / self.count), variance_reduction
+
+
+# Solves a x = b for a small, square a by Gaussian elimination; None if a is singular
+def _solve(a, b):
+    n = len(b)
+    m = [list(row) + [rhs] for row, rhs in zip(a, b)]
+
+    scale = max((abs(v) for row in a for v in row), default=0)
+    if scale == 0:
+        return None
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) <= 1e-12 * scale:
+            return None
+
+        m[col], m[pivot] = m[pivot], m[col]
+
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+
+    return x
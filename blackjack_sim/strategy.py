@@ -1,8 +1,34 @@
 from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
 
 
 class Strategy(object):
 
+    """
+    The strategy config is compiled into one flat table of int action codes so that each decision is a single list
+    index. The table is keyed by hand class, total (hard total, or the pair rank index for pairs), dealer up card index,
+    whether the player can still split and whether it's the first decision for the hand (2 cards); see get_table_idx.
+    """
+
+    # Action codes
+    STAND = 0
+    HIT = 1
+    DOUBLE = 2
+    SPLIT = 3
+    NO_ACTION = -1  # strategy config doesn't cover the hand
+
+    ACTION_STRS = ['S', 'H', 'D', 'SP']
+    ACTION_CODES = {action_str: code for code, action_str in enumerate(ACTION_STRS)}
+
+    # Hand classes
+    HARD = 0
+    SOFT = 1
+    PAIR = 2
+
+    NUM_HAND_CLASSES = 3
+    NUM_TOTALS = 32  # hard totals go up to 30 (20 + a ten); pair rank indexes are < 13
+    NUM_DEALER_UP_CARDS = 10
+
     def __init__(self, strategy_config):
         self.hard_totals = {}  # dict; key=total, val=action
         self.soft_hands = {}  # dict; key=hand, val=action
@@ -36,47 +62,157 @@ class Strategy(object):
         else:
             raise ConfigurationError('ERROR: Missing pairs in strategy config')
 
-    def determine_player_action(self, dealer_up_card, player_hand):
-        num_cards = len(player_hand.cards)
+        for actions in list(self.hard_totals.values()) + list(self.soft_hands.values()) + list(self.pairs.values()):
+            for action in actions:
+                if action not in self.ACTION_CODES:
+                    raise ConfigurationError(f'Invalid action in strategy config: {action}')
 
-        # There will only be 1 card if we just split
-        if num_cards == 1:
-            return 'H'
+        self.actions = self._compile()
+
+    @classmethod
+    def get_table_idx(cls, hand_class, total, dealer_up_card_idx, can_split, first_decision):
+        return (((hand_class * cls.NUM_TOTALS + total) * cls.NUM_DEALER_UP_CARDS + dealer_up_card_idx) * 2 + can_split) * 2 + first_decision
+
+    def _compile(self):
+        actions = [self.NO_ACTION] * (self.NUM_HAND_CLASSES * self.NUM_TOTALS * self.NUM_DEALER_UP_CARDS * 4)
+
+        for hand_class in [self.HARD, self.SOFT, self.PAIR]:
+            for total in range(self.NUM_TOTALS):
+                for dealer_up_card_idx in range(self.NUM_DEALER_UP_CARDS):
+                    for can_split in [0, 1]:
+                        for first_decision in [0, 1]:
+                            action = self._resolve_action(hand_class, total, dealer_up_card_idx, can_split, first_decision)
+
+                            idx = self.get_table_idx(hand_class, total, dealer_up_card_idx, can_split, first_decision)
+                            actions[idx] = self.ACTION_CODES[action] if action else self.NO_ACTION
+
+        return actions
+
+    # Looks up the action in the strategy config for a compiled table entry; returns None if there isn't one
+    def _resolve_action(self, hand_class, total, dealer_up_card_idx, can_split, first_decision):
+        if hand_class == self.PAIR:
+            if not first_decision or total >= Card.NUM_RANKS:
+                return None
+
+            rank = Card.CARD_RANKS[total]
+            hand_cards = rank + rank
+            hard_value = 2 * Card.VALUES[Card.CARD_RANKS.index(rank)]
+        else:
+            hard_value = total
+            hand_cards = None
+
+            # Two card soft hands are keyed by their sorted ranks, e.g. A7
+            if hand_class == self.SOFT and first_decision and 2 < hard_value < 11:
+                hand_cards = 'A' + str(hard_value - 1)
+
+        soft_value = hard_value + 10 if hand_class != self.HARD and hard_value <= 11 else None
 
         # Return action of stand if we're at 21 or busted
-        if player_hand.hard_value >= 21:
+        if hard_value >= 21:
             return 'S'
 
-        hand_cards = player_hand.get_hand_as_ranks()
-
         action = None
         # Determine the player's first action for the hand
         # Look up pairs first (if still allowed to split), then soft hands, then hard totals; this order matters.
-        if num_cards == 2:
-            if player_hand.is_blackjack:
-                action = 'S'
-            elif player_hand.player.allowed_to_split and hand_cards in self.pairs.keys():
-                action = self.pairs[hand_cards][dealer_up_card.dealer_up_card_index]
+        if first_decision:
+            if soft_value == 21:
+                action = 'S'  # blackjack
+            elif can_split and hand_cards in self.pairs.keys():
+                action = self.pairs[hand_cards][dealer_up_card_idx]
             elif hand_cards in self.soft_hands.keys():
-                action = self.soft_hands[hand_cards][dealer_up_card.dealer_up_card_index]
-            elif player_hand.hard_value in self.hard_totals.keys():
-                action = self.hard_totals[player_hand.hard_value][dealer_up_card.dealer_up_card_index]
+                action = self.soft_hands[hand_cards][dealer_up_card_idx]
+            elif hard_value in self.hard_totals.keys():
+                action = self.hard_totals[hard_value][dealer_up_card_idx]
 
         # Determine the player's action after initially hitting
         # Stand on soft 19 or greater, otherwise follow hard totals strategy and either hit or stand
         # TODO: do we need to add another strategy config for this?
-        elif num_cards > 2:
-            if player_hand.soft_value and player_hand.soft_value >= 19:
+        else:
+            if soft_value and soft_value >= 19:
                 return 'S'
-            elif player_hand.hard_value in self.hard_totals.keys():
-                action = self.hard_totals[player_hand.hard_value][dealer_up_card.dealer_up_card_index]
+            elif hard_value in self.hard_totals.keys():
+                action = self.hard_totals[hard_value][dealer_up_card_idx]
 
                 if action == 'D':
                     action = 'H'
 
-        if not action:
-            raise DetermineActionError(f'Unable to determine player action for hand: {hand_cards}')
+        return action
+
+    def determine_player_action(self, dealer_up_card, player_hand):
+        return self.ACTION_STRS[self.determine_player_action_code(dealer_up_card, player_hand)]
+
+    def determine_player_action_code(self, dealer_up_card, player_hand):
+        cards = player_hand.cards
+        num_cards = len(cards)
+
+        # There will only be 1 card if we just split
+        if num_cards == 1:
+            return self.HIT
+
+        hard_value = player_hand.hard_value
+
+        # Return action of stand if we're at 21 or busted
+        if hard_value >= 21:
+            return self.STAND
+
+        if num_cards == 2:
+            first_decision = 1
+            rank_idx = Card.RANK_INDEXES[cards[0]]
+
+            if rank_idx == Card.RANK_INDEXES[cards[1]]:
+                hand_class = self.PAIR
+                total = rank_idx
+            else:
+                hand_class = self.SOFT if player_hand.contains_ace else self.HARD
+                total = hard_value
+        else:
+            first_decision = 0
+            hand_class = self.SOFT if player_hand.contains_ace else self.HARD
+            total = hard_value
+
+        action = self.actions[
+            (((hand_class * self.NUM_TOTALS + total) * self.NUM_DEALER_UP_CARDS + Card.DEALER_UP_CARD_INDEXES[dealer_up_card]) * 2
+             + player_hand.player.allowed_to_split) * 2 + first_decision
+        ]
+
+        if action == self.NO_ACTION:
+            raise DetermineActionError(f'Unable to determine player action for hand: {player_hand.get_hand_as_ranks()}')
 
         return action
 
 
+class DealerStrategy(object):
+
+    """
+    The dealer's action for every hand, precomputed into a table indexed by hard total and soft flag (see get_table_idx).
+    Action codes are the same as Strategy's. The dealer stands on 17 or more; hits_soft_17 chooses between the H17 and
+    S17 rules for soft 17.
+    """
+
+    MAX_HARD_VALUE = 31  # dealer hits 16 at most
+
+    def __init__(self, hits_soft_17=True):
+        self.hits_soft_17 = hits_soft_17
+
+        self.actions = [Strategy.STAND] * (2 * (self.MAX_HARD_VALUE + 1))
+
+        for hard_value in range(self.MAX_HARD_VALUE + 1):
+            for is_soft in [0, 1]:
+                # Hands can only be soft if counting an ace as 11 doesn't bust
+                soft_value = hard_value + 10 if is_soft and hard_value <= 11 else None
+
+                if soft_value and (soft_value > 17 or (soft_value == 17 and not self.hits_soft_17)):
+                    action = Strategy.STAND
+                elif hard_value >= 17:
+                    action = Strategy.STAND
+                else:
+                    action = Strategy.HIT
+
+                self.actions[self.get_table_idx(hard_value, is_soft)] = action
+
+    @staticmethod
+    def get_table_idx(hard_value, is_soft):
+        return 2 * hard_value + is_soft
+
+    def determine_dealer_action_code(self, dealer_hand):
+        return self.actions[2 * dealer_hand.hard_value + (dealer_hand.soft_value is not None)]
@@ -0,0 +1,28 @@
+import unittest
+from benchmarks import run_benchmarks
+from common_test_utils import *
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    # Benchmarks have to keep up with the code they time
+    @sub_test([dict(name=name) for name in run_benchmarks.MICRO_BENCHMARKS])
+    def test_micro_benchmark_runs(self, name):
+        run, num_ops = run_benchmarks.MICRO_BENCHMARKS[name]()
+        run()
+
+        assert num_ops > 0
+
+    def test_compare_results(self):
+        baseline = {'benchmarks': {'a': {'rate': 100}, 'b': {'rate': 100}, 'c': {'rate': 100}}}
+        results = {'benchmarks': {'a': {'rate': 120}, 'b': {'rate': 90}, 'c': {'rate': 80}, 'd': {'rate': 1}}}
+
+        comparison = run_benchmarks.compare_results(results, baseline, tolerance=0.15)
+
+        assert sorted(comparison) == ['a', 'b', 'c']
+        assert [regressed for change, regressed in (comparison[name] for name in 'abc')] == [False, False, True]
+        self.assertAlmostEqual(comparison['c'][0], -0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
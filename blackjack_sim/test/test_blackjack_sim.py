@@ -1,5 +1,13 @@
+import json
+import os
+import tempfile
 import unittest
 from blackjack_sim.game_models import *
+from blackjack_sim.simulation import Simulation, SimulationManager
+from blackjack_sim.strategy import Strategy, DealerStrategy
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.bonus_odds import BustBonusOdds
+from blackjack_sim.bonuses import BonusPlan
 from common_test_utils import *
 from test_config import TestConfig
 
@@ -17,6 +25,290 @@ class TestSimulation(unittest.TestCase):
         assert sim.min_bet == 15
         assert sim.buyin_num_bets == 20
 
+    # Results for a given seed must not depend on how many worker processes played the shards
+    def test_sharded_results_independent_of_workers(self):
+        results = []
+        for workers in [1, 2]:
+            sim_config = dict(TestConfig.simulation_config, num_sessions=2, seed=1234, shard_hands=30, workers=workers)
+            sim = Simulation(0, sim_config, TestConfig.strategy_config)
+            sim.run()
+
+            assert len(sim.sessions) == 2
+            assert sim.num_hands_played == 2 * sim.max_session_hands
+
+            results.append([p.get_gameplay_result_str(min_bet=sim.min_bet) for s in sim.sessions for p in s.players])
+
+        assert results[0] == results[1]
+
+    # Shuffling shoes in background producers deals exactly the same shoes
+    def test_shoe_prefetch_results_match(self):
+        results = []
+        for producers in [0, 1]:
+            sim_config = dict(TestConfig.simulation_config, seed=99, shoe_batch_size=2, shoe_prefetch_producers=producers)
+            sim = Simulation(0, sim_config, TestConfig.strategy_config)
+            sim.run()
+
+            assert sim.num_hands_played == sim.max_session_hands
+
+            results.append([p.get_gameplay_result_str(min_bet=sim.min_bet) for s in sim.sessions for p in s.players])
+
+        assert results[0] == results[1]
+        assert sim.num_prefetch_batches > 0
+
+    # A single batch table deals the same shoes as the object engine, so every counter has to match
+    @sub_test([
+        dict(split_limit=4, bonus_bets={'21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1}, 'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 5}}),
+        dict(dealer_hits_soft_17=0, penetration=0.5, bonus_bets={'bust': {'name': 'Bust', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {
+            'A': 5, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 5, '7': 0, '6': 15, '5': 5, '4': 5, '3': 5, '2': 5}}}),
+        dict(split_limit=2, num_decks=1, rng='random'),
+        dict(infinite_deck=1, bonus_bets={'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 5}}),
+        dict(bonus_bets={
+            '21_3': [{'name': '21+3 $1', 'frequency': 'always', 'amount': 1}, {'name': '21+3 $5', 'frequency': 'always', 'amount': 5}],
+            'bust': [{'name': 'Bust', 'frequency': 'always', 'amount': 5}, {'name': 'Bust 6', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {
+                'A': 0, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 0, '7': 0, '6': 15, '5': 0, '4': 0, '3': 0, '2': 0}}]
+        }),
+        dict(bonus_bets={'bust': [{'name': 'Bust', 'frequency': 'always', 'amount': 5, 'control_variate': 1}, {'name': 'Bust 2-6', 'frequency': 'dealer_up_card_lookup',
+            'control_variate': 1, 'dealer_up_card_lookup': {'A': 0, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 0, '7': 0, '6': 5, '5': 5, '4': 5, '3': 5, '2': 5}}]}),
+        dict(min_bet=2.5, bonus_bets={'bust': {'name': 'Bust', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {
+            'A': 2.5, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 7.5, '7': 0, '6': 2.5, '5': 2.5, '4': 2.5, '3': 2.5, '2': 2.5}}})
+    ])
+    def test_batch_engine_matches_object_engine(self, **sim_config):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        results = []
+        for engine in ['object', 'batch']:
+            sim = Simulation(0, dict(TestConfig.simulation_config, seed=2024, max_session_hands=2000, engine=engine, batch_tables=1, **sim_config), TestConfig.strategy_config)
+            sim.run()
+
+            results.append([sim.num_hands_played, sim.num_shoes_used] + [p.get_gameplay_result_str(min_bet=sim.min_bet) for s in sim.sessions for p in s.players])
+
+        assert results[0] == results[1]
+
+    def test_batch_engine_tables(self):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sim_config = dict(TestConfig.simulation_config, seed=7, max_session_hands=1001, engine='batch', batch_tables=64, split_limit=TestConfig.SPLIT_LIMIT)
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        assert sim.num_hands_played == 1001
+        assert sim.sessions[0].num_hands_played == 1001
+
+        for player in sim.sessions[0].players:
+            assert player.num_hands_played == player.num_wins + player.num_pushes + player.num_losses
+            assert player.num_hands_played >= 1001
+            assert max(player.num_split_hands_dict, default=0) <= TestConfig.SPLIT_LIMIT
+
+    # Bonus bets don't change how hands are played, so each plan of a list gets exactly the results it gets on its own
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_bonus_plan_lists(self, engine):
+        if engine == 'batch' and not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        lookup = {'A': 5, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 0, '7': 0, '6': 5, '5': 5, '4': 5, '3': 5, '2': 5}
+        bust_plans = [
+            {'name': 'Bust Always', 'frequency': 'always', 'amount': 5},
+            {'name': 'Bust 2-6+A', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': lookup},
+            {'name': 'Bust Only 6', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': dict({r: 0 for r in lookup}, **{'6': 15})}
+        ]
+        bonus_21_3_plans = [{'name': '21+3 $1', 'frequency': 'always', 'amount': 1}, {'name': '21+3 $2', 'frequency': 'always', 'amount': 2}]
+
+        sim_config = dict(TestConfig.simulation_config, seed=12, max_session_hands=3000, engine=engine, batch_tables=50)
+
+        sim = Simulation(0, dict(sim_config, bonus_bets={'21_3': bonus_21_3_plans, 'bust': bust_plans}), TestConfig.strategy_config)
+        sim.run()
+        players = sim.sessions[0].players
+
+        for plan_idx, plan_config in enumerate(bust_plans):
+            single_sim = Simulation(0, dict(sim_config, bonus_bets={'bust': plan_config}), TestConfig.strategy_config)
+            single_sim.run()
+
+            for player, single_player in zip(players, single_sim.sessions[0].players):
+                assert player.bonus_plans_bust[plan_idx].get_result_str() == single_player.bonus_plan_bust.get_result_str()
+
+        for plan_idx, plan_config in enumerate(bonus_21_3_plans):
+            single_sim = Simulation(0, dict(sim_config, bonus_bets={'21_3': plan_config}), TestConfig.strategy_config)
+            single_sim.run()
+
+            for player, single_player in zip(players, single_sim.sessions[0].players):
+                assert player.bonus_plans_21_3[plan_idx].get_result_str() == single_player.bonus_plan_21_3.get_result_str()
+
+        # Only the first plans are bet
+        single_sim = Simulation(0, dict(sim_config, bonus_bets={'21_3': bonus_21_3_plans[0], 'bust': bust_plans[0]}), TestConfig.strategy_config)
+        single_sim.run()
+
+        for player, single_player in zip(players, single_sim.sessions[0].players):
+            assert player.chip_stack == single_player.chip_stack
+
+    # Controlling for the dealer's exact bust odds narrows the interval a lot without moving the estimate off the exact edge
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_bust_bonus_control_variate(self, engine):
+        if engine == 'batch' and not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        plan_config = {'name': 'Bust', 'frequency': 'always', 'amount': 5, 'control_variate': 1}
+        sim_config = dict(TestConfig.simulation_config, seed=3, max_session_hands=5000, engine=engine, batch_tables=50, bonus_bets={'bust': plan_config})
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        exact_edge = BustBonusOdds(num_decks=sim.num_decks, hits_soft_17=sim.dealer_hits_soft_17).get_house_edge(BonusPlan(plan_config))
+
+        for player in sim.sessions[0].players:
+            plan = player.bonus_plan_bust
+            cv_edge, cv_halfwidth, variance_reduction = plan.get_control_variate_edge()
+
+            assert plan.control_stats.count == plan.num_times_played
+            assert variance_reduction > 5
+            assert cv_halfwidth < plan.get_edge_ci_halfwidth() / 2
+            assert abs(cv_edge - exact_edge) < 2 * cv_halfwidth
+
+    def test_21_3_control_variate(self):
+        sim_config = dict(TestConfig.simulation_config, bonus_bets={'21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1, 'control_variate': 1}})
+
+        with self.assertRaises(ConfigurationError):
+            Simulation(0, sim_config, TestConfig.strategy_config)
+
+    def test_infinite_deck(self):
+        sim_config = dict(TestConfig.simulation_config, seed=31, max_session_hands=500, infinite_deck=1, finite_reference_hands=200,
+                          bonus_bets={'21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1}})
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        assert sim.num_hands_played == 500
+        assert sim.num_shoes_used == 0
+
+        for player in sim.sessions[0].players:
+            assert player.num_hands_played == player.num_wins + player.num_pushes + player.num_losses
+
+    # Samples the cards left in the simulation's own shoes without playing the simulation itself
+    def test_sampled_bonus_results(self):
+        sim_config = dict(TestConfig.simulation_config, seed=5, bonus_bets={
+            '21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1},
+            'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 5}
+        })
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+
+        with self.assertLogs(sim.log, 'INFO') as logs:
+            sim.log_sampled_bonus_results(500)
+
+        assert sim.num_hands_played == 0
+        assert sum('21+3 House Edge Per $1' in line for line in logs.output) == 1
+        assert sum('Bust House Edge Per $1' in line for line in logs.output) == 1
+
+    # Stops at the first shard that reaches the target; where it stops doesn't depend on the # of workers
+    def test_target_ci_halfwidth(self):
+        results = []
+        for workers in [1, 2]:
+            sim_config = dict(TestConfig.simulation_config, seed=17, max_session_hands=5000, shard_hands=500, target_ci_halfwidth=8, workers=workers)
+            sim = Simulation(0, sim_config, TestConfig.strategy_config)
+            sim.run()
+
+            results.append([sim.num_hands_played] + [p.get_gameplay_result_str(min_bet=sim.min_bet) for s in sim.sessions for p in s.players])
+
+            assert sim.num_hands_played < 5000
+            for player in sim.sessions[0].players:
+                assert player.get_edge_ci_halfwidth(sim.min_bet) <= 8
+
+        assert results[0] == results[1]
+
+        with self.assertRaises(ConfigurationError):
+            Simulation(0, dict(TestConfig.simulation_config, target_ci_halfwidth=0), TestConfig.strategy_config)
+
+    # A session that fits in one shard is still split up, so the run can stop before the limit
+    def test_target_ci_halfwidth_single_shard_session(self):
+        sim = Simulation(0, dict(TestConfig.simulation_config, seed=17, max_session_hands=5000, target_ci_halfwidth=8), TestConfig.strategy_config)
+
+        assert sim.shard_hands == 500
+        assert len(sim.get_shards()) == Simulation.MIN_TARGET_CI_WAVES
+
+        sim.run()
+        assert sim.num_hands_played < 5000
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ConfigurationError):
+            Simulation(0, dict(TestConfig.simulation_config, engine='gpu'), TestConfig.strategy_config)
+
+    # Simulations in a comparison group deal the same shoes, so their differences have a much smaller paired error
+    def test_manager_comparison_group(self):
+        strategy_file_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'basic_strategy.json')
+
+        base_config = dict(TestConfig.simulation_config, strategy_config_file=strategy_file_path, comparison_group='bust', seed=8, max_session_hands=4000, shard_hands=200)
+        sim_configs = [
+            dict(base_config, name='No Bonus'),
+            dict(base_config, name='No Bonus Again'),
+            dict(base_config, name='Bust Bonus', bonus_bets={'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 5}}),
+            {k: v for k, v in dict(base_config, name='Not Grouped').items() if k != 'comparison_group'}
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sim_config_file_path = os.path.join(tmp_dir, 'sim_config.json')
+            with open(sim_config_file_path, 'w') as f:
+                json.dump(sim_configs, f)
+
+            sim_mgr = SimulationManager(sim_config_file_path=sim_config_file_path)
+
+        no_bonus_sim, no_bonus_again_sim, bust_sim, other_sim = sim_mgr.simulations
+
+        assert no_bonus_sim.seed == no_bonus_again_sim.seed == bust_sim.seed
+        assert no_bonus_sim.shoe_stream == no_bonus_again_sim.shoe_stream == bust_sim.shoe_stream == 0
+        assert other_sim.shoe_stream == 3
+        assert list(sim_mgr.get_comparison_groups()) == ['bust']
+
+        sim_mgr.run_simulations()
+
+        # Same config and shoes; exactly the same results
+        assert sim_mgr.get_comparison(no_bonus_sim, no_bonus_again_sim) == (0, 0, sim_mgr.get_comparison(no_bonus_sim, no_bonus_again_sim)[2])
+
+        # The bust bonus doesn't change how the hands are played, so only the bonus bets' own variance is left
+        edge_diff, paired_std_error, independent_std_error = sim_mgr.get_comparison(no_bonus_sim, bust_sim)
+        assert edge_diff != 0
+        assert paired_std_error < independent_std_error / 1.5
+
+        # Shoes depend on the group's settings
+        with self.assertRaises(ConfigurationError):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                sim_config_file_path = os.path.join(tmp_dir, 'sim_config.json')
+                with open(sim_config_file_path, 'w') as f:
+                    json.dump([sim_configs[0], dict(sim_configs[1], num_decks=6)], f)
+
+                SimulationManager(sim_config_file_path=sim_config_file_path)
+
+    # Simulations that use the same strategy file share one compiled strategy
+    def test_manager_loads_strategy_once(self):
+        strategy_file_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'basic_strategy.json')
+
+        sim_configs = [
+            dict(TestConfig.simulation_config, name='Small', strategy_config_file=strategy_file_path, max_session_hands=10),
+            dict(TestConfig.simulation_config, name='Large', strategy_config_file=strategy_file_path, num_decks=6)
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sim_config_file_path = os.path.join(tmp_dir, 'sim_config.json')
+            with open(sim_config_file_path, 'w') as f:
+                json.dump(sim_configs, f)
+
+            sim_mgr = SimulationManager(sim_config_file_path=sim_config_file_path, workers=2)
+
+        assert len(sim_mgr.simulations) == 2
+        assert len(sim_mgr.strategies) == 1
+        assert sim_mgr.simulations[0].strategy is sim_mgr.simulations[1].strategy
+
+        small_sim, large_sim = sim_mgr.simulations
+        assert large_sim.get_shard_cost(large_sim.get_shards()[0]) > small_sim.get_shard_cost(small_sim.get_shards()[0])
+
+        sim_mgr.run_simulations()
+
+        assert small_sim.num_hands_played == 10
+        assert large_sim.num_hands_played == 100
+
     # Verify that an action is determined for every possible combination of player hand and dealer up card
     def test_determine_player_action_all_starting_hands(self):
         sim = TestConfig.get_simulation()
@@ -73,6 +365,53 @@ class TestSimulation(unittest.TestCase):
 
         assert action == expected_action
 
+    # Decisions after the first one come from the compiled table too
+    @sub_test([
+        dict(player_hand_str='932', dealer_up_card_rank='2', expected_action=Strategy.STAND),
+        dict(player_hand_str='932', dealer_up_card_rank='7', expected_action=Strategy.HIT),
+        dict(player_hand_str='A25', dealer_up_card_rank='9', expected_action=Strategy.HIT),
+        dict(player_hand_str='A26', dealer_up_card_rank='9', expected_action=Strategy.STAND),
+        dict(player_hand_str='225', dealer_up_card_rank='6', expected_action=Strategy.HIT),
+        dict(player_hand_str='T2', dealer_up_card_rank='6', expected_action=Strategy.STAND),
+        dict(player_hand_str='T2', dealer_up_card_rank='A', expected_action=Strategy.HIT),
+        dict(player_hand_str='88', dealer_up_card_rank='A', expected_action=Strategy.SPLIT),
+        dict(player_hand_str='AT', dealer_up_card_rank='A', expected_action=Strategy.STAND)
+    ])
+    def test_determine_player_action_code(self, player_hand_str, dealer_up_card_rank, expected_action):
+        sim = TestConfig.get_simulation()
+
+        player_hand = TestConfig.get_blackjack_hand(ranks_str=player_hand_str)
+        dealer_up_card = Card('C', dealer_up_card_rank)
+
+        action = sim.strategy.determine_player_action_code(dealer_up_card=dealer_up_card, player_hand=player_hand)
+
+        assert action == expected_action
+        assert sim.strategy.determine_player_action(dealer_up_card=dealer_up_card, player_hand=player_hand) == Strategy.ACTION_STRS[action]
+
+    def test_invalid_strategy_action(self):
+        strategy_config = dict(TestConfig.strategy_config, hard_totals=dict(TestConfig.strategy_config['hard_totals'], **{'12': ['X'] * 10}))
+
+        with self.assertRaises(ConfigurationError):
+            Strategy(strategy_config)
+
+    @sub_test([
+        dict(dealer_hand_str='A6', hits_soft_17=True, expected_action=Strategy.HIT),
+        dict(dealer_hand_str='A6', hits_soft_17=False, expected_action=Strategy.STAND),
+        dict(dealer_hand_str='A24', hits_soft_17=True, expected_action=Strategy.HIT),
+        dict(dealer_hand_str='A24', hits_soft_17=False, expected_action=Strategy.STAND),
+        dict(dealer_hand_str='A7', hits_soft_17=True, expected_action=Strategy.STAND),
+        dict(dealer_hand_str='A5', hits_soft_17=False, expected_action=Strategy.HIT),
+        dict(dealer_hand_str='T6', hits_soft_17=False, expected_action=Strategy.HIT),
+        dict(dealer_hand_str='T7', hits_soft_17=True, expected_action=Strategy.STAND),
+        dict(dealer_hand_str='A6T', hits_soft_17=True, expected_action=Strategy.STAND),
+        dict(dealer_hand_str='A5T', hits_soft_17=True, expected_action=Strategy.HIT),
+        dict(dealer_hand_str='T6K', hits_soft_17=True, expected_action=Strategy.STAND)
+    ])
+    def test_dealer_action(self, dealer_hand_str, hits_soft_17, expected_action):
+        dealer_hand = TestConfig.get_blackjack_hand(ranks_str=dealer_hand_str, is_dealer_hand=True)
+
+        assert DealerStrategy(hits_soft_17=hits_soft_17).determine_dealer_action_code(dealer_hand) == expected_action
+
     # Verify that we're playing these trickier hands correctly
     @sub_test([
         dict(player_hand_str='A2A'),
@@ -0,0 +1,174 @@
+import json
+import os
+import tempfile
+import unittest
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.bonus_counts import TwentyOne3OutcomeCounts, BustOutcomeCounts
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds
+from blackjack_sim.cards import Card
+from blackjack_sim.errors import *
+from common_test_utils import *
+from test_config import TestConfig
+
+
+class TestBonusOutcomeCounts(unittest.TestCase):
+
+    @sub_test([
+        dict(rank_str='789', suited=True, outcome=TwentyOne3BonusOdds.STRAIGHT_FLUSH),
+        dict(rank_str='QKA', suited=False, outcome=TwentyOne3BonusOdds.STRAIGHT),
+        dict(rank_str='555', suited=False, outcome=TwentyOne3BonusOdds.TRIPS),
+        dict(rank_str='29K', suited=True, outcome=TwentyOne3BonusOdds.FLUSH),
+        dict(rank_str='29K', suited=False, outcome=TwentyOne3BonusOdds.NO_WIN)
+    ])
+    def test_21_3_outcome(self, rank_str, suited, outcome):
+        counts = TwentyOne3OutcomeCounts()
+        cards = [Card('C' if suited else Card.CARD_SUITS[i], rank) for i, rank in enumerate(rank_str)]
+        counts.add_hand(cards[0], cards[1:])
+
+        assert counts.get_count(rank_str[0], outcome) == 1
+        assert counts.get_num_settled() == 1
+
+    @sub_test([
+        dict(rank_str='888', suited=True, outcome=BustBonusOdds.SUITED_888),
+        dict(rank_str='888', suited=False, outcome=BustBonusOdds.NON_SUITED_888),
+        dict(rank_str='T6K', suited=True, outcome=BustBonusOdds.SUITED),
+        dict(rank_str='T6K', suited=False, outcome=BustBonusOdds.NON_SUITED),
+        dict(rank_str='T7', suited=False, outcome=BustBonusOdds.NO_BUST)
+    ])
+    def test_bust_outcome(self, rank_str, suited, outcome):
+        counts = BustOutcomeCounts()
+        counts.add_dealer_hand(TestConfig.get_blackjack_hand(rank_str, suited=suited, is_dealer_hand=True))
+
+        assert counts.get_count(rank_str[0], outcome) == 1
+        assert counts.get_outcome_counts()[outcome] == 1
+
+    # Counts of the parts of a simulation add up to the counts of all of its hands, whatever the up cards
+    def test_merged_21_3_what_if(self):
+        hands = [('789', True), ('QKA', False), ('555', False), ('29K', True), ('29K', False), ('A23', False)]
+
+        counts = TwentyOne3OutcomeCounts()
+        parts = [TwentyOne3OutcomeCounts(), TwentyOne3OutcomeCounts()]
+        for hand_idx, (rank_str, suited) in enumerate(hands):
+            cards = [Card('C' if suited else Card.CARD_SUITS[i], rank) for i, rank in enumerate(rank_str)]
+            counts.add_hand(cards[0], cards[1:])
+            parts[hand_idx % 2].add_hand(cards[0], cards[1:])
+
+        parts[0].merge(parts[1])
+        assert parts[0].counts == counts.counts
+
+        # Straight flush, 2 straights, trips and flush wins and a loss: (30 + 10 + 10 + 20 + 5 - 1) / 6, then with overrides
+        assert counts.what_if().ev == 74 / 6
+        assert counts.what_if(payouts={'straight_flush': 40, 'straight': 12}).ev == 88 / 6
+
+    def test_what_if_payouts(self):
+        counts = BustOutcomeCounts()
+        for rank_str, suited in [('888', True), ('T6K', False), ('T7', False), ('T7', False)]:
+            counts.add_dealer_hand(TestConfig.get_blackjack_hand(rank_str, suited=suited, is_dealer_hand=True))
+
+        # 75 + 2 - 1 - 1 per $1
+        assert counts.what_if().ev == 75 / 4
+        assert counts.what_if(payouts={'suited_888': 100, 'non-suited': {'10': 3}}).ev == 101 / 4
+
+        # Only the 8 bets
+        result = counts.what_if(plan={'name': 'Bust 8', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': dict({r: 0 for r in Card.CARD_RANKS}, **{'8': 10})})
+        assert result.num_bets == 1
+        assert result.ev == 750
+        assert result.house_edge == -7500
+
+    def test_counts_dict(self):
+        counts = TwentyOne3OutcomeCounts(counts=range(Card.NUM_RANKS * len(TwentyOne3OutcomeCounts.OUTCOMES)))
+        assert TwentyOne3OutcomeCounts.from_dict(json.loads(json.dumps(counts.to_dict()))).counts == counts.counts
+
+        with self.assertRaises(ConfigurationError):
+            BustOutcomeCounts.from_dict(counts.to_dict())
+
+
+class TestRoundCounts(unittest.TestCase):
+
+    BONUS_BETS = {
+        '21_3': [{'name': '21+3', 'frequency': 'always', 'amount': 1}, {'name': '21+3 $5', 'frequency': 'always', 'amount': 5}],
+        'bust': [{'name': 'Bust', 'frequency': 'always', 'amount': 5}, {'name': 'Bust 2 6', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {
+            'A': 0, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 0, '7': 0, '6': 15, '5': 0, '4': 0, '3': 0, '2': 5}}]
+    }
+
+    PAYOUTS = {'21_3': {'straight_flush': 100, 'flush': 4}, 'bust': {'suited_888': 50, 'suited': {'6': 20}, 'non-suited': {'1': 4, '2': 2}}}
+
+    @classmethod
+    def run_simulation(cls, **sim_config):
+        sim_config = dict(dict(TestConfig.simulation_config, seed=9, max_session_hands=2000, shard_hands=1000, batch_tables=1, bonus_bets=cls.BONUS_BETS), **sim_config)
+
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        return sim
+
+    # With the configured payouts, what-ifs settle exactly the bets the simulation settled
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_what_if_matches_simulation(self, engine):
+        if engine == 'batch' and not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sim = self.run_simulation(engine=engine, batch_tables=50)
+        results = sim.log_what_if_results([])
+        players = sim.sessions[0].players
+
+        for plan_idx, plan in enumerate(players[0].bonus_plans_bust):
+            result = results[('Configured', plan.name)]
+
+            assert result.num_bets == plan.num_times_played
+            self.assertAlmostEqual(result.ev * result.num_bets, plan.net_amount, places=6)
+            self.assertAlmostEqual(result.ci_halfwidth, plan.get_edge_ci_halfwidth(), places=6)
+
+        for plan_idx, plan in enumerate(players[0].bonus_plans_21_3):
+            result = results[('Configured', plan.name)]
+
+            assert result.num_bets == sum(p.bonus_plans_21_3[plan_idx].num_times_played for p in players)
+            self.assertAlmostEqual(result.ev * result.num_bets, sum(p.bonus_plans_21_3[plan_idx].net_amount for p in players), places=6)
+
+    # Payouts don't change how the hands are played, so a what-if gets what a simulation with those payouts gets
+    def test_what_if_matches_simulated_payouts(self):
+        sim = self.run_simulation(engine='object')
+        results = sim.log_what_if_results([dict(self.PAYOUTS, name='Other')])
+
+        payout_sim = self.run_simulation(engine='object', bonus_payouts=self.PAYOUTS)
+        payout_results = payout_sim.log_what_if_results([])
+
+        for plan_name in ['21+3', '21+3 $5', 'Bust', 'Bust 2 6']:
+            assert results[('Other', plan_name)] == payout_results[('Configured', plan_name)]
+
+        assert results[('Other', 'Bust')].ev * results[('Other', 'Bust')].num_bets == payout_sim.sessions[0].players[0].bonus_plan_bust.net_amount
+
+    def test_engines_count_identically(self):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sims = [self.run_simulation(engine=engine) for engine in ['object', 'batch']]
+
+        assert sims[0].bonus_counts_21_3.counts == sims[1].bonus_counts_21_3.counts
+        assert sims[0].bonus_counts_bust.counts == sims[1].bonus_counts_bust.counts
+        assert sims[0].bonus_counts_21_3.get_num_settled() == 2000 * sims[0].num_players
+
+    def test_saved_counts(self):
+        with tempfile.TemporaryDirectory() as path:
+            counts_path = os.path.join(path, 'counts.json')
+            sim = self.run_simulation(engine='object', bonus_counts_path=counts_path)
+
+            loaded_sim = Simulation(0, dict(TestConfig.simulation_config, bonus_bets=self.BONUS_BETS), TestConfig.strategy_config)
+            loaded_sim.load_bonus_counts(counts_path)
+
+            assert loaded_sim.bonus_counts_21_3.counts == sim.bonus_counts_21_3.counts
+            assert loaded_sim.log_what_if_results([dict(self.PAYOUTS, name='Other')]) == sim.log_what_if_results([dict(self.PAYOUTS, name='Other')])
+
+    def test_invalid_payout_table(self):
+        sim = TestConfig.get_simulation()
+
+        with self.assertRaises(ConfigurationError):
+            sim.log_what_if_results([{'name': 'Bad', 'blackjack': 1.2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from math import comb, sqrt
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds
+from blackjack_sim.bonuses import TwentyOne3BonusPayer
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.game_models import BlackjackHand
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.cards import Card
+from common_test_utils import *
+from test_config import TestConfig
+
+
+class TestTwentyOne3BonusOdds(unittest.TestCase):
+
+    # Count every set of 3 cards (by card code, weighted by the # of copies in the shoe) with the payer itself
+    @sub_test([
+        dict(num_decks=1),
+        dict(num_decks=3)
+    ])
+    def test_outcome_counts_match_payer(self, num_decks):
+        payer = TwentyOne3BonusPayer()
+        odds = TwentyOne3BonusOdds(num_decks=num_decks, payer=payer)
+
+        outcomes_by_mx = {mx: outcome for outcome, mx in odds.get_multipliers().items()}
+        outcomes_by_mx[0] = TwentyOne3BonusOdds.NO_WIN
+
+        counts = {outcome: 0 for outcome in TwentyOne3BonusOdds.OUTCOMES}
+        for c1 in range(Card.NUM_CARDS):
+            for c2 in range(c1, Card.NUM_CARDS):
+                for c3 in range(c2, Card.NUM_CARDS):
+                    codes = (c1, c2, c3)
+
+                    num_hands = 1
+                    for code in set(codes):
+                        num_hands *= comb(num_decks, codes.count(code))
+
+                    if num_hands:
+                        player_hand = BlackjackHand(player=None, dealer_hand=False)
+                        player_hand.add_card(c2)
+                        player_hand.add_card(c3)
+
+                        counts[outcomes_by_mx[payer.get_payout(dealer_up_card=c1, player_hand=player_hand, bonus_bet=1)]] += num_hands
+
+        assert counts == odds.get_outcome_counts()
+        assert sum(counts.values()) == odds.get_num_hands()
+
+    def test_single_deck_counts(self):
+        counts = TwentyOne3BonusOdds(num_decks=1).get_outcome_counts()
+
+        assert counts[TwentyOne3BonusOdds.STRAIGHT_FLUSH] == 12 * 4
+        assert counts[TwentyOne3BonusOdds.TRIPS] == 13 * 4
+        assert counts[TwentyOne3BonusOdds.STRAIGHT] == 12 * (4 ** 3 - 4)
+        assert counts[TwentyOne3BonusOdds.FLUSH] == 4 * comb(13, 3) - 12 * 4
+
+    def test_infinite_deck_probabilities(self):
+        odds = TwentyOne3BonusOdds(num_decks=None)
+        outcomes = odds.get_outcome_probabilities()
+
+        assert odds.get_num_hands() == Card.NUM_CARDS ** 3
+        assert sum(odds.get_outcome_counts().values()) == odds.get_num_hands()
+
+        # Every card is drawn independently: trips is any 3 of a rank, a straight flush any of the 12 straights in one suit
+        self.assertAlmostEqual(outcomes[TwentyOne3BonusOdds.TRIPS], 1 / 13 ** 2, places=15)
+        self.assertAlmostEqual(outcomes[TwentyOne3BonusOdds.STRAIGHT_FLUSH], 12 * 6 / 52 ** 3 * 4, places=15)
+
+        # More decks are closer to an infinite deck
+        assert abs(TwentyOne3BonusOdds(num_decks=8).get_ev() - odds.get_ev()) < abs(TwentyOne3BonusOdds(num_decks=2).get_ev() - odds.get_ev())
+
+    # The simulated edge has to be within a few standard errors of the exact one
+    def test_simulation_matches_exact_edge(self):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sim_config = dict(TestConfig.simulation_config, seed=5, num_decks=6, max_session_hands=200000, engine='batch', batch_tables=5000,
+                          bonus_bets={'21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1}})
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        plans = [p.bonus_plan_21_3 for p in sim.sessions[0].players]
+        num_played = sum(plan.num_times_played for plan in plans)
+        simulated_ev = sum(plan.net_amount for plan in plans) / num_played
+
+        odds = TwentyOne3BonusOdds(num_decks=6)
+        outcomes = odds.get_outcome_probabilities()
+        variance = sum(outcomes[outcome] * mx ** 2 for outcome, mx in odds.get_multipliers().items()) + outcomes[TwentyOne3BonusOdds.NO_WIN] - odds.get_ev() ** 2
+
+        assert abs(simulated_ev - odds.get_ev()) < 5 * sqrt(variance / num_played)
+
+
+class TestBustBonusOdds(unittest.TestCase):
+
+    @sub_test([
+        dict(num_decks=None, hits_soft_17=True),
+        dict(num_decks=None, hits_soft_17=False),
+        dict(num_decks=1, hits_soft_17=True),
+        dict(num_decks=6, hits_soft_17=False)
+    ])
+    def test_outcome_probabilities(self, num_decks, hits_soft_17):
+        odds = BustBonusOdds(num_decks=num_decks, hits_soft_17=hits_soft_17)
+
+        for rank in Card.CARD_RANKS:
+            outcomes = odds.get_outcome_probabilities(rank)
+
+            assert set(outcomes) == set(BustBonusOdds.OUTCOMES)
+            assert all(p >= 0 for p in outcomes.values())
+            self.assertAlmostEqual(sum(outcomes.values()), 1, places=12)
+
+            if rank != '8':
+                assert outcomes[BustBonusOdds.SUITED_888] == 0 and outcomes[BustBonusOdds.NON_SUITED_888] == 0
+
+        # Only aces and tens can have a blackjack under them
+        assert odds.get_blackjack_probability('6') == 0
+        assert odds.get_blackjack_probability('A') > 0
+
+    def test_infinite_deck_probabilities(self):
+        odds = BustBonusOdds(num_decks=None, hits_soft_17=False)
+
+        # Published S17 infinite deck dealer bust probabilities
+        self.assertAlmostEqual(odds.get_bust_probability('2'), 0.353608, places=6)
+        self.assertAlmostEqual(odds.get_bust_probability('7'), 0.262312, places=6)
+
+        # Dealer 8 8 8 busts on the 3rd card
+        outcomes = odds.get_outcome_probabilities('8')
+        self.assertAlmostEqual(outcomes[BustBonusOdds.SUITED_888], (1 / 52) ** 2, places=15)
+        self.assertAlmostEqual(outcomes[BustBonusOdds.NON_SUITED_888], (1 / 13) ** 2 - (1 / 52) ** 2, places=15)
+
+        # Infinite deck blackjack under an ace is a ten
+        self.assertAlmostEqual(odds.get_blackjack_probability('A'), 4 / 13, places=15)
+
+    def test_finite_deck_888(self):
+        # 2 decks only have 2 8s of each suit, so suited 888 is impossible
+        outcomes = BustBonusOdds(num_decks=2).get_outcome_probabilities('8')
+
+        assert outcomes[BustBonusOdds.SUITED_888] == 0
+        self.assertAlmostEqual(outcomes[BustBonusOdds.NON_SUITED_888], (7 / 103) * (6 / 102), places=15)
+
+    def test_plan_ev(self):
+        odds = BustBonusOdds(num_decks=6)
+
+        always_plan = {'name': 'Bust', 'frequency': 'always', 'amount': 5}
+        six_plan = {'name': 'Bust', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {rank: 5 if rank == '6' else 0 for rank in Card.CARD_RANKS}}
+
+        self.assertAlmostEqual(odds.get_plan_ev(six_plan), 5 * odds.get_up_card_ev('6'), places=12)
+        self.assertAlmostEqual(odds.get_house_edge(six_plan), -100 * odds.get_up_card_ev('6'), places=12)
+
+        # Weighted by how often each up card is played
+        weights = {rank: 1 - odds.get_blackjack_probability(rank) for rank in Card.CARD_RANKS}
+        expected_ev = sum(weights[rank] * odds.get_up_card_ev(rank) for rank in Card.CARD_RANKS) / sum(weights.values())
+        self.assertAlmostEqual(odds.get_plan_ev(always_plan), 5 * expected_ev, places=12)
+
+        # The bust bonus is a house game
+        assert 0 < odds.get_house_edge(always_plan) < 20
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+from blackjack_sim.bonus_odds import TwentyOne3BonusOdds, BustBonusOdds
+from blackjack_sim.bonus_sampling import TwentyOne3BonusSampler, BustBonusSampler
+from blackjack_sim.rng import RandomStream
+from blackjack_sim.errors import *
+from blackjack_sim.cards import Card
+from common_test_utils import *
+
+
+class TestTwentyOne3BonusSampler(unittest.TestCase):
+
+    # Estimates are unbiased, so they should be within a few standard errors of the exact odds
+    @sub_test([
+        dict(num_decks=2),
+        dict(num_decks=None)
+    ])
+    def test_matches_exact_odds(self, num_decks):
+        sampler = TwentyOne3BonusSampler(num_decks=num_decks, rng=RandomStream.create('random', 3)).sample(1000)
+        exact = TwentyOne3BonusOdds(num_decks=num_decks).get_outcome_probabilities()
+
+        for outcome, (probability, std_error) in sampler.get_outcome_probabilities().items():
+            assert abs(probability - exact[outcome]) < 4 * std_error, outcome
+
+        ev, std_error, variance_reduction = sampler.get_ev()
+        assert abs(ev - TwentyOne3BonusOdds(num_decks=num_decks).get_ev()) < 4 * std_error
+
+    def test_rare_outcomes_oversampled(self):
+        sampler = TwentyOne3BonusSampler(num_decks=6, rng=RandomStream.create('random', 4)).sample(1000)
+        contributions = sampler.get_contributions()
+
+        assert contributions[TwentyOne3BonusOdds.STRAIGHT_FLUSH][2] > 5
+        assert sampler.get_ev()[2] > 1
+
+    # Without tilts every weight is 1: plain stratified sampling
+    def test_no_tilt(self):
+        sampler = TwentyOne3BonusSampler(num_decks=1, rng=RandomStream.create('random', 5), suited_tilt=1, near_tilt=1).sample(1000)
+
+        assert sampler.num_rounds == 1000
+        assert len(sampler._batches) == 10
+        for num_rounds, stratum_sums, outcome_sums in sampler._batches:
+            for stratum_sum, sums in zip(stratum_sums, outcome_sums):
+                self.assertAlmostEqual(sum(sums.values()), stratum_sum, places=9)
+
+    # Sampling from the cards left in a bigger shoe is the same as sampling from a full shoe of those cards
+    def test_samples_cards_left(self):
+        sampler = TwentyOne3BonusSampler(num_decks=6, rng=RandomStream.create('random', 8))
+        for i in range(1000):
+            sampler.sample_round(range(Card.NUM_CARDS))
+            if i % 100 == 99:
+                sampler.end_batch()
+
+        exact = TwentyOne3BonusOdds(num_decks=1).get_outcome_probabilities()
+        for outcome, (probability, std_error) in sampler.get_outcome_probabilities().items():
+            assert abs(probability - exact[outcome]) < 4 * std_error, outcome
+
+
+class TestBustBonusSampler(unittest.TestCase):
+
+    @sub_test([
+        dict(num_decks=2, hits_soft_17=True),
+        dict(num_decks=6, hits_soft_17=False),
+        dict(num_decks=None, hits_soft_17=True)
+    ])
+    def test_matches_exact_odds(self, num_decks, hits_soft_17):
+        sampler = BustBonusSampler(num_decks=num_decks, hits_soft_17=hits_soft_17, rng=RandomStream.create('random', 6)).sample(1000)
+        odds = BustBonusOdds(num_decks=num_decks, hits_soft_17=hits_soft_17)
+
+        # Overall probabilities weight each up card by how often the bet is settled with it
+        not_blackjack = [1 - odds.get_blackjack_probability(rank) for rank in Card.CARD_RANKS]
+        for outcome, (probability, std_error) in sampler.get_outcome_probabilities().items():
+            exact = sum(p * odds.get_outcome_probabilities(rank)[outcome] for p, rank in zip(not_blackjack, Card.CARD_RANKS)) / sum(not_blackjack)
+
+            assert abs(probability - exact) <= 4 * std_error, outcome
+
+        ev, std_error, variance_reduction = sampler.get_ev()
+        assert abs(ev - odds.get_plan_ev({'name': 'Bust', 'frequency': 'always', 'amount': 1})) < 4 * std_error
+
+        edge, edge_ci_halfwidth = sampler.get_house_edge()
+        self.assertAlmostEqual(edge, -ev * 100, places=12)
+
+    def test_rare_outcomes_oversampled(self):
+        sampler = BustBonusSampler(num_decks=6, rng=RandomStream.create('random', 7)).sample(1000)
+        contributions = sampler.get_contributions()
+
+        assert contributions[BustBonusOdds.SUITED_888][2] > 20
+        assert contributions[BustBonusOdds.NON_SUITED_888][2] > 5
+        assert contributions[BustBonusOdds.SUITED][2] > 2
+
+    # A deck without aces or tens: the dealer can't have blackjack and busting takes 3+ cards
+    def test_samples_cards_left(self):
+        cards = [code for code in range(Card.NUM_CARDS) if Card.VALUES[code] not in [1, 10]]
+        sampler = BustBonusSampler(num_decks=2, rng=RandomStream.create('random', 9))
+        sampler.sample_round(cards * 2)
+        sampler.end_batch()
+        sampler.sample_round(cards * 2)
+
+        assert sampler.num_rounds == 2
+        for num_rounds, stratum_sums, outcome_sums in sampler._get_batches():
+            assert [p > 0 for p in stratum_sums] == [Card.VALUES[rank_idx] not in [1, 10] for rank_idx in range(Card.NUM_RANKS)]
+            self.assertAlmostEqual(sum(stratum_sums), 1, places=12)
+
+    def test_invalid_num_decks(self):
+        with self.assertRaises(ConfigurationError):
+            BustBonusSampler(num_decks=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
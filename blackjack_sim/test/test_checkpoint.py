@@ -0,0 +1,136 @@
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+from blackjack_sim.simulation import Simulation, SimulationShard
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.checkpoint import Checkpoints
+from blackjack_sim.errors import *
+from common_test_utils import *
+from test_config import TestConfig
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    BONUS_BETS = {
+        '21_3': [{'name': '21+3', 'frequency': 'always', 'amount': 1}],
+        'bust': [{'name': 'Bust', 'frequency': 'always', 'amount': 5}]
+    }
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_sim_config(self, name, **sim_config):
+        return dict(TestConfig.simulation_config, num_sessions=2, max_session_hands=200, shard_hands=100, batch_tables=10, bonus_bets=self.BONUS_BETS,
+                    record_path=os.path.join(self.path, name, 'recording'), checkpoint_path=os.path.join(self.path, name, 'checkpoints'),
+                    checkpoint_interval=0, **sim_config)
+
+    # Runs the simulation until num_checkpoints partial checkpoints have been saved, like a run that was killed
+    def run_interrupted(self, sim_config, num_checkpoints):
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        save_partial_shard = sim.checkpoints.save_partial_shard
+        num_saved = []
+
+        def interrupted_save_partial_shard(shard, get_state):
+            save_partial_shard(shard, get_state)
+            num_saved.append(1)
+
+            if len(num_saved) == num_checkpoints:
+                raise Interrupted()
+
+        sim.checkpoints.save_partial_shard = interrupted_save_partial_shard
+
+        with self.assertRaises(Interrupted):
+            sim.run()
+
+        return sim
+
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='object', infinite_deck=1, rng='random'),
+        dict(engine='batch'),
+        dict(engine='batch', infinite_deck=1)
+    ])
+    def test_resume_matches_uninterrupted_run(self, **sim_config):
+        if sim_config['engine'] == 'batch' and not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sim = Simulation(0, self.get_sim_config('full', seed=11, **sim_config), TestConfig.strategy_config)
+        sim.run()
+
+        # Stop part way through the second shard; the first shard's result is loaded back as is
+        resumed_config = self.get_sim_config('resumed', **sim_config)
+        interrupted_sim = self.run_interrupted(dict(resumed_config, seed=11), num_checkpoints=14 if sim_config['engine'] == 'batch' else 150)
+        shard = SimulationShard(session_idx=0, shard_idx=1, first_hand=100, num_hands=100)
+
+        assert interrupted_sim.checkpoints.load_shard(shard)[0] == Checkpoints.PARTIAL
+
+        # The seed comes from the checkpoint
+        resumed_sim = Simulation(0, dict(resumed_config, resume=1), TestConfig.strategy_config)
+        assert resumed_sim.seed == 11
+        resumed_sim.run()
+
+        assert resumed_sim.num_hands_played == sim.num_hands_played == 400
+        assert resumed_sim.num_shoes_used == sim.num_shoes_used
+        assert resumed_sim.bonus_counts_21_3.counts == sim.bonus_counts_21_3.counts
+        assert resumed_sim.bonus_counts_bust.counts == sim.bonus_counts_bust.counts
+
+        for session, resumed_session in zip(sim.sessions, resumed_sim.sessions):
+            for player, resumed_player in zip(session.players, resumed_session.players):
+                assert resumed_player.get_gameplay_result_str(min_bet=sim.min_bet) == player.get_gameplay_result_str(min_bet=sim.min_bet)
+                assert resumed_player.round_stats.mean == player.round_stats.mean
+
+        for part in sorted(os.listdir(sim.record_path)):
+            files = sorted(os.listdir(os.path.join(sim.record_path, part)))
+            match, mismatch, errors = filecmp.cmpfiles(os.path.join(sim.record_path, part), os.path.join(resumed_sim.record_path, part), files, shallow=False)
+
+            assert match == files, mismatch + errors
+
+    def test_resume_with_other_settings(self):
+        sim_config = self.get_sim_config('run', seed=5, engine='object')
+        self.run_interrupted(sim_config, num_checkpoints=10)
+
+        sim = Simulation(0, dict(sim_config, resume=1, max_session_hands=400), TestConfig.strategy_config)
+
+        with self.assertRaises(ConfigurationError):
+            sim.start_checkpoints()
+
+        # Settings that don't change the results may
+        Simulation(0, dict(sim_config, resume=1, workers=2, checkpoint_interval=60), TestConfig.strategy_config).start_checkpoints()
+
+    # A run killed while writing a checkpoint leaves its temp file behind
+    def test_resume_removes_temp_files(self):
+        sim_config = self.get_sim_config('run', seed=5, engine='object')
+        sim = self.run_interrupted(sim_config, num_checkpoints=10)
+        names = sorted(os.listdir(sim.checkpoints.path))
+
+        fd, temp_path = tempfile.mkstemp(dir=sim.checkpoints.path, prefix=Checkpoints.TEMP_FILE_PREFIX)
+        os.close(fd)
+
+        Simulation(0, dict(sim_config, resume=1), TestConfig.strategy_config).start_checkpoints()
+
+        assert sorted(os.listdir(sim.checkpoints.path)) == names
+
+    def test_new_run_clears_checkpoints(self):
+        sim_config = self.get_sim_config('run', seed=5, engine='object')
+        sim = self.run_interrupted(sim_config, num_checkpoints=10)
+        shard = SimulationShard(session_idx=0, shard_idx=0, first_hand=0, num_hands=100)
+
+        assert sim.checkpoints.load_shard(shard)[0] == Checkpoints.PARTIAL
+
+        Simulation(0, sim_config, TestConfig.strategy_config).start_checkpoints()
+
+        assert sim.checkpoints.load_shard(shard) is None
+        assert [name for name in os.listdir(sim.checkpoints.path)] == [Checkpoints.RUN_FILE_NAME]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.differential import DifferentialHarness
+from blackjack_sim.recording import RoundRecording
+from blackjack_sim.errors import *
+from common_test_utils import *
+from test_config import TestConfig
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIM_CONFIG_FILE_PATH = os.path.join(ROOT_PATH, 'blackjack_sim', 'config', 'simulation_config.json')
+GOLDEN_HASHES_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_round_hashes.json')
+
+# Every sample simulation is hashed with this seed and # of hands
+GOLDEN_SEED = 2024
+GOLDEN_HANDS = 500
+
+
+def load_json_file(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Key = name of a sample simulation, value = harness that plays it with the golden seed and # of hands
+def get_golden_harnesses():
+    harnesses = {}
+    for sim_config in load_json_file(SIM_CONFIG_FILE_PATH):
+        strategy_config = load_json_file(os.path.join(ROOT_PATH, sim_config['strategy_config_file']))
+        harnesses[sim_config['name']] = DifferentialHarness(dict(sim_config, seed=GOLDEN_SEED, max_session_hands=GOLDEN_HANDS), strategy_config)
+
+    return harnesses
+
+
+# Run this file with --update-golden to store new hashes after a change that's meant to change how rounds are played
+def update_golden_hashes():
+    hashes = {name: harness.get_engine_hash(DifferentialHarness.REFERENCE_ENGINE) for name, harness in get_golden_harnesses().items()}
+
+    with open(GOLDEN_HASHES_FILE_PATH, 'w') as f:
+        json.dump({'seed': GOLDEN_SEED, 'max_session_hands': GOLDEN_HANDS, 'hashes': hashes}, f, indent=2)
+        f.write('\n')
+
+
+class TestDifferentialHarness(unittest.TestCase):
+
+    BONUS_BETS = {
+        '21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1},
+        'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 5}
+    }
+
+    def setUp(self):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_harness(self, **sim_config):
+        return DifferentialHarness(dict(TestConfig.simulation_config, seed=7, max_session_hands=1000, shard_hands=500, split_limit=TestConfig.SPLIT_LIMIT,
+                                        bonus_bets=self.BONUS_BETS, **sim_config), TestConfig.strategy_config, path=self.path)
+
+    @sub_test([
+        dict(),
+        dict(num_decks=6, blackjack_payout=1.2)
+    ])
+    def test_engines_play_the_same_rounds(self, **sim_config):
+        assert self.get_harness(**sim_config).compare('batch') is None
+
+    def test_first_divergent_round(self):
+        harness = self.get_harness()
+        assert harness.compare('batch') is None
+
+        # Double a hand of the second part of the batch engine's recording, and a later one
+        batch_part_path = os.path.join(self.path, 'batch', 'part-00000-000001')
+        reference = RoundRecording(os.path.join(self.path, 'object'))
+        num_rounds, columns = reference.get_columns(1)
+        hand_idx = int(np.flatnonzero((columns['doubled'] == 0) & (columns['blackjack'] == 0))[100])
+
+        bets = np.memmap(os.path.join(batch_part_path, 'bet.bin'), dtype=columns['bet'].dtype, mode='r+')
+        bets[[hand_idx, hand_idx + 50]] *= 2
+        bets.flush()
+        del bets
+
+        doubled = np.memmap(os.path.join(batch_part_path, 'doubled.bin'), dtype=columns['doubled'].dtype, mode='r+')
+        doubled[[hand_idx, hand_idx + 50]] = 1
+        doubled.flush()
+        del doubled
+
+        divergence = harness.compare_recordings(reference, RoundRecording(os.path.join(self.path, 'batch')), 'batch')
+
+        # Round of the hand: the first seat after it in the cumulative # of hands
+        seat_idx = int(np.searchsorted(np.cumsum(columns['num_hands']), hand_idx, side='right'))
+        num_players = reference.num_players
+
+        assert divergence.part_name == 'part-00000-000001'
+        assert divergence.part_round_idx == seat_idx // num_players
+        assert divergence.round_idx == 500 + seat_idx // num_players
+        hand_name = divergence.differences[0][:-len(' bet')]
+        assert hand_name.startswith(f'seat {seat_idx % num_players + 1} hand ')
+        assert divergence.differences == [f'{hand_name} bet', f'{hand_name} doubled']
+
+        lines = divergence.get_report_lines()
+        assert lines[0].startswith('batch engine diverges from the object engine at round')
+        assert lines.count('object:') == lines.count('batch:') == 1
+        reference_lines, engine_lines = lines[:lines.index('batch:')], lines[lines.index('batch:'):]
+        assert sum('actions: double' in line for line in engine_lines) == sum('actions: double' in line for line in reference_lines) + 1
+
+    def test_missing_rounds(self):
+        harness = self.get_harness()
+        harness.compare('batch')
+        shutil.rmtree(os.path.join(self.path, 'batch', 'part-00000-000001'))
+
+        divergence = harness.compare_recordings(RoundRecording(os.path.join(self.path, 'object')), RoundRecording(os.path.join(self.path, 'batch')), 'batch')
+
+        assert divergence.round_idx == 500
+        assert divergence.engine_round is None
+        assert divergence.differences == ['round played']
+        assert divergence.get_report_lines()[-1] == '  (not played)'
+
+    # A crash of either engine is raised, not reported as rounds it didn't play
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_engine_crash(self, engine):
+        harness = self.get_harness()
+        error = GameplayError(f'{engine} engine crashed')
+
+        with self.assertRaises(GameplayError) as context:
+            with mock.patch.object(Simulation if engine == 'object' else BatchTables, 'play_round', side_effect=error):
+                harness.compare('batch')
+
+        assert context.exception is error
+
+    # Both engines still play the sample simulations exactly as they did when the hashes were stored
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_golden_round_hashes(self, engine):
+        golden = load_json_file(GOLDEN_HASHES_FILE_PATH)
+        assert (golden['seed'], golden['max_session_hands']) == (GOLDEN_SEED, GOLDEN_HANDS)
+
+        harnesses = get_golden_harnesses()
+        assert sorted(harnesses) == sorted(golden['hashes'])
+
+        for name, harness in harnesses.items():
+            self.assertEqual(harness.get_engine_hash(engine), golden['hashes'][name], name)
+
+
+if __name__ == '__main__':
+    if '--update-golden' in sys.argv:
+        update_golden_hashes()
+    else:
+        unittest.main()
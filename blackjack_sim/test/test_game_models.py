@@ -1,6 +1,11 @@
+import copy
+import pickle
 import unittest
 import time
 from blackjack_sim.game_models import *
+from blackjack_sim.rng import RandomStream, np
+from blackjack_sim.shoe_prefetch import ShoePrefetcher
+from common_test_utils import *
 
 
 class TestGameModels(unittest.TestCase):
@@ -11,11 +16,237 @@ class TestGameModels(unittest.TestCase):
 
         shoe = shoe_factory.get_shoe()
 
-        print(' '.join(c.rank for c in shoe))
+        print(' '.join(Card.to_str(c) for c in shoe))
 
         assert shoe
         assert len(shoe) == num_decks * len(Card.CARD_RANKS) * len(Card.CARD_SUITS)
 
+    def test_card_encoding(self):
+        for suit in Card.CARD_SUITS:
+            for rank in Card.CARD_RANKS:
+                card = Card(suit, rank)
+
+                assert 0 <= card < Card.NUM_CARDS
+                assert card.suit == suit
+                assert card.rank == rank
+                assert Card.to_str(int(card)) == rank
+
+        assert Card.VALUES[Card('H', 'A')] == 1
+        assert Card.VALUES[Card('S', 'Q')] == 10
+        assert Card.VALUES[Card('D', '7')] == 7
+        assert Card.DEALER_UP_CARD_INDEXES[Card('C', 'J')] == Card.CARD_STRATEGY_RANK_LOOKUP['T']
+        assert Card.DEALER_UP_CARD_INDEXES[Card('C', '2')] == 0
+
+        # Shoes hold the plain int codes
+        shoe = ShoeFactory(1).get_shoe()
+        assert sorted(shoe) == list(range(Card.NUM_CARDS))
+
+    @sub_test([
+        dict(copier=lambda card: pickle.loads(pickle.dumps(card))),
+        dict(copier=copy.copy),
+        dict(copier=copy.deepcopy)
+    ])
+    def test_card_copy(self, copier):
+        card = Card('H', 'A')
+        card_copy = copier(card)
+
+        assert type(card_copy) is Card
+        assert card_copy == card
+        assert (card_copy.suit, card_copy.rank) == ('H', 'A')
+
+    # Values kept up to date card by card must match recalculating them from scratch
+    def test_incremental_hand_value(self):
+        shoe = ShoeFactory(1, rng=RandomStream.create(seed=3)).get_shoe()
+
+        hand = BlackjackHand(player=None, dealer_hand=True)
+        while shoe.remaining():
+            if hand.hard_value >= 21:
+                hand.reset(player=None, dealer_hand=True)
+
+            hand.add_card(shoe.deal())
+            values = (hand.hard_value, hand.soft_value, hand.contains_ace, hand.is_blackjack)
+
+            hand.calculate_value()
+            assert values == (hand.hard_value, hand.soft_value, hand.contains_ace, hand.is_blackjack)
+
+    def test_hand_pool(self):
+        pool = BlackjackHandPool()
+        player = BlackjackPlayer(idx=0, buyin=100)
+
+        for r in range(3):
+            pool.release_all()
+
+            hand = pool.acquire(player=player, dealer_hand=False, bet=15)
+            hand.add_card(Card('C', '8'))
+            hand.add_card(Card('D', '8'))
+
+            new_hand = hand.split_hand(new_hand=pool.acquire(player=player, dealer_hand=False))
+
+            assert hand.hard_value == 8
+            assert new_hand.hard_value == 8
+            assert new_hand.player is player
+            assert hand.bet == 15
+
+        # Hands were reused rather than allocated every round
+        assert pool.get_num_allocated() == 2
+
+    def test_shoe(self):
+        shoe = Shoe(list(range(10)), cut_card_position=6)
+
+        assert shoe.size() == 10
+        assert shoe.remaining() == 10
+        assert shoe.deal() == 0
+        assert list(shoe.deal_many(4)) == [1, 2, 3, 4]
+        assert shoe.remaining() == 5
+        assert shoe.penetration() == 0.5
+
+        shoe.deal()
+        assert not shoe.is_cut_card_reached()
+
+        shoe.deal()
+        assert shoe.is_cut_card_reached()
+
+        with self.assertRaises(GameplayError):
+            shoe.deal_many(4)
+
+        assert list(shoe.deal_many(3)) == [7, 8, 9]
+
+        with self.assertRaises(GameplayError):
+            shoe.deal()
+
+    def test_shoe_factory_batch(self):
+        num_decks = 2
+        num_shoes = 5
+        shoe_factory = ShoeFactory(num_decks, rng=RandomStream.create(seed=42))
+
+        shoes = shoe_factory.get_shoe_batch(num_shoes)
+
+        assert len(shoes) == num_shoes
+
+        master = sorted(list(range(Card.NUM_CARDS)) * num_decks)
+        for shoe in shoes:
+            assert sorted(int(c) for c in shoe) == master
+
+        # Shoes in a batch are shuffled independently
+        assert list(shoes[0]) != list(shoes[1])
+
+        # Same random stream, same shoes
+        same_shoes = ShoeFactory(num_decks, rng=RandomStream.create(seed=42)).get_shoe_batch(num_shoes)
+        assert [list(s) for s in shoes] == [list(s) for s in same_shoes]
+
+    # Prefetched batches must be the same shoes the factory would have shuffled, whether or not the buffer ran dry
+    def test_shoe_prefetcher(self):
+        num_decks = 2
+        batch_size = 3
+        num_batches = 12
+
+        expected_factory = ShoeFactory(num_decks, rng=RandomStream.create(seed=11))
+        expected = [[list(s) for s in expected_factory.get_shoe_batch(batch_size)] for b in range(num_batches)]
+
+        with ShoePrefetcher(ShoeFactory(num_decks, rng=RandomStream.create(seed=11)), batch_size, num_producers=2, num_slots=2) as prefetcher:
+            for b in range(num_batches):
+                shoes = prefetcher.get_shoe_batch(batch_size)
+
+                assert [list(Shoe(s)) for s in shoes] == expected[b]
+
+                if b % 4 == 0:
+                    time.sleep(0.05)
+
+            assert prefetcher.num_batches == num_batches
+
+            print(f'Prefetch stalls: {prefetcher.num_stalls} of {prefetcher.num_batches}')
+
+    @sub_test([
+        dict(backend='random'),
+        dict(backend='pcg64'),
+        dict(backend='philox')
+    ])
+    def test_random_stream(self, backend):
+        if backend != 'random' and np is None:
+            self.skipTest('NumPy is not installed')
+
+        stream = RandomStream.create(backend=backend, seed=7)
+
+        assert stream.backend == backend
+
+        # Child streams are reproducible and independent of each other
+        child_values = [stream.spawn(0, 1).randint(0, 10 ** 9) for i in range(2)]
+        assert child_values[0] == child_values[1]
+        assert stream.spawn(0, 1).randint(0, 10 ** 9) != stream.spawn(0, 2).randint(0, 10 ** 9)
+        assert stream.spawn(0).spawn(1).randint(0, 10 ** 9) == child_values[0]
+
+        cards = list(range(Card.NUM_CARDS))
+        batch = stream.spawn(3).shuffled_batch(cards, 2)
+        assert len(batch) == 2
+        assert sorted(int(c) for c in batch[1]) == cards
+
+    @sub_test([
+        dict(backend='random'),
+        dict(backend='pcg64')
+    ])
+    def test_infinite_shoe_card_frequencies(self, backend):
+        if backend != 'random' and np is None:
+            self.skipTest('NumPy is not installed')
+
+        shoe_factory = InfiniteShoeFactory(6, rng=RandomStream.create(backend=backend, seed=11))
+        cards = [int(c) for shoe in shoe_factory.get_shoe_batch(64) for c in shoe]
+
+        # Every card code within ~5 standard errors of 1 in 52
+        p = 1 / Card.NUM_CARDS
+        for code in range(Card.NUM_CARDS):
+            assert abs(cards.count(code) / len(cards) - p) <= 5 * (p * (1 - p) / len(cards)) ** 0.5
+
+    def test_infinite_shoe(self):
+        num_decks = 2
+        shoe_factory = InfiniteShoeFactory(num_decks, rng=RandomStream.create(seed=3))
+
+        shoe_size = shoe_factory.get_shoe_size()
+        assert shoe_size == num_decks * Card.NUM_CARDS
+
+        shoe = shoe_factory.get_shoe()
+
+        # Deals past the end of any finite shoe without reaching a cut card
+        cards = [shoe.deal() for c in range(3 * shoe_size)] + list(shoe.deal_many(shoe_size + 5))
+        assert len(cards) == 4 * shoe_size + 5
+        assert all(0 <= c < Card.NUM_CARDS for c in cards)
+        assert not shoe.is_cut_card_reached()
+        assert shoe.remaining() > shoe_size
+
+        # Drawn with replacement, so a shoe's worth of cards is not a permutation of the shoe
+        batch = shoe_factory.shuffle_batch(0, 3)
+        assert len(batch) == 3
+        assert any(sorted(int(c) for c in shoe) != sorted(list(range(Card.NUM_CARDS)) * num_decks) for shoe in batch)
+
+    def test_random_stream_unknown_backend(self):
+        with self.assertRaises(ConfigurationError):
+            RandomStream.create(backend='mt19937')
+
+    # Every backend draws the same kinds of values from the same seed and key every time
+    @sub_test([
+        dict(backend='random'),
+        dict(backend='pcg64'),
+        dict(backend='philox')
+    ])
+    def test_random_stream_batches(self, backend):
+        if backend != 'random' and np is None:
+            self.skipTest('NumPy is not installed')
+
+        stream = RandomStream.create(backend=backend, seed=13)
+
+        uniforms = [float(u) for u in stream.spawn(0).random_batch(1000)]
+        assert uniforms == [float(u) for u in stream.spawn(0).random_batch(1000)]
+        assert len(uniforms) == 1000
+        assert all(0 <= u < 1 for u in uniforms)
+        assert 0.4 < sum(uniforms) / len(uniforms) < 0.6
+
+        # Both ends can come up
+        assert {stream.randint(1, 3) for i in range(200)} == {1, 2, 3}
+        assert {int(n) for n in stream.randint_batch(1, 3, 200)} == {1, 2, 3}
+
+        # Every copy is shuffled on its own
+        batch = stream.spawn(1).shuffled_batch(list(range(Card.NUM_CARDS)), 3)
+        assert len({tuple(int(c) for c in shoe) for shoe in batch}) == 3
+
     def test_shoe_factory_performance(self):
         num_decks = 6
         num_shoes = 1000
@@ -35,5 +266,13 @@ class TestGameModels(unittest.TestCase):
         print(f"Got {num_shoes} shoes of {num_decks} decks in {total_time:0.4f} seconds")
         print(f"Time per shoe: {time_per_shoe:0.4f} s")
 
+        start_time = time.perf_counter()
+
+        shoes = shoe_factory.get_shoe_batch(num_shoes)
+
+        end_time = time.perf_counter()
+
+        print(f"Got batch of {len(shoes)} shoes of {num_decks} decks in {end_time - start_time:0.4f} seconds")
+
 if __name__ == '__main__':
     unittest.main()
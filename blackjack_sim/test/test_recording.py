@@ -0,0 +1,140 @@
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.recording import RoundRecorder, RoundRecording
+from blackjack_sim.bonuses import TwentyOne3BonusPayer, BustBonusPayer
+from blackjack_sim.errors import *
+from common_test_utils import *
+from test_config import TestConfig
+
+
+class TestRoundRecording(unittest.TestCase):
+
+    BONUS_BETS = {
+        '21_3': [{'name': '21+3', 'frequency': 'always', 'amount': 1}, {'name': '21+3 $5', 'frequency': 'always', 'amount': 5}],
+        'bust': [{'name': 'Bust', 'frequency': 'always', 'amount': 5}, {'name': 'Bust 6', 'frequency': 'dealer_up_card_lookup', 'dealer_up_card_lookup': {
+            'A': 0, 'K': 0, 'Q': 0, 'J': 0, 'T': 0, '9': 0, '8': 0, '7': 0, '6': 15, '5': 0, '4': 0, '3': 0, '2': 0}}]
+    }
+
+    def setUp(self):
+        if not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_simulation(self, record_path=None, **sim_config):
+        sim_config = dict(TestConfig.simulation_config, seed=2024, max_session_hands=1000, shard_hands=500, batch_tables=1,
+                          split_limit=TestConfig.SPLIT_LIMIT, bonus_bets=self.BONUS_BETS, **sim_config)
+        if record_path:
+            sim_config['record_path'] = record_path
+
+        sim = Simulation(0, sim_config, TestConfig.strategy_config)
+        sim.run()
+
+        return sim
+
+    # Split hands are counted by the final # of hands in a replay, and round stats are summed in a different order
+    def assert_results_match(self, sim, players):
+        for player, replay_player in zip(sim.sessions[0].players, players):
+            result_strs = [[line for line in p.get_gameplay_result_str(min_bet=sim.min_bet).split('\n') if not line.startswith(('Split to', 'House Edge Per Round'))]
+                           for p in [player, replay_player]]
+
+            assert result_strs[0] == result_strs[1]
+            assert replay_player.round_stats.count == player.round_stats.count
+            self.assertAlmostEqual(replay_player.round_stats.mean, player.round_stats.mean, places=9)
+            self.assertAlmostEqual(replay_player.round_stats.variance(), player.round_stats.variance(), places=6)
+
+    # A single batch table plays like the object engine, so it records exactly the same bytes
+    def test_engines_record_identically(self):
+        for engine in ['object', 'batch']:
+            self.run_simulation(record_path=os.path.join(self.path, engine), engine=engine)
+
+        parts = sorted(os.listdir(os.path.join(self.path, 'object')))
+        assert parts == [RoundRecorder.get_part_name(0, 0), RoundRecorder.get_part_name(0, 1)]
+
+        for part in parts:
+            files = sorted(os.listdir(os.path.join(self.path, 'object', part)))
+            match, mismatch, errors = filecmp.cmpfiles(os.path.join(self.path, 'object', part), os.path.join(self.path, 'batch', part), files, shallow=False)
+
+            assert match == files, mismatch + errors
+
+        recording = RoundRecording(os.path.join(self.path, 'batch'))
+        assert recording.num_rounds == 1000
+        assert recording.num_players == TestConfig.simulation_config['num_players']
+
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch'),
+        dict(engine='object', min_bet=2.5),
+        dict(engine='batch', min_bet=2.5)
+    ])
+    def test_replay_matches_simulation(self, engine, **sim_config):
+        sim = self.run_simulation(record_path=self.path, engine=engine, **sim_config)
+        players = sim.log_replay_results(self.path)
+
+        self.assert_results_match(sim, players)
+
+        for player, replay_player in zip(sim.sessions[0].players, players):
+            assert sum(player.num_split_hands_dict.values()) == sum(replay_player.num_split_hands_dict.values())
+
+    # Payouts don't change how hands are played, so a replay with other payouts gets what a simulation with them gets
+    @sub_test([
+        dict(blackjack_payout=1.2),
+        dict(bonus_payouts={'21_3': {'straight_flush': 100, 'flush': 4}, 'bust': {'suited_888': 50, 'suited': {'6': 20}, 'non-suited': {'1': 4}}})
+    ])
+    def test_replay_other_payouts(self, **payout_config):
+        self.run_simulation(record_path=self.path, engine='batch')
+
+        sim = self.run_simulation(engine='object', **payout_config)
+        players = sim.log_replay_results(self.path)
+
+        self.assert_results_match(sim, players)
+
+    def test_incomplete_parts_skipped(self):
+        self.run_simulation(record_path=self.path, engine='batch')
+        os.remove(os.path.join(self.path, RoundRecorder.get_part_name(0, 1), RoundRecorder.META_FILE_NAME))
+
+        assert RoundRecording(self.path).num_rounds == 500
+
+        with self.assertRaises(ConfigurationError):
+            RoundRecording(os.path.join(self.path, 'missing'))
+
+
+class TestBonusPayouts(unittest.TestCase):
+
+    def test_21_3_payouts(self):
+        payer = TwentyOne3BonusPayer(payouts={'straight_flush': 30, 'trips': 20})
+
+        assert payer.STRAIGHT_FLUSH_MX == 30
+        assert payer.TRIPLES_MX == 20
+        assert payer.FLUSH_MX == TwentyOne3BonusPayer.FLUSH_MX
+
+        with self.assertRaises(ConfigurationError):
+            TwentyOne3BonusPayer(payouts={'full_house': 5})
+
+    def test_bust_payouts(self):
+        payer = BustBonusPayer(payouts={'suited_888': 100, 'suited': {'1': 40}})
+
+        assert payer.SUITED_888_MX == 100
+        assert payer.MX_LOOKUP['suited'][1] == 40
+
+        # The class table is left alone
+        assert BustBonusPayer.MX_LOOKUP['suited'][1] != 40
+        assert BustBonusPayer().MX_LOOKUP['suited'][1] != 40
+
+        with self.assertRaises(ConfigurationError):
+            BustBonusPayer(payouts={'suited': {'12': 5}})
+
+        with self.assertRaises(ConfigurationError):
+            BustBonusPayer(payouts={'non_suited': {'1': 5}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from random import Random
+from statistics import mean, variance, covariance
+from blackjack_sim.stats import RunningStats, RunningCovariance, np
+from common_test_utils import *
+
+
+class TestRunningStats(unittest.TestCase):
+
+    values = [15, -15, 0, 22.5, -30, 15, -15, -15, 30, 0, -5, 75]
+
+    def test_add(self):
+        stats = RunningStats()
+        for x in self.values:
+            stats.add(x)
+
+        assert stats.count == len(self.values)
+        self.assertAlmostEqual(stats.mean, mean(self.values), places=12)
+        self.assertAlmostEqual(stats.variance(), variance(self.values), places=12)
+        self.assertAlmostEqual(stats.ci_halfwidth(), RunningStats.Z_95 * (variance(self.values) / len(self.values)) ** 0.5, places=12)
+
+    @sub_test([
+        dict(use_numpy=False),
+        dict(use_numpy=True)
+    ])
+    def test_add_batch_and_merge(self, use_numpy):
+        if use_numpy and np is None:
+            self.skipTest('NumPy is not installed')
+
+        # Same result however the values are split up
+        stats = RunningStats()
+        stats.add_batch(np.array(self.values[:5]) if use_numpy else self.values[:5])
+
+        other = RunningStats()
+        other.add_batch(np.array(self.values[5:]) if use_numpy else self.values[5:])
+        other.add_batch([])
+
+        stats.merge(other)
+        stats.merge(RunningStats())
+
+        assert stats.count == len(self.values)
+        self.assertAlmostEqual(stats.mean, mean(self.values), places=12)
+        self.assertAlmostEqual(stats.variance(), variance(self.values), places=12)
+
+    def test_no_interval_without_values(self):
+        stats = RunningStats()
+        stats.add(1)
+
+        assert stats.ci_halfwidth() == float('inf')
+
+
+class TestRunningCovariance(unittest.TestCase):
+
+    rows = [[15, 1, 0], [-15, -2, 1], [0, 0, 0], [22.5, 3, -1], [-30, -4, 2], [15, 2, 0], [-15, -1, 1], [75, 9, -3]]
+
+    @sub_test([
+        dict(use_numpy=False),
+        dict(use_numpy=True)
+    ])
+    def test_add_batch_and_merge(self, use_numpy):
+        if use_numpy and np is None:
+            self.skipTest('NumPy is not installed')
+
+        cov = RunningCovariance(3)
+        for row in self.rows[:3]:
+            cov.add(row)
+
+        other = RunningCovariance(3)
+        other.add_batch(np.array(self.rows[3:]) if use_numpy else self.rows[3:])
+
+        cov.merge(other)
+        cov.merge(RunningCovariance(3))
+
+        columns = list(zip(*self.rows))
+
+        assert cov.count == len(self.rows)
+        for i in range(3):
+            self.assertAlmostEqual(cov.means[i], mean(columns[i]), places=12)
+            for j in range(3):
+                self.assertAlmostEqual(cov.comoments[i][j] / (cov.count - 1), covariance(columns[i], columns[j]), places=10)
+
+    # y = 3 + 2x + noise where x has a known mean of 0; the controlled estimate is far tighter than the plain mean
+    def test_control_variate_estimate(self):
+        rng = Random(5)
+
+        cov = RunningCovariance(2)
+        for i in range(2000):
+            x = rng.gauss(0, 1)
+            cov.add([3 + 2 * x + rng.gauss(0, 0.5), x])
+
+        estimate, std_error, variance_reduction = cov.get_control_variate_estimate()
+
+        assert abs(estimate - 3) < 4 * std_error
+        assert std_error < 0.5 / 2000 ** 0.5 * 1.2
+        assert variance_reduction > 10
+
+    # Controls that never vary are left out
+    def test_constant_control(self):
+        cov = RunningCovariance(2)
+        for row in [[1, 0], [3, 0], [2, 0]]:
+            cov.add(row)
+
+        estimate, std_error, variance_reduction = cov.get_control_variate_estimate()
+
+        self.assertAlmostEqual(estimate, 2, places=12)
+        self.assertAlmostEqual(std_error, (1 / 3) ** 0.5, places=12)
+        assert variance_reduction == 1.0
+
+
+if __name__ == '__main__':
+    unittest.main()
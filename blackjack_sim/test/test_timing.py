@@ -0,0 +1,86 @@
+import unittest
+from blackjack_sim.simulation import Simulation
+from blackjack_sim.batch_engine import BatchTables
+from blackjack_sim.timing import PhaseTimers
+from blackjack_sim.strategy import Strategy
+from common_test_utils import *
+from test_config import TestConfig
+
+
+class TestPhaseTimers(unittest.TestCase):
+
+    BONUS_BETS = {
+        '21_3': {'name': '21+3', 'frequency': 'always', 'amount': 1},
+        'bust': {'name': 'Bust', 'frequency': 'always', 'amount': 1}
+    }
+
+    def run_simulation(self, **sim_config):
+        sim = Simulation(0, dict(TestConfig.simulation_config, seed=3, max_session_hands=1000, shard_hands=500, batch_tables=20,
+                                 bonus_bets=self.BONUS_BETS, **sim_config), TestConfig.strategy_config)
+        sim.run()
+
+        return sim
+
+    def test_wrap(self):
+        timers = PhaseTimers()
+        double = timers.wrap(lambda x: 2 * x, PhaseTimers.DEAL)
+
+        assert double(2) == 4
+        assert double(3) == 6
+        assert timers.counts[PhaseTimers.DEAL] == 2
+        assert timers.times[PhaseTimers.DEAL] > 0
+
+        timers.add_rounds(10, 0.5)
+        popped = timers.pop()
+
+        assert popped.counts[PhaseTimers.DEAL] == 2
+        assert popped.get_hands_per_sec() == 20
+        assert popped.get_us_per_round() == 50000
+        assert timers.counts[PhaseTimers.DEAL] == 0 and timers.num_rounds == 0
+
+        # Wrappers made before the pop keep adding to the same timers
+        double(1)
+        assert timers.counts[PhaseTimers.DEAL] == 1
+
+    # Timing doesn't change how anything is played, and a simulation that isn't timed isn't instrumented at all
+    @sub_test([
+        dict(engine='object'),
+        dict(engine='batch')
+    ])
+    def test_timed_simulation(self, engine):
+        if engine == 'batch' and not BatchTables.AVAILABLE:
+            self.skipTest('NumPy is not installed')
+
+        sim = self.run_simulation(engine=engine)
+        timed_sim = self.run_simulation(engine=engine, phase_timing=1)
+
+        assert sim.phase_timers is None and sim.total_phase_timers is None
+        assert not {'play_player_hand', 'next_shoe_cards'} & set(vars(sim))
+        assert 'get_payout' not in vars(sim.bonus_payer_bust)
+
+        for player, timed_player in zip(sim.sessions[0].players, timed_sim.sessions[0].players):
+            assert timed_player.get_gameplay_result_str(min_bet=sim.min_bet) == player.get_gameplay_result_str(min_bet=sim.min_bet)
+
+        timers = timed_sim.total_phase_timers
+        assert timers.num_rounds == 1000
+        assert timers.round_time > 0
+
+        timed_phases = [phase for phase in PhaseTimers.PHASES if timers.counts[phase]]
+        assert timed_phases == (PhaseTimers.PHASES if engine == 'object' else [p for p in PhaseTimers.PHASES if p != PhaseTimers.STRATEGY])
+        assert len(timers.get_report_lines()) == len(timed_phases) + 1
+
+        if engine == 'object':
+            assert timers.counts[PhaseTimers.DEAL] == 1000
+            assert timers.counts[PhaseTimers.SHOE] == timed_sim.num_shoes_used
+
+    # A compiled strategy may be shared with other simulations, so it isn't timed itself
+    def test_shared_strategy_not_timed(self):
+        strategy = Strategy(TestConfig.strategy_config)
+        shared_sim = Simulation(0, dict(TestConfig.simulation_config, phase_timing=1), strategy)
+
+        assert 'determine_player_action_code' in vars(shared_sim.strategy)
+        assert 'determine_player_action_code' not in vars(strategy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import time
+from functools import wraps
+
+
+class PhaseTimers(object):
+
+    """
+    Time and # of calls spent in each phase of playing rounds, plus the time and # of rounds of the shards' round loops
+    for hands/sec and µs per round. A phase is timed by replacing methods of an engine instance with timed wrappers
+    (instrument()), so an engine that isn't instrumented runs exactly the code it always did and timing costs nothing
+    when it's off.
+
+    Phases are timed where they're called, so they can nest: strategy lookups are part of player play, and the shoe
+    batches that an infinite deck refills from mid-round are part of whichever phase drew the card.
+    """
+
+    SHOE = 'shoe'
+    DEAL = 'deal'
+    STRATEGY = 'strategy'
+    PLAYER = 'player'
+    DEALER = 'dealer'
+    SETTLE = 'settle'
+    BONUS = 'bonus'
+
+    PHASES = [SHOE, DEAL, STRATEGY, PLAYER, DEALER, SETTLE, BONUS]
+
+    PHASE_NAMES = {
+        SHOE: 'Shoe generation',
+        DEAL: 'Dealing',
+        STRATEGY: 'Strategy lookup',
+        PLAYER: 'Player play',
+        DEALER: 'Dealer play',
+        SETTLE: 'Settlement',
+        BONUS: 'Bonus payout'
+    }
+
+    def __init__(self):
+        self.times = {phase: 0.0 for phase in self.PHASES}
+        self.counts = {phase: 0 for phase in self.PHASES}
+
+        self.round_time = 0.0
+        self.num_rounds = 0
+
+    # Replaces obj.method_name (an instance's own attribute from then on) with a wrapper that times it as phase
+    def instrument(self, obj, method_name, phase):
+        setattr(obj, method_name, self.wrap(getattr(obj, method_name), phase))
+
+    def wrap(self, func, phase):
+        times = self.times
+        counts = self.counts
+        perf_counter = time.perf_counter
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[phase] += perf_counter() - start
+                counts[phase] += 1
+
+        return timed
+
+    def add_rounds(self, num_rounds, round_time):
+        self.num_rounds += num_rounds
+        self.round_time += round_time
+
+    # Moves the timings into a new PhaseTimers and starts over; wrappers keep adding to this one
+    def pop(self):
+        timers = PhaseTimers()
+        timers.merge(self)
+
+        for phase in self.PHASES:
+            self.times[phase] = 0.0
+            self.counts[phase] = 0
+
+        self.round_time = 0.0
+        self.num_rounds = 0
+
+        return timers
+
+    def merge(self, other):
+        for phase in self.PHASES:
+            self.times[phase] += other.times[phase]
+            self.counts[phase] += other.counts[phase]
+
+        self.round_time += other.round_time
+        self.num_rounds += other.num_rounds
+
+    def get_hands_per_sec(self):
+        return self.num_rounds / self.round_time if self.round_time else 0
+
+    def get_us_per_round(self):
+        return self.round_time / self.num_rounds * 1e6 if self.num_rounds else 0
+
+    # One line per phase that was timed, then the totals
+    def get_report_lines(self):
+        lines = []
+        for phase in self.PHASES:
+            if not self.counts[phase]:
+                continue
+
+            phase_time = self.times[phase]
+            lines.append(f'{self.PHASE_NAMES[phase]}: {phase_time:0.4f} s ({round(100 * phase_time / self.round_time, 1) if self.round_time else 0}%), '
+                         f'{self.counts[phase]} calls, {round(phase_time / self.counts[phase] * 1e6, 3)} µs per call, '
+                         f'{round(phase_time / self.num_rounds * 1e6, 3) if self.num_rounds else 0} µs per round')
+
+        lines.append(f'Rounds: {self.num_rounds} in {self.round_time:0.4f} s, {round(self.get_hands_per_sec())} hands/sec, '
+                     f'{round(self.get_us_per_round(), 3)} µs per round')
+
+        return lines
@@ -9,9 +9,14 @@ class Utils(object):
         log = logging.getLogger(name)
         log.setLevel(log_level)
 
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(log_level)
-        log.addHandler(handler)
+        # Loggers are global by name; only attach a handler the first time so that recreating a
+        # Simulation (e.g. in a worker process) doesn't duplicate every line.
+        if not log.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            log.addHandler(handler)
+
+        for handler in log.handlers:
+            handler.setLevel(log_level)
 
         return log
     